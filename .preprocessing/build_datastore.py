@@ -0,0 +1,70 @@
+# !/usr/bin/python3
+
+# Copy the per-experiment parquet files of ../data into the partitioned store
+# (../data/store) read by the pages through utils/datastore.py
+#
+# The angles of the polar plot of the melting dates (melting_angle) are computed
+# from the melting dates, for the period and the years kept (MELTYEARS) of
+# Configuration.ini: run it again when they change.
+
+import os
+import re
+import sys
+import pandas as pd
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import datastore
+from utils import snowmelt
+from utils import stationindex
+
+#============================ CONFIGURATION
+#
+dirdata      = "../data"
+
+# name of the legacy files
+pattern_count = re.compile(r"count_nbstation_assim_(?P<namevar>[A-Z]+)_(?P<nameexp>\w+?)_(?P<namersas>RSAS\w*?)_(?P<year>\d{4})\.parquet$")
+pattern_melt  = re.compile(r"melting_date_stat_domain_(?P<domain>lat\d+to\d+_lon\d+to\d+)(_(?P<nameexp>\w+))?\.parquet$")
+pattern_prcp  = re.compile(r"yearly_prcp_domain_(?P<domain>lat\d+to\d+_lon\d+to\d+)_(?P<nameexp>\w+)\.parquet$")
+
+#============================= FUNCTIONS
+#%% function to find the dataset and the partition of a legacy file
+def parse_filename(filename):
+    match = pattern_count.match(filename)
+    if match:
+        return('count_nbstation', {'namevar': match['namevar'], 'nameexp': match['nameexp'], 'year': int(match['year'])})
+
+    match = pattern_melt.match(filename)
+    if match:
+        # the melting dates of CaPA V2.1 have no experiment suffix
+        return('melting_date', {'domain': match['domain'], 'nameexp': match['nameexp'] or "v21"})
+
+    match = pattern_prcp.match(filename)
+    if match:
+        nameexp = "v21" if match['nameexp'] == "V2P1" else match['nameexp']
+        return('yearly_prcp', {'domain': match['domain'], 'nameexp': nameexp})
+
+    return(None, None)
+
+#============================= MAIN
+def main():
+    filenames = sorted(filename for filename in os.listdir(dirdata) if filename.endswith(".parquet"))
+
+    for filename in tqdm(filenames, desc="Writing partitions"):
+        namedataset, keys = parse_filename(filename)
+        if namedataset is None:
+            print(f"File {filename} skipped")
+            continue
+
+        data = pd.read_parquet(os.path.join(dirdata, filename))
+        if namedataset == "count_nbstation":
+            # the station counts are written with their spatial index
+            stationindex.write_counts(data, **keys)
+        elif namedataset == "melting_date":
+            # the melting dates are written with their angles
+            snowmelt.write_melt(data, **keys)
+        else:
+            datastore.write_partition(namedataset, data, **keys)
+
+if __name__ == "__main__":
+    main()
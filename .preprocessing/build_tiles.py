@@ -0,0 +1,24 @@
+# !/usr/bin/python3
+
+# Cut the figures of ../figures into the multi-resolution tiles read by the
+# PICIC-PRISM page (otherwise they are built on the first view of each figure)
+
+import os
+import sys
+import glob
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import imagepyramid
+
+#============================ CONFIGURATION
+#
+dirfigures = "../figures"
+
+#============================= MAIN
+def main():
+    for image_name in tqdm(sorted(glob.glob(f"{dirfigures}/*.png")), desc="Building tiles"):
+        imagepyramid.open_pyramid(image_name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# !/usr/bin/python3
+
+# Export the figures of the pages for every configuration of Configuration.ini,
+# without Streamlit, into ../figures/export with an index (index.html, index.json)
+#
+#   stations_{namevar}_{nameexp}_{year}.png     annual cycle of the assimilated stations
+#   stations_{namevar}_{nameexp}_{year}.html    map of the stations
+#   melt_{namedomain}.png                       melting dates of the experiments over the domain
+#   prcp_{namedomain}.png                       yearly precipitation over the domain
+#
+# The figures are rendered by a pool of processes; every process sets matplotlib
+# up and loads the base maps of the domains once. A figure whose data files did
+# not change since the last export is kept (--force renders everything again).
+
+import os
+import sys
+import json
+import html
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import datastore
+from utils import figcache
+from utils import registry
+
+#============================ CONFIGURATION
+#
+direxport    = "../figures/export"
+nameindex    = "index.json"
+
+#============================= FUNCTIONS
+#%% function to set a worker up: non interactive backend and base maps of the domains in memory
+def init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+    from utils import basemap
+    from utils import snowmelt
+    for domain in registry.get_registry().domains.values():
+        basemap.load_basemap(tuple(snowmelt.map_extent(domain)))
+
+#%% function to list the figures of every configuration: (name of the figure, kind, arguments, data files)
+# the station counts of the store are exported for the experiments, years and variables of Configuration.ini only
+def list_jobs(config):
+    jobs   = []
+    combos = [(namevar, nameexp, year) for nameexp, experiment in config.experiments.items() for year in experiment.years
+              for namevar in config.namevars]
+    for namevar, nameexp, year in combos:
+        if not config.has_counts(namevar, nameexp, year):
+            continue
+        sources = [datastore.partition_dir(namedataset, namevar=namevar, nameexp=nameexp, year=year)
+                   for namedataset in ("count_nbstation", "count_nbstation_index")]
+        jobs.append((f"stations_{namevar}_{nameexp}_{year}", "stations", (namevar, nameexp, year), sources))
+
+    for namedomain, domain in config.domains.items():
+        key = datastore.domain_key(domain)
+        if config.experiments_with_melt(domain):
+            jobs.append((f"melt_{namedomain}", "melt", (namedomain,), [datastore.partition_dir("melting_angle", domain=key)]))
+        if config.experiments_with_prcp(domain):
+            jobs.append((f"prcp_{namedomain}", "prcp", (namedomain,), [datastore.partition_dir("yearly_prcp", domain=key)]))
+
+    return(jobs)
+
+#%% function to get the version of the data files of a figure
+def job_version(sources):
+    return(hashlib.sha1(repr(figcache.data_version(sources)).encode()).hexdigest())
+
+#%% function to render one figure (in a worker), returns the files written
+def render_job(job, dpi):
+    import matplotlib.pyplot as plt
+    from utils import snowmelt
+    from utils import stationindex
+    from utils import stations
+
+    namefig, kind, arguments, sources = job
+    config = registry.get_registry()
+    files  = [f"{namefig}.png"]
+
+    if kind == "stations":
+        namevar, nameexp, year = arguments
+        data, monthval = stationindex.query_region(namevar, nameexp, year)
+        fig            = stations.plot_annual_cycle(monthval, year, namevar)
+        stations.build_station_map(data).save(os.path.join(direxport, f"{namefig}.html"))
+        files.append(f"{namefig}.html")
+    elif kind == "melt":
+        domain   = config.domains[arguments[0]]
+        nameexps = [nameexp for nameexp in snowmelt.meltexps if nameexp in config.experiments_with_melt(domain)]
+        data     = datastore.query("melting_angle", domain=datastore.domain_key(domain), nameexp=nameexps)
+        fig      = snowmelt.plot_melt_domain(domain, data)
+    else:
+        domain   = config.domains[arguments[0]]
+        nameexps = [nameexp for nameexp in snowmelt.prcpexps if nameexp in config.experiments_with_prcp(domain)]
+        data     = datastore.query("yearly_prcp", domain=datastore.domain_key(domain), nameexp=nameexps)
+        fig      = snowmelt.plot_prcp_domain(data)
+
+    fig.savefig(os.path.join(direxport, f"{namefig}.png"), dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+
+    return(files)
+
+#%% function to write the index of the exported figures
+def write_index(index):
+    namefiletmp = os.path.join(direxport, f"{nameindex}.{os.getpid()}.tmp")
+    with open(namefiletmp, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(namefiletmp, os.path.join(direxport, nameindex))
+
+    sections = {"stations": "Assimilated stations", "melt": "Melting snow dates", "prcp": "Yearly precipitation"}
+    lines    = ["<html><head><meta charset='utf-8'><title>RDRS figures</title></head><body>"]
+    for kind, title in sections.items():
+        lines.append(f"<h2>{title}</h2>")
+        for namefig, entry in sorted(index.items()):
+            if entry['kind'] != kind:
+                continue
+            label = html.escape(" ".join(str(x) for x in entry['arguments']))
+            lines.append(f"<h4>{label}</h4>")
+            for filename in entry['files']:
+                if filename.endswith(".png"):
+                    lines.append(f"<img src='{filename}' style='max-width:900px'>")
+                else:
+                    lines.append(f"<a href='{filename}'>map</a>")
+    lines.append("</body></html>")
+
+    with open(os.path.join(direxport, "index.html"), "w") as f:
+        f.write("\n".join(lines))
+
+#============================= MAIN
+def main():
+    parser = argparse.ArgumentParser(description="Export the figures of the pages for every configuration")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes rendering the figures")
+    parser.add_argument("--dpi", type=int, default=200, help="resolution of the figures")
+    parser.add_argument("--force", action="store_true", help="render the figures whose data did not change too")
+    args   = parser.parse_args()
+
+    os.makedirs(direxport, exist_ok=True)
+    config   = registry.get_registry()
+
+    index    = dict()
+    if os.path.isfile(os.path.join(direxport, nameindex)):
+        with open(os.path.join(direxport, nameindex)) as f:
+            index = json.load(f)
+
+    # figures to render: new ones and the ones of modified data files
+    jobs     = list_jobs(config)
+    versions = {job[0]: job_version(job[3]) for job in jobs}
+    todo     = [job for job in jobs
+                if args.force or index.get(job[0], {}).get('version') != versions[job[0]]
+                or not all(os.path.isfile(os.path.join(direxport, filename)) for filename in index[job[0]]['files'])]
+    print(f"{len(todo)} figure(s) to render, {len(jobs) - len(todo)} up to date")
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+        results = pool.map(render_job, todo, [args.dpi] * len(todo), chunksize=4)
+        for job, files in tqdm(zip(todo, results), total=len(todo), desc="Rendering"):
+            namefig, kind, arguments, sources = job
+            index[namefig] = {'kind': kind, 'arguments': list(arguments), 'files': files, 'version': versions[namefig]}
+
+    # forget the figures of configurations that are gone, and remove their files
+    for namefig in [namefig for namefig in index if namefig not in versions]:
+        for filename in index.pop(namefig)['files']:
+            if os.path.isfile(os.path.join(direxport, filename)):
+                os.remove(os.path.join(direxport, filename))
+    write_index(index)
+    print(f"Index written in {os.path.join(direxport, 'index.html')}")
+
+if __name__ == "__main__":
+    main()
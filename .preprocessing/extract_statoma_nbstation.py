@@ -2,29 +2,35 @@
 
 
 import pandas as pd
-import numpy as np
 import os
-from datetime import datetime
-from configparser import ConfigParser
 from tqdm import tqdm 
+import argparse
+import tempfile
+
+import sys
+import statoma
+import manifest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import datastore
+from utils import stationindex
+from utils import stationcycles
+from utils import stationids
+from utils import registry
+from utils import profiling
+
 #============================ READ CONFIGURATION
 #
-config = ConfigParser()
-config.read("../Configuration.ini")
+config                   = registry.get_registry()
 
 # time information
-years                    = config["PERIOD"]["timeperiod"].split(',') 
-yearfirst                = int(years[0])
-yearend                  = int(years[1])
+yearfirst                = config.yearfirst
+yearend                  = config.yearend
 # name of variable
-namevars                 = config["VARIABLES"]["namevar"].split(',')  #TT,TD,SD
-
+namevars                 = config.namevars  #TT,TD,SD
 
 # name of experiments
-nameexps = []
-for section in config.sections():
-    if 'DRS' in section :
-        nameexps.append(section)
+nameexps                 = list(config.experiments)
 
 # where to save the outputs 
 dirdata                  = "../data"
@@ -48,7 +54,7 @@ def load_data(namevar, year, directory):
         
         # # Load the statoma file
         file_path = os.path.join(directory, filename)
-        df        = pd.read_csv(file_path, delim_whitespace=True, header='infer')  
+        df        = pd.read_csv(file_path, sep=r"\s+", header='infer')  
         
         # select only interesting columns and add dates
         df_sub                  = df[['LAT', 'LON', 'ALT']] 
@@ -58,68 +64,171 @@ def load_data(namevar, year, directory):
         
     return(data)   
 
-for nameexp in nameexps:
-    
-    print(nameexp)
-    
-    exppath  = config[nameexp]['EXPPATH']
-    namersas = config[nameexp]['RSAS']
-    years_s  = config[nameexp]['YEAR'].split(',')
-    years    = [int(x) for x in years_s]
-    
-    dirname         = dict()
-    dirname['TT']   = f"{exppath}/{nameexp}/{namersas}/gridpt/mist/statoma/screen/yin"  
-    dirname['TD']   = dirname['TT']
-    dirname['SD']   = f"{exppath}/{nameexp}/{namersas}/gridpt/mist/statoma/snow/yin"  
-
-    for namevar in namevars:
-        print(namevar)
-        for year in years:
-            
-            namefileout      = f"{dirdata}/count_nbstation_assim_{namevar}_{nameexp}_{namersas}_{year}.parquet"
-            print(namefileout)
-            if os.path.isfile(namefileout):
-                print(f"File {namefileout} already exist")
+#%% function to count the stations with the original in-memory path
+def count_concat(namevar, year, directory, presence):
+    # load the data
+    data_var    = load_data(namevar, year, directory)
+    data_var['STATION'] = stationids.assign(data_var)
+
+    # stations of every file
+    for date_str, stations in data_var.groupby('DATE'):
+        presence.add(stations, date_str)
+
+    # format the date
+    data_var['DATE'] = pd.to_datetime(data_var['DATE'], format="%Y%m%d%H")
+
+    # Extract year and month
+    data_var['MONTH'] = data_var['DATE'].dt.month
+
+    # Group by station and 'MONTH', and count the size
+    grouped = data_var.groupby(['STATION', 'MONTH']).size().reset_index(name='COUNT')
+
+    return(grouped)
+
+#%% function to count the stations of a list of files with a pool of processes, file per file
+# (spill mode: the counts above the memory ceiling are spilled to a temporary directory)
+def count_stream(file_paths, args, presence):
+    if args.mode != "spill":
+        return(statoma.stream_counts(file_paths, workers=args.workers, presence=presence))
+
+    with tempfile.TemporaryDirectory(prefix="statoma_spill_", dir=args.spill_dir) as dirspill:
+        return(statoma.spill_counts(file_paths, dirspill, args.memory_limit * 1024 * 1024,
+                                    workers=args.workers, presence=presence))
+
+#%% function to build the name of the output of one (experiment, variable, year)
+def output_file(nameexp, namevar, year):
+    return(f"{dirdata}/count_nbstation_assim_{namevar}_{nameexp}_{config.experiments[nameexp].rsas}_{year}.parquet")
+
+#%% function to list the (experiment, variable, year) to extract, in the order of Configuration.ini
+def list_tasks():
+    return([(nameexp, namevar, year) for nameexp in nameexps for namevar in namevars
+            for year in config.experiments[nameexp].years])
+
+#%% function to add the new stations of a task to the dictionary (one write) and give their IDs to the counts
+def save_stations(grouped, presence):
+    stationids.save()
+    presence.finalize()
+
+    return(grouped.assign(STATION=stationids.final(grouped['STATION'])))
+
+#%% function to get the presence of the stations already extracted, None if it is not in the store
+# (extracted before the cycles were kept, or with another time step)
+def read_presence(namevar, nameexp, year, timestep):
+    if not registry.get_registry().has_cycles(namevar, nameexp, year):
+        return(None)
+
+    data, bits = stationcycles.read_bitmaps(namevar, nameexp, year)
+    if data.empty or int(data['TIMESTEP'].iloc[0]) != timestep:
+        return(None)
+
+    return(stationcycles.Presence.from_bitmaps(data, bits, year))
+
+#%% function to build (or update) one count_nbstation_assim output
+def build_output(namevar, nameexp, year, directory, namefileout, args):
+    with profiling.stage("scan files"):
+        relevant_files = statoma.list_statoma_files(namevar, year, directory)
+        files          = manifest.scan_files(directory, relevant_files)
+        previous       = manifest.read_manifest(namefileout)
+
+    # the concat mode does not update its outputs
+    if os.path.isfile(namefileout) and args.mode == "concat":
+        print(f"File {namefileout} already exist")
+        return
+
+    # presence of the stations at every cycle, written with the counts
+    timestep = config.timesteps[namevar]
+    presence = read_presence(namevar, nameexp, year, timestep) if previous is not None else None
+    if previous is None and os.path.isfile(namefileout):
+        # the output of a run interrupted before its manifest is treated as absent
+        print(f"File {namefileout}: no manifest matching the output, every file is parsed again")
+    elif previous is not None and presence is None:
+        print(f"File {namefileout}: no presence of the stations per cycle yet, every file is parsed again")
+        previous = None
+
+    if previous is None:
+        presence = stationcycles.Presence(year, timestep)
+        with profiling.stage(f"count {args.mode}"):
+            if args.mode == "concat":
+                grouped = count_concat(namevar, year, directory, presence)
             else:
-                # load the data
-                data_var    = load_data(namevar, year, dirname[namevar])
+                file_paths = [os.path.join(directory, filename) for filename in relevant_files]
+                grouped    = count_stream(file_paths, args, presence)
+            grouped = save_stations(grouped, presence)
+
+        # Pivot the table to create one column for each month
+        with profiling.stage("format counts"):
+            pivoted = statoma.format_counts(grouped)
+    else:
+        new_files, dirty_months = manifest.diff_manifest(previous, files)
+        if not new_files and not dirty_months:
+            print(f"File {namefileout} is up to date")
+            return
+
+        # reparse the new files and every file of the months where a file changed or disappeared
+        files_parse = new_files + [filename for filename, entry in files.items() if entry['month'] in dirty_months]
+        print(f"File {namefileout}: {len(new_files)} new file(s), month(s) to recount {dirty_months}")
 
-                # format the date
-                data_var['DATE'] = pd.to_datetime(data_var['DATE'], format="%Y%m%d%H")
+        file_paths = [os.path.join(directory, filename) for filename in sorted(files_parse)]
+        with profiling.stage("count update"):
+            presence.clear_months(dirty_months)
+            delta      = save_stations(count_stream(file_paths, args, presence), presence)
+            pivoted    = statoma.update_counts(pd.read_parquet(namefileout), delta, dirty_months)
 
-                # Extract year and month
-                data_var['MONTH'] = data_var['DATE'].dt.month
+    # keep the partitioned store read by the pages (its spatial index and the cycles of the stations) in sync
+    with profiling.stage("write store"):
+        stationindex.write_counts(pivoted, namevar=namevar, nameexp=nameexp, year=year)
+        stationcycles.write_cycles(presence, namevar, nameexp, year)
 
-                # Group by 'LAT', 'LON', 'ALT', and 'MONTH', and count the size
-                grouped = data_var.groupby(['LAT', 'LON', 'ALT', 'MONTH']).size().reset_index(name='COUNT')
+    # Save the DataFrame to a Parquet file, then its manifest: written last, it marks the output as complete
+    # (an output without a matching manifest is counted again from all of its files by the next run)
+    with profiling.stage("write parquet"):
+        datastore.write_table("count_nbstation", datastore.to_table("count_nbstation", pivoted, exclude=["BUCKET"]), namefileout)
+        manifest.write_manifest(namefileout, files)
 
-                # Pivot the table to create one column for each month
-                pivoted = grouped.pivot_table(index=['LAT', 'LON', 'ALT'], 
-                                            columns='MONTH', values='COUNT', fill_value=0).reset_index()
+    if os.path.isfile(namefileout):
+        print(f"File {namefileout} has been created successfully.")
+    else:
+        print(f"File {namefileout} was not created.")
 
-                # List of month names and their corresponding month numbers
-                month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-                all_months = list(range(1, 13))  # All month numbers from 1 to 12
+#============================= MAIN
+def main():
+    parser = argparse.ArgumentParser(description="Count the assimilated stations per month from the statoma files")
+    parser.add_argument("--mode", choices=["stream", "spill", "concat"], default="stream",
+                        help="stream: parse the files in parallel and aggregate on the fly; "
+                             "spill: same under a memory ceiling, spilling the counts to disk; concat: load everything in memory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of processes used to parse the statoma files (stream and spill modes)")
+    parser.add_argument("--memory-limit", type=int, default=512,
+                        help="ceiling of the counts kept in memory in spill mode [MB]")
+    parser.add_argument("--spill-dir", default=None,
+                        help="directory of the counts spilled to disk in spill mode (default: the temporary directory)")
+    parser.add_argument("--task", nargs=3, action="append", metavar=("NAMEEXP", "NAMEVAR", "YEAR"),
+                        help="extract only this experiment, variable and year (repeatable; see also scheduler.py)")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every stage (JSON lines on the log, summary at the end); also RDRSVIZ_PROFILE=1")
+    args   = parser.parse_args()
 
-                # Identify missing months
-                missing_months = set(all_months) - set(pivoted.columns[3:])
+    if args.profile:
+        profiling.enable()
+    profiling.start_run("extract_statoma_nbstation")
 
-                # Insert columns for missing months with zeros
-                for month in missing_months:
-                    pivoted[month_names[month - 1]] = 0
+    tasks  = list_tasks()
+    if args.task:
+        selected = [(nameexp, namevar, int(year)) for nameexp, namevar, year in args.task]
+        unknown  = [task for task in selected if task not in tasks]
+        if unknown:
+            parser.error(f"not in Configuration.ini: {unknown}")
+        tasks    = selected
 
-                # Rename columns with month names
-                pivoted.columns  = ['LAT', 'LON', 'ALT'] + month_names
+    for nameexp, namevar, year in tasks:
+        namefileout      = output_file(nameexp, namevar, year)
+        print(nameexp, namevar, namefileout)
+        build_output(namevar, nameexp, year, config.experiments[nameexp].statoma_dir(namevar), namefileout, args)
 
-                pivoted['Total'] = pivoted.iloc[:, 3:].sum(axis=1)
+    profiling.summary()
 
-                # Save the DataFrame to a Parquet file
-                pivoted.to_parquet(namefileout, index=False) 
-                
-                if os.path.isfile(namefileout):
-                    print(f"File {namefileout} has been created successfully.")
-                else:
-                    print(f"File {namefileout} was not created.")
+if __name__ == "__main__":
+    main()
 
 # # #%% 
 
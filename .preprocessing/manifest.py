@@ -0,0 +1,77 @@
+# !/usr/bin/python3
+
+# Manifest of the statoma files used to build one count_nbstation_assim output.
+# It records the name, size and modification time of every source file so that
+# a later run only reparses the files that are new or have changed.
+
+import os
+import json
+
+#============================= FUNCTIONS
+#%% function to build the name of the manifest of an output file
+def manifest_path(namefileout):
+    dirout, namefile = os.path.split(namefileout)
+    namefile         = os.path.splitext(namefile)[0] + ".json"
+
+    return(os.path.join(dirout, "manifest", namefile))
+
+#%% function to describe one file by its size and modification time
+def file_signature(file_path):
+    stat = os.stat(file_path)
+
+    return({'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+
+#%% function to describe the source files of an output
+# the month is taken from the date (YYYYMMDDHH) at the start of the file name
+def scan_files(directory, filenames):
+    files = dict()
+    for filename in filenames:
+        entry          = file_signature(os.path.join(directory, filename))
+        entry['month'] = int(filename[4:6])
+        files[filename] = entry
+
+    return(files)
+
+#%% function to read a manifest, None when it is missing or does not match the output
+def read_manifest(namefileout):
+    namemanifest = manifest_path(namefileout)
+    if not os.path.isfile(namemanifest) or not os.path.isfile(namefileout):
+        return(None)
+
+    with open(namemanifest) as f:
+        manifest = json.load(f)
+
+    # the output was rewritten without its manifest (e.g. interrupted run)
+    if manifest.get('output') != file_signature(namefileout):
+        return(None)
+
+    return(manifest)
+
+#%% function to write the manifest once the output has been saved
+def write_manifest(namefileout, files):
+    namemanifest = manifest_path(namefileout)
+    os.makedirs(os.path.dirname(namemanifest), exist_ok=True)
+
+    manifest = {'output': file_signature(namefileout), 'files': files}
+
+    namefiletmp = namemanifest + ".tmp"
+    with open(namefiletmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(namefiletmp, namemanifest)
+
+#%% function to compare the files on disk with the manifest
+# returns the files that are new in an unchanged month and the months that have to be recounted
+# (a file was modified or removed)
+def diff_manifest(manifest, files):
+    previous     = manifest['files']
+
+    dirty_months = set()
+    for filename, entry in previous.items():
+        current = files.get(filename)
+        if current is None or current['size'] != entry['size'] or current['mtime'] != entry['mtime']:
+            dirty_months.add(entry['month'])
+
+    new_files    = [filename for filename, entry in files.items()
+                    if filename not in previous and entry['month'] not in dirty_months]
+
+    return(sorted(new_files), sorted(dirty_months))
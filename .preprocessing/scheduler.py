@@ -0,0 +1,284 @@
+# !/usr/bin/python3
+
+# Resumable runs of the preprocessing as a graph of tasks: one extraction of the
+# statoma files per (experiment, variable, year) of Configuration.ini, and the
+# export of the figures once every extraction is done (--export).
+#
+#   python scheduler.py run [--jobs 4] [--mode spill --memory-limit 512] [--export]
+#   python scheduler.py status
+#   python scheduler.py reset [TASK ...]
+#
+# A pool of local worker processes runs the tasks whose dependencies are done;
+# every task is one run of its script (extract_statoma_nbstation.py --task ...)
+# with its share of the cores, and its output in ../data/runs/logs/<task>.log.
+#
+# Every task has a checkpoint, ../data/runs/checkpoints/<task>.json (state, times,
+# return code and signature of its output), written through a temporary file and
+# a rename. A task is done when its checkpoint says so and its output was not
+# modified since, so an interrupted run (Ctrl-C, killed job, crashed node) resumes
+# with the same command: the tasks done are skipped and the others run again. The
+# outputs are complete or absent: the extractor writes every file atomically and
+# the manifest of its output last, and counts an output without a matching
+# manifest again from all of its files.
+
+import os
+import sys
+import json
+import time
+import fcntl
+import signal
+import argparse
+import subprocess
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Tuple
+
+import manifest
+
+#============================ CONFIGURATION
+#
+dirscript    = os.path.dirname(os.path.abspath(__file__))
+dirruns      = os.path.join(dirscript, "..", "data", "runs")
+dircheck     = os.path.join(dirruns, "checkpoints")
+dirlogs      = os.path.join(dirruns, "logs")
+
+# seconds between two checks of the running tasks
+polling      = 1.0
+
+#============================= CLASSES
+#%% one task of the graph: the command it runs, the file it produces and the tasks it waits for
+@dataclass(frozen=True)
+class Task:
+    name:    str
+    command: Tuple[str, ...]
+    output:  Optional[str] = None
+    after:   Tuple[str, ...] = field(default_factory=tuple)
+
+#============================= FUNCTIONS
+#%% function to build the graph of the tasks, in the order of Configuration.ini
+def list_tasks(args):
+    # the extractor reads Configuration.ini on import
+    import extract_statoma_nbstation as extractor
+
+    tasks   = []
+    options = ["--mode", args.mode, "--memory-limit", str(args.memory_limit)]
+    for nameexp, namevar, year in extractor.list_tasks():
+        tasks.append(Task(name=f"extract_{nameexp}_{namevar}_{year}",
+                          command=(sys.executable, "extract_statoma_nbstation.py", "--task", nameexp, namevar, str(year),
+                                   "--workers", str(args.workers), *options),
+                          output=os.path.join(dirscript, extractor.output_file(nameexp, namevar, year))))
+
+    if args.export:
+        tasks.append(Task(name="export_figures", command=(sys.executable, "export_figures.py", "--workers", str(args.workers)),
+                          after=tuple(task.name for task in tasks)))
+
+    return(tasks)
+
+#%% function to get the file of the checkpoint of a task
+def checkpoint_file(name):
+    return(os.path.join(dircheck, f"{name}.json"))
+
+#%% function to read the checkpoint of a task, None if the task never ran
+def read_checkpoint(name):
+    try:
+        with open(checkpoint_file(name)) as f:
+            return(json.load(f))
+    except FileNotFoundError:
+        return(None)
+
+#%% function to write the checkpoint of a task
+def write_checkpoint(name, checkpoint):
+    os.makedirs(dircheck, exist_ok=True)
+    namefiletmp = f"{checkpoint_file(name)}.{os.getpid()}.tmp"
+    with open(namefiletmp, "w") as f:
+        json.dump(checkpoint, f, indent=1)
+    os.replace(namefiletmp, checkpoint_file(name))
+
+#%% function to get the signature of the output of a task (None without output)
+def output_signature(task):
+    if task.output is None or not os.path.isfile(task.output):
+        return(None)
+
+    return(manifest.file_signature(task.output))
+
+#%% function to get the state of a task: done, failed, interrupted, running (by another scheduler) or pending
+def task_state(task, checkpoint):
+    if checkpoint is None:
+        return("pending")
+    if checkpoint['state'] == "done":
+        # the output was modified or removed since the task ran
+        return("done" if checkpoint.get('output') == output_signature(task) else "pending")
+    if checkpoint['state'] == "running":
+        # the scheduler of the run was killed without updating the checkpoint
+        return("running" if pid_alive(checkpoint.get('pid')) else "interrupted")
+
+    return(checkpoint['state'])
+
+#%% function to check that a process is still alive
+def pid_alive(pid):
+    if pid is None:
+        return(False)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return(False)
+    except PermissionError:
+        return(True)
+
+    return(True)
+
+#%% function to start a task in a new process, its output goes to its log
+def start_task(task):
+    os.makedirs(dirlogs, exist_ok=True)
+    namelog    = os.path.join(dirlogs, f"{task.name}.log")
+    log        = open(namelog, "a")
+    log.write(f"\n#### {datetime.now().isoformat(timespec='seconds')} {' '.join(task.command)}\n")
+    log.flush()
+
+    proc       = subprocess.Popen(task.command, cwd=dirscript, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+    log.close()
+    checkpoint = {'state': "running", 'pid': proc.pid, 'start': time.time(), 'log': namelog}
+    write_checkpoint(task.name, checkpoint)
+
+    return(proc, checkpoint)
+
+#%% function to write the checkpoint of a task once its process has exited
+def finish_task(task, proc, checkpoint, state=None):
+    checkpoint = dict(checkpoint)
+    checkpoint.update(state=state or ("done" if proc.returncode == 0 else "failed"), returncode=proc.returncode,
+                      end=time.time(), output=output_signature(task))
+    checkpoint.pop('pid', None)
+    write_checkpoint(task.name, checkpoint)
+
+    return(checkpoint)
+
+#%% function to hold the lock of the runs, a second scheduler would run the same tasks twice
+def lock_runs():
+    os.makedirs(dirruns, exist_ok=True)
+    lock = open(os.path.join(dirruns, ".lock"), "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        sys.exit("another scheduler is running (data/runs/.lock)")
+
+    return(lock)
+
+#%% function to stop the run on SIGTERM (e.g. end of the allocation of a batch job) as on Ctrl-C
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+#%% function to run the tasks not done, --jobs at a time
+def run(tasks, args):
+    lock     = lock_runs()
+    signal.signal(signal.SIGTERM, interrupt)
+
+    states   = {task.name: task_state(task, read_checkpoint(task.name)) for task in tasks}
+    todo     = [task for task in tasks if states[task.name] not in ("done", "failed", "running")
+                or (args.retry_failed and states[task.name] == "failed")]
+    failed   = {task.name for task in tasks if states[task.name] == "failed" and not args.retry_failed}
+    # processes left by a killed scheduler: their tasks are not started twice
+    orphans  = [task.name for task in tasks if states[task.name] == "running"]
+    print(f"{list(states.values()).count('done')} task(s) done, {len(failed)} failed (--retry-failed), {len(todo)} to run")
+    if orphans:
+        print(f"still running from a previous run, resume once they are finished: {' '.join(orphans)}")
+
+    running  = dict()
+    ndone    = 0
+    try:
+        while todo or running:
+            # tasks waiting for a task that failed, or that another run is doing, cannot run
+            for task in [task for task in todo if failed.union(orphans).intersection(task.after)]:
+                todo.remove(task)
+                failed.add(task.name)
+                print(f"skipped  {task.name}: a task it depends on failed or is still running")
+
+            # start the tasks whose dependencies are done
+            for task in list(todo):
+                if len(running) >= args.jobs:
+                    break
+                if all(states[name] == "done" for name in task.after):
+                    todo.remove(task)
+                    running[task.name] = (task, *start_task(task))
+                    print(f"started  {task.name}")
+
+            time.sleep(polling)
+
+            for name, (task, proc, checkpoint) in list(running.items()):
+                if proc.poll() is None:
+                    continue
+                del running[name]
+                checkpoint   = finish_task(task, proc, checkpoint)
+                states[name] = checkpoint['state']
+                ndone       += 1
+                if checkpoint['state'] == "failed":
+                    failed.add(name)
+                print(f"{checkpoint['state']:8s} {name} ({checkpoint['end'] - checkpoint['start']:.0f} s) "
+                      f"[{ndone}/{ndone + len(running) + len(todo)}]" + (f", see {checkpoint['log']}" if name in failed else ""))
+    except KeyboardInterrupt:
+        print("interrupted, waiting for the running tasks to stop")
+        for task, proc, checkpoint in running.values():
+            proc.terminate()
+        for task, proc, checkpoint in running.values():
+            proc.wait()
+            finish_task(task, proc, checkpoint, state="interrupted")
+        print("run the same command again to resume")
+        return(1)
+    finally:
+        lock.close()
+
+    return(1 if failed else 0)
+
+#%% function to print the state of every task
+def status(tasks):
+    counts = dict()
+    print(f"{'task':50s} {'state':12s} {'time':>8s}  end")
+    for task in tasks:
+        checkpoint = read_checkpoint(task.name)
+        state      = task_state(task, checkpoint)
+        counts[state] = counts.get(state, 0) + 1
+
+        duration   = f"{checkpoint['end'] - checkpoint['start']:.0f} s" if checkpoint and 'end' in checkpoint else ""
+        end        = datetime.fromtimestamp(checkpoint['end']).isoformat(timespec='seconds') if checkpoint and 'end' in checkpoint else ""
+        print(f"{task.name:50s} {state:12s} {duration:>8s}  {end}")
+
+    print(", ".join(f"{n} {state}" for state, n in sorted(counts.items())))
+
+#%% function to forget the checkpoints of tasks (every task if names is empty)
+def reset(tasks, names):
+    lock  = lock_runs()
+    known = {task.name for task in tasks}
+    for name in names or known:
+        if name not in known:
+            sys.exit(f"unknown task {name}")
+        if os.path.isfile(checkpoint_file(name)):
+            os.remove(checkpoint_file(name))
+    lock.close()
+
+#============================= MAIN
+def main():
+    parser = argparse.ArgumentParser(description="Run the preprocessing as resumable tasks, one per (experiment, variable, year)")
+    parser.add_argument("command", choices=["run", "status", "reset"], help="run (or resume) the tasks, print their state, or forget them")
+    parser.add_argument("names", nargs="*", help="tasks to reset (every task if none)")
+    parser.add_argument("--jobs", type=int, default=4, help="number of tasks run at the same time")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes of every task (default: the cores shared between the jobs)")
+    parser.add_argument("--mode", choices=["stream", "spill"], default="stream", help="mode of the extractor")
+    parser.add_argument("--memory-limit", type=int, default=512, help="ceiling of the counts of a task in spill mode [MB]")
+    parser.add_argument("--export", action="store_true", help="export the figures once every extraction is done")
+    parser.add_argument("--retry-failed", action="store_true", help="run the tasks that failed again")
+    args   = parser.parse_args()
+
+    args.workers = args.workers or max(1, os.cpu_count() // args.jobs)
+    tasks  = list_tasks(args)
+
+    if args.command == "run":
+        return(run(tasks, args))
+    if args.command == "status":
+        status(tasks)
+    else:
+        reset(tasks, args.names)
+
+    return(0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# !/usr/bin/python3
+
+# Helpers to read statoma files and count the assimilated stations per month.
+# They are kept in their own module so that the worker processes used by
+# extract_statoma_nbstation.py can import them. The workers count the stations
+# of a file by coordinates, the counts are then aggregated on the station IDs
+# (utils/stationids.py).
+#
+# spill_counts aggregates out of core: once the counts in memory are above a
+# ceiling, they are written to disk split in buckets of station IDs, and every
+# bucket is merged on its own at the end, with the same result as stream_counts.
+
+import os
+import sys
+import glob
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import stationids
+
+#============================ CONSTANTS
+#
+month_names  = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+keys_station = ['LAT', 'LON', 'ALT']
+
+# number of per-file partial counts kept before they are folded into the running aggregate
+batchsize    = 256
+
+# files parsed per worker at a time (the results of one chunk only wait in memory)
+chunkfiles   = 8
+
+# number of buckets of station IDs of the counts spilled to disk
+nbuckets     = 16
+
+#============================= FUNCTIONS
+#%% function to list the statoma files of one variable and one year
+def list_statoma_files(namevar, year, directory):
+    # Define the suffix based on the namevar
+    suffixe = f"_statoma_{namevar}_001" if "SD" in namevar else f"_statoma_{namevar}_000"
+
+    relevant_files = [filename for filename in os.listdir(directory) if suffixe in filename and str(year) in filename]
+
+    return(sorted(relevant_files))
+
+#%% function to count the stations of one statoma file
+# the date (YYYYMMDDHH) is the first 10 characters of the file name
+def count_file(file_path):
+    filename = os.path.basename(file_path)
+    month    = int(filename[4:6])
+
+    df       = pd.read_csv(file_path, sep=r'\s+', header='infer', usecols=keys_station)
+    counts   = df.groupby(keys_station).size().reset_index(name='COUNT')
+    counts['MONTH'] = month
+
+    return(counts)
+
+#%% function to fold partial counts into the running aggregate
+def merge_counts(partials):
+    merged = pd.concat(partials, axis=0, ignore_index=True)
+    merged = merged.groupby(['STATION', 'MONTH'], as_index=False)['COUNT'].sum()
+
+    return(merged)
+
+#%% function to get an empty (STATION, MONTH) aggregate
+def empty_counts():
+    return(pd.DataFrame({'STATION': pd.Series([], dtype='int32'), 'MONTH': pd.Series([], dtype='int64'),
+                         'COUNT': pd.Series([], dtype='int64')}))
+
+#%% function to parse a list of files with a pool of processes, yields (file path, counts of its stations by ID)
+# (the stations new to the dictionary have a provisional ID until stationids.save())
+# nchunk files are sent to the pool at a time (chunkfiles per worker if None)
+def iter_counts(file_paths, workers=1, nchunk=None):
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    nchunk   = nchunk or max(workers, 1) * chunkfiles
+
+    try:
+        for i in range(0, len(file_paths), nchunk):
+            chunk   = file_paths[i:i + nchunk]
+            results = executor.map(count_file, chunk, chunksize=8) if executor is not None else map(count_file, chunk)
+            for file_path, counts in zip(chunk, results):
+                yield(file_path, counts.assign(STATION=stationids.assign(counts))[['STATION', 'MONTH', 'COUNT']])
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+#%% function to count the stations of a list of files with a pool of processes
+# only the (STATION, MONTH) counts are kept in memory, never the raw observations
+# presence (utils/stationcycles.Presence), if given, gets the stations of every file
+def stream_counts(file_paths, workers=1, presence=None):
+    partials  = [empty_counts()]
+
+    for file_path, counts in tqdm(iter_counts(file_paths, workers), total=len(file_paths), desc="Processing files"):
+        if presence is not None:
+            presence.add(counts, os.path.basename(file_path)[0:10])
+        partials.append(counts)
+        if len(partials) > batchsize:
+            partials = [merge_counts(partials)]
+
+    return(merge_counts(partials))
+
+#%% function to get the memory used by counts [bytes]
+def counts_bytes(partials):
+    return(sum(int(counts.memory_usage(index=False).sum()) for counts in partials))
+
+#%% function to write counts to disk, one parquet file per bucket of station IDs
+def spill(merged, dirspill, nspill):
+    for bucket, counts in merged.groupby(merged['STATION'] % nbuckets):
+        dirbucket = os.path.join(dirspill, f"bucket={bucket}")
+        os.makedirs(dirbucket, exist_ok=True)
+        counts.to_parquet(os.path.join(dirbucket, f"spill-{nspill}.parquet"), index=False)
+
+#%% function to count the stations of a list of files with the counts in memory kept below maxbytes
+# the counts above the ceiling are spilled to dirspill, then the spills of every bucket of station IDs are merged
+# in turn, so the result (the one of stream_counts) is the only aggregate of the whole list held in memory
+def spill_counts(file_paths, dirspill, maxbytes, workers=1, presence=None):
+    partials = [empty_counts()]
+    nbytes   = 0
+    nspill   = 0
+
+    for file_path, counts in tqdm(iter_counts(file_paths, workers), total=len(file_paths), desc="Processing files"):
+        if presence is not None:
+            presence.add(counts, os.path.basename(file_path)[0:10])
+        partials.append(counts)
+        nbytes  += counts_bytes([counts])
+        if nbytes <= maxbytes:
+            continue
+
+        # fold the counts first, spill them when they still take more than half of the ceiling
+        partials = [merge_counts(partials)]
+        nbytes   = counts_bytes(partials)
+        if nbytes > maxbytes // 2:
+            spill(partials[0], dirspill, nspill)
+            partials = [empty_counts()]
+            nbytes   = 0
+            nspill  += 1
+
+    if nspill == 0:
+        return(merge_counts(partials))
+
+    spill(merge_counts(partials), dirspill, nspill)
+    merged = []
+    for bucket in range(nbuckets):
+        files = sorted(glob.glob(os.path.join(dirspill, f"bucket={bucket}", "spill-*.parquet")))
+        merged.append(merge_counts([empty_counts()] + [pd.read_parquet(namefile) for namefile in files]))
+
+    merged = pd.concat(merged, axis=0, ignore_index=True).sort_values(['STATION', 'MONTH'], kind="stable")
+
+    return(merged.reset_index(drop=True))
+
+#%% function to pivot the (STATION, MONTH) counts with one column per month and the total
+# the coordinates of the stations are the ones of their IDs
+def format_counts(grouped):
+    pivoted = grouped.pivot_table(index='STATION', columns='MONTH', values='COUNT',
+                                  aggfunc='sum', fill_value=0)
+
+    # Insert columns for missing months with zeros
+    pivoted = pivoted.reindex(columns=range(1, 13), fill_value=0).astype('int64')
+
+    # Rename columns with month names
+    pivoted.columns  = month_names
+    pivoted          = pd.concat([stationids.coordinates(pivoted.index)[keys_station].set_index(pivoted.index), pivoted], axis=1)
+    pivoted          = pivoted.reset_index()
+
+    pivoted['Total'] = pivoted[month_names].sum(axis=1)
+
+    return(pivoted)
+
+#%% function to go back from the monthly columns to (STATION, MONTH) counts
+def unpivot_counts(pivoted):
+    # outputs written before the stations had IDs
+    if 'STATION' not in pivoted.columns:
+        ids     = stationids.assign(pivoted)
+        stationids.save()
+        pivoted = pivoted.assign(STATION=stationids.final(ids))
+
+    grouped = pivoted.melt(id_vars=['STATION'], value_vars=month_names, var_name='MONTH', value_name='COUNT')
+    grouped['MONTH'] = grouped['MONTH'].map({name: i + 1 for i, name in enumerate(month_names)}).astype('int64')
+    grouped = grouped[grouped['COUNT'] > 0].reset_index(drop=True)
+
+    return(grouped)
+
+#%% function to merge new counts into an existing output
+# the months listed in months_recount are replaced by the new counts, the others are added up
+def update_counts(pivoted, delta, months_recount=()):
+    grouped = unpivot_counts(pivoted)
+    grouped = grouped[~grouped['MONTH'].isin(list(months_recount))]
+
+    return(format_counts(merge_counts([grouped, delta])))
@@ -0,0 +1,125 @@
+# !/usr/bin/python3
+
+# Start-up time of the app: every page runs in a new Python process with
+# `python -X importtime`, as a cold server process would, and the import cost of
+# the modules is reported per package and per module.
+#
+#   python benchmarks/import_time.py                          # app.py and every page
+#   python benchmarks/import_time.py pages/02_snowmelt_dates.py --top 30
+#   python benchmarks/import_time.py --imports-only           # imports of the page, not its first run
+#
+# The pages run as plain scripts in bare mode (no `streamlit run`), so the time
+# of the process is the import of the modules plus the first run of the page.
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from collections import defaultdict
+
+#============================ CONFIGURATION
+#
+dirroot  = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+pages    = ["app.py", "pages/01_stations_assimilated.py", "pages/02_snowmelt_dates.py", "pages/03_PICIC-PRISM.py"]
+
+# run in the new process: the page, or only its top level import statements
+runner   = """
+import sys, runpy, logging, time
+sys.path.insert(0, {dirroot!r})
+logging.disable(logging.WARNING)
+t0 = time.perf_counter()
+if {imports_only!r}:
+    import ast
+    with open({namepage!r}) as f:
+        tree = ast.parse(f.read())
+    tree.body = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    exec(compile(tree, {namepage!r}, "exec"), {{"__name__": "__main__"}})
+else:
+    runpy.run_path({namepage!r}, run_name="__main__")
+sys.stderr.write(f"page time: {{time.perf_counter() - t0}}\\n")
+"""
+
+#============================= FUNCTIONS
+#%% function to run one page in a new process, returns its wall time and the lines of -X importtime
+def run_page(namepage, imports_only):
+    code = runner.format(dirroot=os.path.abspath(dirroot), namepage=os.path.join(os.path.abspath(dirroot), namepage),
+                         imports_only=imports_only)
+
+    t0   = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=dirroot,
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(f"{namepage}:\n{proc.stderr[-2000:]}")
+
+    return(wall, proc.stderr.splitlines())
+
+#%% function to parse the lines of -X importtime: (module, self us, cumulative us, depth) in import order
+def parse_importtime(lines):
+    modules = []
+    for line in lines:
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        selftime, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(selftime), int(cumulative), depth))
+
+    return(modules)
+
+#%% function to summarize the import cost of one page (times in seconds)
+def summarize(wall, lines, top):
+    modules    = parse_importtime(lines)
+    pagetime   = next((float(line.split(":")[1]) for line in lines if line.startswith("page time:")), None)
+
+    # self time summed per package (first part of the module name)
+    packages   = defaultdict(int)
+    for name, selftime, cumulative, depth in modules:
+        packages[name.split(".")[0]] += selftime
+
+    # modules imported by the page itself (not by another module), with what they import
+    pagemodules = sorted([(name, cumulative) for name, selftime, cumulative, depth in modules if depth == 0],
+                         key=lambda module: -module[1])
+
+    return({'process': wall,
+            'page': pagetime,
+            'imports': sum(selftime for name, selftime, cumulative, depth in modules) / 1e6,
+            'packages': {name: value / 1e6 for name, value in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+            'modules': {name: cumulative / 1e6 for name, cumulative in pagemodules[:top]}})
+
+#%% function to print the summary of one page
+def print_summary(namepage, summary):
+    print(f"{namepage}: process {summary['process']:.2f}s, imports {summary['imports']:.2f}s"
+          + (f", page {summary['page']:.2f}s" if summary['page'] is not None else ""))
+    print("  packages (self time)")
+    for name, value in summary['packages'].items():
+        print(f"    {value:8.3f}s  {name}")
+    print("  modules imported by the page (cumulative time)")
+    for name, value in summary['modules'].items():
+        print(f"    {value:8.3f}s  {name}")
+
+#============================= MAIN
+def main():
+    parser = argparse.ArgumentParser(description="Import cost of the app and of its pages in a cold process")
+    parser.add_argument("pages", nargs="*", default=pages, help="pages to run, relative to the root of the app")
+    parser.add_argument("--top", type=int, default=15, help="number of packages and modules reported")
+    parser.add_argument("--imports-only", action="store_true", help="run the imports of the pages only")
+    parser.add_argument("--output", help="JSON file of the summaries")
+    args   = parser.parse_args()
+
+    results = dict()
+    for namepage in args.pages:
+        wall, lines       = run_page(namepage, args.imports_only)
+        results[namepage] = summarize(wall, lines, args.top)
+        print_summary(namepage, results[namepage])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    return(0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+# !/usr/bin/python3
+
+# Timings of the pages and of their hot paths on the synthetic stores (synthetic.py)
+#
+#   python benchmarks/run_benchmarks.py                       # 1x, 10x and 100x stations and experiments
+#   python benchmarks/run_benchmarks.py --stations 1 10 --experiments 1 --no-pages
+#   python benchmarks/run_benchmarks.py --write-thresholds    # save the current timings (x margin) as thresholds
+#
+# Every stage is timed cold (after clearing the caches of the process: opened
+# datasets, loader cache, figure cache, base maps) and warm (run again right
+# away). The operating system file cache is not cleared, so a cold read is a cold
+# process, not a cold disk. The run fails (exit code 1) when a timing is above
+# its threshold in thresholds.json.
+#
+# The thresholds are ratios to a calibration run (a parquet round trip, a group-by
+# and a figure render of fixed size) timed at the start of every run, so that they
+# hold on a faster or slower machine. --absolute compares with the seconds of a
+# thresholds file written on the same machine with --write-thresholds --absolute.
+#
+# streamlit < 1.28 has no AppTest: the full pages then run as plain scripts with
+# runpy in bare mode, without the widgets events and the rendering of the browser.
+
+import io
+import os
+import sys
+import json
+import time
+import runpy
+import logging
+import argparse
+import statistics
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import synthetic
+from utils import arrowcache
+from utils import basemap
+from utils import datastore
+from utils import figcache
+from utils import registry
+from utils import snowmelt
+from utils import stations
+from utils import stationindex
+
+#============================ CONFIGURATION
+#
+dirroot        = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+namethresholds = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thresholds.json")
+
+pages          = ["pages/01_stations_assimilated.py", "pages/02_snowmelt_dates.py", "pages/03_PICIC-PRISM.py"]
+
+# template partition of the stations page and domain of the snowmelt page
+namevar        = "TT"
+domain         = (45, 48, 285, 290)
+
+#============================= FUNCTIONS
+#%% function to clear every cache of the process
+def clear_caches():
+    import streamlit as st
+
+    registry.refresh()
+    st.cache_data.clear()
+    figcache.figure_cache.invalidate()
+    arrowcache.clear()
+    basemap.load_basemap.cache_clear()
+
+#%% function to import the modules the pages and utils import on first use
+def preload_modules():
+    import branca.colormap
+    import cartopy.crs
+    import folium
+    import matplotlib.pyplot
+    import shapely.wkb
+    import streamlit_folium
+    import PIL.Image
+    from utils import stationmap
+
+#%% function to time a stage: median of the cold runs (caches cleared before each) and of the warm runs
+def time_stage(run, repeat):
+    timings = {'cold': [], 'warm': []}
+    for i in range(repeat):
+        clear_caches()
+        t0 = time.perf_counter()
+        run()
+        timings['cold'].append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        run()
+        timings['warm'].append(time.perf_counter() - t0)
+
+    return({key: statistics.median(values) for key, values in timings.items()})
+
+#%% function to time the calibration workload: median of repeat runs after a first one
+def calibrate(repeat=5):
+    import matplotlib.pyplot as plt
+
+    rng     = np.random.default_rng(0)
+    data    = pd.DataFrame({'key': rng.integers(0, 1000, 500000), 'value': rng.random(500000)})
+
+    def run():
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(data), buffer)
+        pq.read_table(pa.BufferReader(buffer.getvalue())).to_pandas().groupby('key')['value'].quantile(0.75)
+
+        fig, ax = plt.subplots(figsize=(6, 4))
+        ax.plot(data['value'].values[:10000])
+        figcache.figure_to_png(fig, dpi=100)
+
+    run()
+    timings = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - t0)
+
+    return(statistics.median(timings))
+
+#%% function to get the streamlit AppTest class (None before streamlit 1.28)
+def get_apptest():
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        AppTest = None
+
+    return(AppTest)
+
+#%% function to run one page headless (widgets keep their default values)
+def run_page(namepage):
+    AppTest = get_apptest()
+
+    if AppTest is not None:
+        apptest = AppTest.from_file(os.path.join(dirroot, namepage), default_timeout=600)
+        apptest.run()
+        if apptest.exception:
+            raise RuntimeError(f"{namepage}: {apptest.exception[0].value}")
+    else:
+        # streamlit < 1.28 has no AppTest: the page runs as a plain script in bare mode
+        runpy.run_path(os.path.join(dirroot, namepage), run_name="__main__")
+
+#%% function to list the stages timed on one store
+def list_stages(dirstore, with_pages):
+    stages = dict()
+
+    # experiments of the store (the real ones and their copies)
+    nameexps_count = sorted({part['nameexp'] for part in datastore.list_partitions("count_nbstation")
+                             if part['namevar'] == namevar and part['year'] == synthetic.yeartemplate})
+    nameexps_melt  = sorted({part['nameexp'] for part in datastore.list_partitions("melting_angle")
+                             if part['domain'] == datastore.domain_key(domain)})
+
+    # parquet read
+    stages['read one count partition']    = lambda: datastore.query("count_nbstation", namevar=namevar,
+                                                                    nameexp=nameexps_count[0], year=synthetic.yeartemplate)
+    stages['read all count experiments']  = lambda: datastore.query("count_nbstation", namevar=namevar,
+                                                                    nameexp=nameexps_count, year=synthetic.yeartemplate)
+    stages['read region of the index']    = lambda: stationindex.query_region(namevar, nameexps_count[0], synthetic.yeartemplate, domain)
+    stages['read melting angles']         = lambda: datastore.query("melting_angle", domain=datastore.domain_key(domain),
+                                                                    nameexp=nameexps_melt)
+    stages['read yearly precipitation']   = lambda: datastore.query("yearly_prcp", domain=datastore.domain_key(domain))
+
+    # angles of the polar plot (precomputed, pivoted per experiment)
+    data_angle = datastore.query("melting_angle", domain=datastore.domain_key(domain), nameexp=nameexps_melt)
+    stages['angle frame']                 = lambda: snowmelt.angle_frame(data_angle, nameexps_melt)
+
+    # folium build (the HTML sent to the browser)
+    data_var   = datastore.query("count_nbstation", namevar=namevar, nameexp=nameexps_count[0], year=synthetic.yeartemplate)
+    stages['folium build']                = lambda: stations.build_station_map(data_var).get_root().render()
+
+    # matplotlib render
+    monthval   = data_var[['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']].sum(axis=0)
+    data_prcp  = datastore.query("yearly_prcp", domain=datastore.domain_key(domain))
+    stages['render annual cycle']         = lambda: figcache.figure_to_png(stations.plot_annual_cycle(monthval, synthetic.yeartemplate, namevar))
+    stages['render melting dates']        = lambda: figcache.figure_to_png(snowmelt.plot_melt_domain(domain, data_angle))
+    stages['render precipitation']        = lambda: figcache.figure_to_png(snowmelt.plot_prcp_domain(data_prcp))
+
+    # full pages
+    if with_pages:
+        for namepage in pages:
+            stages[f"page {os.path.basename(namepage)}"] = lambda namepage=namepage: run_page(namepage)
+
+    return(stages)
+
+#%% function to time every stage on one synthetic store
+def run_store(stations_factor, experiments_factor, repeat, with_pages):
+    dirstore = synthetic.generate(stations=stations_factor, experiments=experiments_factor)
+
+    # the pages and the registry read the synthetic store, the loaders cache next to it
+    datastore.dirstore    = dirstore
+    arrowcache.dircache   = os.path.join(dirstore, "..", "cache")
+    registry.refresh()
+
+    results = dict()
+    for namestage, run in list_stages(dirstore, with_pages).items():
+        results[namestage] = time_stage(run, repeat)
+        print(f"  {namestage:32s} cold {results[namestage]['cold']:8.3f} s   warm {results[namestage]['warm']:8.3f} s", flush=True)
+
+    return(results)
+
+#%% function to compare the timings with the thresholds, in seconds once multiplied by scale
+def check_thresholds(results, thresholds, scale):
+    failures = []
+    for namestore, stages in results.items():
+        for namestage, timings in stages.items():
+            for key, value in timings.items():
+                limit = thresholds.get(namestore, {}).get(namestage, {}).get(key)
+                if limit is not None and value > limit * scale:
+                    failures.append(f"{namestore} / {namestage} / {key}: {value:.3f} s > {limit * scale:.3f} s")
+
+    return(failures)
+
+#============================ MAIN
+#
+def main():
+    parser = argparse.ArgumentParser(description="Time the pages and their hot paths on synthetic stores")
+    parser.add_argument("--stations", type=int, nargs="+", default=[1, 10, 100], help="factors of the number of stations")
+    parser.add_argument("--experiments", type=int, nargs="+", default=[1, 10, 100], help="factors of the number of experiments")
+    parser.add_argument("--repeat", type=int, default=3, help="number of cold and warm runs of every stage")
+    parser.add_argument("--no-pages", action="store_true", help="do not time the full pages")
+    parser.add_argument("--output", help="JSON file of the timings")
+    parser.add_argument("--write-thresholds", action="store_true", help="save the timings x --margin as thresholds")
+    parser.add_argument("--margin", type=float, default=3.0, help="margin of the thresholds written")
+    parser.add_argument("--absolute", action="store_true",
+                        help="thresholds in seconds of this machine instead of ratios to the calibration run")
+    parser.add_argument("--thresholds", default=namethresholds, help="JSON file of the thresholds")
+    args   = parser.parse_args()
+
+    # the pages print a warning per call to st.* outside of `streamlit run`
+    logging.disable(logging.WARNING)
+
+    # the modules imported on first use by the pages are imported before the timings,
+    # their import cost is measured by import_time.py
+    preload_modules()
+
+    calibration = calibrate()
+    print(f"calibration run {calibration:.3f} s", flush=True)
+    if get_apptest() is None and not args.no_pages:
+        print("pages run with runpy in bare mode (no AppTest before streamlit 1.28)", flush=True)
+
+    factors = [(s, 1) for s in args.stations] + [(1, e) for e in args.experiments if e != 1 or 1 not in args.stations]
+
+    results = dict()
+    for stations_factor, experiments_factor in factors:
+        namestore = os.path.basename(synthetic.store_dir(stations_factor, experiments_factor))
+        print(namestore, flush=True)
+        results[namestore] = run_store(stations_factor, experiments_factor, args.repeat, not args.no_pages)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'calibration': calibration, 'pages': "AppTest" if get_apptest() else "runpy",
+                       'stores': results}, f, indent=1)
+
+    # the thresholds are seconds (--absolute) or ratios to the calibration run
+    unit     = "seconds" if args.absolute else "calibration"
+    scale    = 1.0 if args.absolute else calibration
+
+    if args.write_thresholds:
+        thresholds = {namestore: {namestage: {key: round((args.margin * value + 0.05) / scale, 3) for key, value in timings.items()}
+                                  for namestage, timings in stages.items()}
+                      for namestore, stages in results.items()}
+        with open(args.thresholds, "w") as f:
+            json.dump({'unit': unit, 'calibration': round(calibration, 3), 'stores': thresholds}, f, indent=1)
+        return(0)
+
+    thresholds = {'unit': unit, 'stores': dict()}
+    if os.path.isfile(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    if thresholds['unit'] != unit:
+        sys.exit(f"{args.thresholds} holds thresholds in {thresholds['unit']}, run with"
+                 + (" --absolute" if thresholds['unit'] == "seconds" else "out --absolute"))
+
+    failures = check_thresholds(results, thresholds['stores'], scale)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+
+    return(1 if failures else 0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# !/usr/bin/python3
+
+# Synthetic stores for the benchmarks, generated from the data/store of the repository
+#
+#   benchmarks/data/stations{S}_experiments{E}/count_nbstation/...
+#   benchmarks/data/stations{S}_experiments{E}/melting_date/...
+#   benchmarks/data/stations{S}_experiments{E}/melting_angle/...
+#   benchmarks/data/stations{S}_experiments{E}/yearly_prcp/...
+#
+# The station counts of the template year are repeated S times per partition (the
+# copies are moved by a fraction of a degree so that they are distinct stations),
+# and every experiment is copied E-1 times as {nameexp}x{k}. The copies are not in
+# Configuration.ini, so the pages still only offer the real experiments, but the
+# multi-experiment reads and the polar plot see all of them (a copy keeps the
+# years kept of its experiment).
+
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import datastore
+from utils import stationindex
+
+#============================ CONFIGURATION
+#
+dirbench     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+dirtemplate  = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "store")
+
+# year of the station counts copied (the year with the most experiments)
+yeartemplate = 1992
+
+#============================= FUNCTIONS
+#%% function to get the directory of a synthetic store
+def store_dir(stations, experiments):
+    return(os.path.join(dirbench, f"stations{stations}_experiments{experiments}"))
+
+#%% function to read one dataset of the template store
+def read_template(namedataset, **filters):
+    dirstore = datastore.dirstore
+    try:
+        datastore.dirstore = dirtemplate
+        datastore.refresh()
+        data = datastore.query(namedataset, **filters)
+    finally:
+        datastore.dirstore = dirstore
+        datastore.refresh()
+
+    return(data)
+
+#%% function to repeat the stations of a count partition
+def scale_stations(data, stations, rng):
+    copies = []
+    for k in range(stations):
+        copy = data.copy()
+        if k > 0:
+            copy['LAT'] = (copy['LAT'] + rng.uniform(-0.5, 0.5, len(copy))).clip(-90, 90).round(2)
+            copy['LON'] = ((copy['LON'] + rng.uniform(-0.5, 0.5, len(copy))) % 360).round(2)
+        copies.append(copy)
+
+    return(pd.concat(copies, ignore_index=True))
+
+#%% function to get the names of the copies of an experiment
+def copy_names(nameexp, experiments):
+    return([nameexp] + [f"{nameexp}x{k}" for k in range(1, experiments)])
+
+#%% function to get the experiment a copy was made from
+def template_name(namecopy):
+    return(re.sub(r"x\d+$", "", namecopy))
+
+#%% function to write one synthetic store (skipped if already there)
+def generate(stations=1, experiments=1, seed=0):
+    dirout   = store_dir(stations, experiments)
+    if os.path.isdir(dirout):
+        return(dirout)
+
+    rng      = np.random.default_rng(seed)
+    counts   = read_template("count_nbstation", year=yeartemplate)
+    melt     = read_template("melting_date")
+    angle    = read_template("melting_angle")
+    prcp     = read_template("yearly_prcp")
+
+    dirstore = datastore.dirstore
+    dirtmp   = f"{dirout}.{os.getpid()}.tmp"
+    try:
+        datastore.dirstore = dirtmp
+
+        keys   = list(datastore.partitions["count_nbstation"].names)
+        for (namevar, nameexp, year), data in counts.groupby(keys, observed=True):
+            data = scale_stations(data.drop(columns=keys), stations, rng)
+            for namecopy in copy_names(nameexp, experiments):
+                stationindex.write_counts(data, namevar=namevar, nameexp=namecopy, year=int(year))
+
+        for namedataset, data_all in (("melting_date", melt), ("melting_angle", angle), ("yearly_prcp", prcp)):
+            keys = list(datastore.partitions[namedataset].names)
+            for (domain, nameexp), data in data_all.groupby(keys, observed=True):
+                data = data.drop(columns=keys)
+                for namecopy in copy_names(nameexp, experiments):
+                    datastore.write_partition(namedataset, data, domain=domain, nameexp=namecopy)
+    finally:
+        datastore.dirstore = dirstore
+        datastore.refresh()
+
+    os.replace(dirtmp, dirout)
+
+    return(dirout)
+
+#============================ MAIN
+#
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate the synthetic stores of the benchmarks")
+    parser.add_argument("--stations", type=int, nargs="+", default=[1, 10, 100], help="factors of the number of stations")
+    parser.add_argument("--experiments", type=int, nargs="+", default=[1, 10, 100], help="factors of the number of experiments")
+    args   = parser.parse_args()
+
+    for stations in args.stations:
+        print(generate(stations=stations))
+    for experiments in args.experiments:
+        print(generate(experiments=experiments))
@@ -1,53 +1,107 @@
 # !/usr/bin/python3
 
 import streamlit as st 
-import pandas as pd
-import numpy as np
-import os
-from configparser import ConfigParser
-import branca.colormap as cm
-
-import folium
-from folium.plugins import Draw
-from streamlit_folium import folium_static
-import matplotlib.pyplot as plt
-from matplotlib.ticker import ScalarFormatter
+import datetime
+
+from utils import datastore
+from utils import stations
+from utils import stationindex
+from utils import stationcycles
+from utils import figcache
+from utils import registry
+from utils import profiling
+from utils import arrowcache
+from utils import prefetch
+
+profiling.start_run("01_stations_assimilated")
 
 #============================ READ CONFIGURATION
 #
-config = ConfigParser()
-config.read("Configuration.ini")
+config                   = registry.get_registry()
 
 # name of the variables
-namevars                 = config["VARIABLES"]["namevar"].split(',')  #TT,TD,SD
+namevars                 = config.namevars  #TT,TD,SD
 
 # time information
-years                    = config["PERIOD"]["timeperiod"].split(',') 
-yearfirst                = int(years[0])
-yearend                  = int(years[1])
+yearfirst                = config.yearfirst
+yearend                  = config.yearend
 
-# directory where the data are saved
-dirdata                  = "../data"
-
-# name of experiments
-nameexps = []
-for section in config.sections():
-    if 'DRS' in section :
-        nameexps.append(section)
+# name of experiments with station counts in the store
+nameexps                 = config.experiments_with_counts()
 
 
 #============================= FUNCTIONS
 #%% LOAD DATA
-# function to load the data and cache it
-@st.cache_data
-def load_data(namevar, nameexp, year, namersas):
-    namefile      = f"data/count_nbstation_assim_{namevar}_{nameexp}_{namersas}_{year}.parquet"
-    data          = pd.read_parquet(namefile)
-    
-    month_columns = data[['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']]
-    month_sum     = month_columns.sum(axis=0)
+#%% function to get the files of the stations of a variable, experiment and year (and of their index)
+def count_sources(namevar, nameexp, year):
+    return([datastore.partition_dir(namedataset, namevar=namevar, nameexp=nameexp, year=year)
+            for namedataset in ("count_nbstation", "count_nbstation_index")])
+
+# function to load the stations of a region (every station if bounds is None) and their monthly cycle, and cache it
+@arrowcache.cached(lambda namevar, nameexp, year, bounds=None: count_sources(namevar, nameexp, year))
+def load_data(namevar, nameexp, year, bounds=None):
+    data, month_sum = stationindex.query_region(namevar, nameexp, year, bounds)
+
     return(data, month_sum)        
 
+# function to load several (experiment, year) of a variable in parallel and align their stations, and cache it
+@arrowcache.cached(lambda namevar, combos, bounds=None: sum([count_sources(namevar, nameexp, year) for nameexp, year in combos], []))
+def load_comparison(namevar, combos, bounds=None):
+    labels     = [f"{nameexp} {year}" for nameexp, year in combos]
+    results    = stations.load_combinations(namevar, combos, bounds)
+    aligned    = stations.align_stations([data for data, month_sum in results], labels)
+
+    return(aligned, [month_sum for data, month_sum in results], labels)
+
+# function to get the files of the cycles of a variable and experiment between two dates (one partition per year)
+def cycle_sources(namevar, nameexp, start, end):
+    return([datastore.partition_dir("station_cycles", namevar=namevar, nameexp=nameexp, year=year)
+            for year in range(start.year, end.year + 1)])
+
+# function to load the number of stations per cycle and the gaps of every station between two dates, and cache it
+@arrowcache.cached(lambda namevar, nameexp, start, end, bounds=None: cycle_sources(namevar, nameexp, start, end))
+def load_cycles(namevar, nameexp, start, end, bounds=None):
+    data, dates, presence = stationcycles.query_cycles(namevar, nameexp, start, end, bounds)
+
+    return(stationcycles.cycle_counts(dates, presence), stationcycles.station_gaps(data, dates, presence))
+
+# function to get the PNG of the annual cycle of a selection, rendered or from the figure cache
+def annual_cycle_png(namevar, nameexp, year, bounds, monthval):
+    sources = [datastore.partition_dir("count_nbstation", namevar=namevar, nameexp=nameexp, year=year)]
+
+    return(figcache.figure_cache.get_or_render(("01_stations_assimilated", nameexp, year, namevar, bounds),
+                                               lambda: stations.plot_annual_cycle(monthval, year, namevar), sources))
+
+# function to load the stations of a selection and render its annual cycle, run in the background by the prefetch
+def warm_selection(namevar, nameexp, year, bounds):
+    data, monthval = load_data(namevar, nameexp, year, bounds)
+    annual_cycle_png(namevar, nameexp, year, bounds, monthval)
+
+# function to list the selections next to the current one, most likely first:
+# the other variables, the other years, the other regions and the other experiments
+def neighbour_selections(namevar, nameexp, year, bounds):
+    selections  = [(other, nameexp, year, bounds) for other in config.namevars_with_counts(nameexp, year)]
+    selections += [(namevar, nameexp, other, bounds) for other in config.years_with_counts(nameexp)]
+    selections += [(namevar, nameexp, year, other) for other in [None] + list(config.domains.values())]
+    selections += [(namevar, other, year, bounds) for other in nameexps]
+
+    selections  = [selection for selection in selections if config.has_counts(*selection[:3])]
+
+    return([selection for i, selection in enumerate(selections)
+            if selection != (namevar, nameexp, year, bounds) and selection not in selections[:i]])
+
+# function to choose the region of the stations: the whole network, a domain of Configuration.ini or the current view of the map
+def select_region(with_view=True):
+    region = st.radio("Region:", ["All stations"] + list(config.domains) + (["Map view"] if with_view else []), horizontal=True)
+    if region == "Map view":
+        bounds = stations.view_bounds(st.session_state.get("stationmap"))
+    elif region == "All stations":
+        bounds = None
+    else:
+        bounds = config.domains[region]
+
+    return(region, bounds)
+
 #============================ END READ CONFIGURATION
 st.set_page_config(layout = 'wide')
 
@@ -56,68 +110,109 @@ st.write("""
 """)
 
 
-option_exp = st.radio("Select an experiment:", ("DRS1992IC401", "DRS1992IC401wCHDSD", "DRS1992IC401v3", "DRS1992IC425", "DRS2014IC425"))
+mode       = st.radio("Mode:", ["One experiment", "Compare experiments"], horizontal=True)
+
+if mode == "Compare experiments":
+    option   = st.selectbox("Variables", namevars)
+
+    # every (experiment, year) with counts of the variable, the first one selected is the reference
+    combos   = [(nameexp, year) for nameexp in nameexps for year in config.years_with_counts(nameexp)
+                if config.has_counts(option, nameexp, year)]
+    labels   = [f"{nameexp} {year}" for nameexp, year in combos]
+    selected = st.multiselect("Experiments and years to compare (the first one is the reference):", labels, default=labels[:2])
+
+    region, bounds = select_region(with_view=False)
+
+    if len(selected) < 2:
+        st.info("Select at least two experiments and years")
+    else:
+        combos_sel = tuple(combos[labels.index(label)] for label in selected)
+        aligned, month_sums, labels_sel = load_comparison(option, combos_sel, bounds)
+
+        sources = [datastore.partition_dir("count_nbstation", namevar=option, nameexp=nameexp, year=year) for nameexp, year in combos_sel]
+        png     = figcache.figure_cache.get_or_render(("01_stations_assimilated", combos_sel, None, option, bounds),
+                                                      lambda: stations.plot_comparison(month_sums, aligned, labels_sel, option), sources)
+        st.image(png, use_column_width=True)
+        profiling.sent("comparison", png)
+
+        st.dataframe(stations.comparison_summary(aligned, labels_sel), use_container_width=True)
+
+    profiling.debug_panel()
+    st.stop()
 
+option_exp = st.radio("Select an experiment:", nameexps)
 
-namersas   = config[option_exp]['RSAS']
-exppath    = config[option_exp]['EXPPATH']
-years_s    = config[option_exp]['YEAR'].split(',')
-years      = [int(x) for x in years_s]    
+# only the years and variables present in the store are proposed
+years      = config.years_with_counts(option_exp)
 
-year_to_look = st.radio("Select a year:", (1992, 2014))
+if not years:
+    st.warning(f"No station counts are available for experiment {option_exp}", icon="⚠️")
+    profiling.debug_panel()
+    st.stop()
 
-if year_to_look in years:        
-    # extract the name of the directory
-    option        = st.selectbox("Variables",("TT", "TD", "SD"))
+year_to_look = st.radio("Select a year:", years)
 
-    # extract the datasets 
-    data_var, monthval    = load_data(option, option_exp, year_to_look, namersas)
+# extract the name of the directory
+option        = st.selectbox("Variables", config.namevars_with_counts(option_exp, year_to_look))
 
-    data_var['LON'] = data_var['LON'] -360
+# region of the stations
+region, bounds = select_region()
 
-    # do the map
-    colormap = cm.LinearColormap(colors=['magenta', 'green', 'red'], vmin=0, vmax=365)
+# extract the datasets 
+data_var, monthval    = load_data(option, option_exp, year_to_look, bounds)
 
-    m        = folium.Map(location=[45.5, -93.56], zoom_start=2.4)    
-    data_var.apply(lambda row:folium.Circle(location=[row["LAT"], row["LON"]], 
-                                            color=colormap(row['Total']), fill=True,  fill_opacity=0.2,
-                                            radius=30).add_to(m), axis=1)
+# do the map
+with profiling.stage("folium build"):
+    m        = stations.build_station_map(data_var)
 
-    m.add_child(colormap)
-    folium.map.LayerControl('topleft', collapsed= False).add_to(m)
-    
+#folium_static(m, width=600, height=320)
+with profiling.stage("folium send"):
+    from streamlit_folium import folium_static, st_folium
+    if region == "Map view":
+        # the bounds of the view are sent back, the page is then rerun with the stations of the new view
+        view = st.session_state.get("stationmap") or {}
+        st_folium(m, key="stationmap", width=500, height=300, returned_objects=["bounds", "center", "zoom"],
+                  center=view.get("center"), zoom=view.get("zoom"))
+    else:
+        folium_static(m, width=500, height=300)
+profiling.sent("station map", lambda: m.get_root().render())
 
-    #folium_static(m, width=600, height=320)
-    folium_static(m, width=500, height=300)
+st.subheader('Annual cycles of the number of assimilated stations')
 
-    st.subheader('Annual cycles of the number of assimilated stations')
-    
-    # Create the x-axis values (months) and the corresponding y-axis values (sums)
-    x_values = range(1, 13)  # Month numbers from 1 to 12
-    y_values = monthval.tolist()  # Convert the Series to a list
+# render the plot, or reuse it if this selection was already displayed with the same data
+png     = annual_cycle_png(option, option_exp, year_to_look, bounds, monthval)
 
-    month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    # Create the plot
-    fig = plt.figure(figsize=(5.2, 2.6))
+st.image(png, use_column_width=True)
+profiling.sent("annual cycle", png)
 
-    ax = fig.add_subplot(111)
+# presence of the stations at every analysis cycle, when extracted with the counts
+if config.has_cycles(option, option_exp, year_to_look):
+    st.subheader('Number of assimilated stations per analysis cycle')
 
-    ax.plot(x_values, y_values, marker='o', linestyle='-', color='m', markersize=4)
-    
-    ax.set_title(f"Annual Time Series - {year_to_look} - {option}", fontsize=7)
-    ax.set_xlabel('Month', fontsize=7)
-    ax.set_xticks(x_values, month_names)  # Label the x-axis with month names
-    ax.set_ylabel('# assimilated cases', fontsize=7)
-    ax.tick_params(axis='both', which='major', labelsize=7)
-    ax.grid(True)
+    dates = st.date_input("Dates:", (datetime.date(year_to_look, 1, 1), datetime.date(year_to_look, 1, 31)),
+                          min_value=datetime.date(year_to_look, 1, 1), max_value=datetime.date(year_to_look, 12, 31))
+    if len(dates) == 2:
+        start  = datetime.datetime.combine(dates[0], datetime.time())
+        end    = datetime.datetime.combine(dates[1], datetime.time()) + datetime.timedelta(days=1)
+        counts, gaps = load_cycles(option, option_exp, start, end, bounds)
 
-    # Use ScalarFormatter to format the x-axis tick labels
-    ax.xaxis.set_major_formatter(ScalarFormatter())
-    
-    st.pyplot(fig, use_container_width=True)
-    
+        if counts.empty:
+            st.info("No station in this region")
+        else:
+            sources = cycle_sources(option, option_exp, start, end)
+            png     = figcache.figure_cache.get_or_render(("01_stations_assimilated", option_exp, (start, end), option, bounds),
+                                                          lambda: stations.plot_cycles(counts, option), sources)
+            st.image(png, use_column_width=True)
+            profiling.sent("cycles", png)
 
-else:
-    
-    st.warning(f"The year you selected {year_to_look} is not available for experiment {option_exp}", icon="⚠️")
+            # stations with the longest dropouts first
+            st.write("Stations by longest time without assimilation [hours] between their first and last cycle:")
+            st.dataframe(gaps.sort_values('LONGESTGAP', ascending=False).head(100), use_container_width=True)
 
+# load the selections next to this one while the user looks at it
+prefetcher = prefetch.session_prefetcher()
+if prefetcher is not None:
+    prefetcher.warm([(("01_stations_assimilated",) + selection, lambda selection=selection: warm_selection(*selection))
+                     for selection in neighbour_selections(option, option_exp, year_to_look, bounds)])
+
+profiling.debug_panel()
@@ -1,116 +1,63 @@
 # !/usr/bin/python3
 
 import streamlit as st 
-import pandas as pd
-import numpy as np
-import os
-from configparser import ConfigParser
-import datetime
-from math import pi, cos, sin
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import geopandas as gpd
-from cartopy.feature import NaturalEarthFeature
-import matplotlib.pyplot as plt
 
+from utils import datastore
+from utils import figcache
+from utils import gridstats
+from utils import registry
+from utils import snowmelt
+from utils import profiling
+from utils import arrowcache
+from utils import prefetch
+
+profiling.start_run("02_snowmelt_dates")
 
 #============================ READ CONFIGURATION
 #
-config = ConfigParser()
-config.read("Configuration.ini")
-
-# time information
-years                    = config["PERIOD"]["timeperiod"].split(',') 
-yearfirst                = int(years[0])
-yearend                  = int(years[1])
-
-dirdata                  = "../data"
+config                   = registry.get_registry()
 
 #============================= FUNCTIONS
 #%% LOAD DATA
-# function to load the data and cache it
-@st.cache_data
-def load_data(domain, nameexp):
-
-    latinf, latsup, loninf, lonsup = domain
-    
-    if nameexp == "v21":    
-        namefile           = f"data/melting_date_stat_domain_lat{latinf}to{latsup}_lon{loninf}to{lonsup}.parquet"
-    else:
-        namefile           = f"data/melting_date_stat_domain_lat{latinf}to{latsup}_lon{loninf}to{lonsup}_{nameexp}.parquet"
-    data               = pd.read_parquet(namefile)
+# function to load the angles of the melting dates of every experiment of a domain in one read and cache it
+# (from the store of the boxes for a box drawn on the map)
+@arrowcache.cached(lambda domain, nameexps: [datastore.partition_dir("melting_angle", config.domain_store(domain), domain=datastore.domain_key(domain))])
+def load_data(domain, nameexps):
+    data               = datastore.query("melting_angle", root=config.domain_store(domain), domain=datastore.domain_key(domain), nameexp=list(nameexps))
     
     return(data)        
 
-@st.cache_data
-def load_prcp_data(domain, nameexp):
-    latinf, latsup, loninf, lonsup = domain
-    
-    if nameexp == "v21":    
-        nameexpfile = "V2P1"
-    else:
-        nameexpfile = nameexp
-        
-    namefile           = f"data/yearly_prcp_domain_lat{latinf}to{latsup}_lon{loninf}to{lonsup}_{nameexpfile}.parquet"
-    data               = pd.read_parquet(namefile)
+@arrowcache.cached(lambda domain, nameexps: [datastore.partition_dir("yearly_prcp", config.domain_store(domain), domain=datastore.domain_key(domain))])
+def load_prcp_data(domain, nameexps):
+    data               = datastore.query("yearly_prcp", root=config.domain_store(domain), domain=datastore.domain_key(domain), nameexp=list(nameexps))
     
     return(data)        
 
-def doplottimeseries(axin, data_prcp_agg, unit, marker_t, colorm, colore, labeltxt):
-    
-    if labeltxt == "V2.1":
-        alphaval = 0.4
-    else:
-        alphaval = 0.7
-        
-    axin.plot(data_prcp_agg['year'], unit*data_prcp_agg['yearlysum'], 
-        marker=marker_t, linestyle='--', markersize=5, 
-        color=colorm, markeredgecolor=colore, label=labeltxt)
+# functions to get the PNG of the figures of a domain, rendered or from the figure cache
+def melt_png(domain, nameexps):
+    sources = [datastore.partition_dir("melting_angle", config.domain_store(domain), domain=datastore.domain_key(domain))]
 
-    axin.fill_between(data_prcp_agg['year'], 
-                    unit*data_prcp_agg['yearlysum_25pct'], 
-                    unit*data_prcp_agg['yearlysum_75pct'], 
-                    color=colorm, alpha=alphaval)   
-    
-    return(axin)
-        
-def estimateangle(data_melt_ds):
-    
-    # ordinal day
-    ordinal_days     = []
-    for date_in in data_melt_ds['MEDIAN']:
-        if pd.isna(date_in):
-            ordinal_day = float('nan')
-        else: 
-            # Get the ordinal day
-            ordinal_day = date_in.timetuple().tm_yday
-        
-        ordinal_days.append(ordinal_day)
-        
-    angles      = [ (2* pi *x/365) for x in ordinal_days]
-    
-    yy = data_melt_ds['YEAR'].tolist()
-    # extract the year
-    df          = pd.DataFrame({'YEAR': yy, 'ANGLE': angles})
-    
-    # Generate a list of years from 1980 to 2018
-    all_years    = list(range(1980, 2019))
+    return(figcache.figure_cache.get_or_render(("02_snowmelt_dates", "melt", None, None, tuple(domain)),
+                                               lambda: snowmelt.plot_melt_domain(domain, load_data(domain, nameexps)), sources))
 
-    # Merge the existing DataFrame with the full list of years and fill NaN
-    result_df = pd.DataFrame({'YEAR': all_years})
-    result_df = result_df.merge(df, on='YEAR', how='left')
-    result_df['ANGLE'] = result_df['ANGLE'].fillna(np.nan)
+def prcp_png(domain, nameexps):
+    sources = [datastore.partition_dir("yearly_prcp", config.domain_store(domain), domain=datastore.domain_key(domain))]
 
-    # If needed, you can sort the DataFrame by the 'YEAR' column
-    result_df = result_df.sort_values(by='YEAR')
-    
-    # estimate the radiius
-    radii       = np.linspace( 1,0.1,  len(range(1980, 2018+1)))
-    result_df['RADII'] = radii
-    
-    return(result_df)
+    return(figcache.figure_cache.get_or_render(("02_snowmelt_dates", "prcp", None, None, tuple(domain)),
+                                               lambda: snowmelt.plot_prcp_domain(load_prcp_data(domain, nameexps)), sources))
+
+# function to list the experiments drawn over a domain (melting dates, precipitation)
+def domain_experiments(domain):
+    return(tuple(nameexp for nameexp in snowmelt.meltexps if nameexp in config.experiments_with_melt(domain)),
+           tuple(nameexp for nameexp in snowmelt.prcpexps if nameexp in config.experiments_with_prcp(domain)))
+
+# function to render both figures of a domain, run in the background by the prefetch
+def warm_domain(domain):
+    nameexps_melt, nameexps_prcp = domain_experiments(domain)
+    if nameexps_melt and nameexps_prcp:
+        melt_png(domain, nameexps_melt)
+        prcp_png(domain, nameexps_prcp)
 
-    
 #============================ END READ CONFIGURATION
 
 st.write("""
@@ -122,188 +69,64 @@ st.write(""" The melting snow melt date displayed in the figure is the median sn
 st.info("""The snow is considered melted once at least 30 days of snow depth stays below a threshold (close to zero)""")
 
 
-namedomain       = st.radio('Select one domain:', ['Montreal-Quebec', 'West', 'East', 'Gaspesie'])
-
-if namedomain == 'Montreal-Quebec':
-    domain = [45, 48, 285, 290]
-elif namedomain == 'East':   
-    domain = [44,  47, 283, 288]
-elif namedomain == 'West':
-    domain = [50, 55, 235, 240]
-elif namedomain == 'Gaspesie':
-    domain = [48, 50, 291, 296]
-    
-
-latinf, latsup, loninf, lonsup = domain
-
-data_melt_v21               = load_data(domain, "v21")
-data_melt_v3wCHDSD          = load_data(domain, "DRS1992IC401wCHDSD")
-data_melt_v3                = load_data(domain, "DRS1992IC401")
-data_melt_v3_bis            = load_data(domain, "DRS1992IC401v3")
-data_melt_ic425             = load_data(domain, "DRS1992IC425")
-data_melt_2014_ic425        = load_data(domain, "DRS2014IC425")
-data_melt_2014_ic421        = load_data(domain, "DRS2014IC421")
-data_melt_1992_ic421        = load_data(domain, "DRS1992IC421")
-
-#%%
-# DO THE PLOT
-    
-# COORDINATES MONTH
-month_lbl        = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
-ordinal_days_lbl = [] 
-for m in range(1,13):
-    if m <10:
-        date_str = f"2023-0{m}-01"
-    else:
-        date_str= f"2023-{m}-01"
-    # Convert the date string to a datetime object
-    date = datetime.datetime.strptime(date_str, '%Y-%m-%d')
-        
-    # Get the ordinal day
-    ordinal_day = date.timetuple().tm_yday
-    ordinal_days_lbl.append(ordinal_day)
-    
-angles_lbl  = [ (2* pi *x/365) for x in ordinal_days_lbl] 
-
-dfout_v2 = estimateangle(data_melt_v21)
-
-dfout_v3 = estimateangle(data_melt_v3)
-dfout_v3.loc[dfout_v3['YEAR'] != 1992, 'ANGLE'] = np.nan
-
-dfout_v3wCHDSD = estimateangle(data_melt_v3wCHDSD)
-dfout_v3wCHDSD.loc[dfout_v3wCHDSD['YEAR'] != 1992, 'ANGLE'] = np.nan
-
-dfout_v3_bis = estimateangle(data_melt_v3_bis)
-dfout_v3_bis.loc[dfout_v3_bis['YEAR'] != 1992, 'ANGLE'] = np.nan
-
-dfout_ic425 = estimateangle(data_melt_ic425)
-dfout_ic425.loc[dfout_ic425['YEAR'] != 1992, 'ANGLE'] = np.nan
-
-dfout_2014_ic425 = estimateangle(data_melt_2014_ic425)
-dfout_2014_ic425.loc[dfout_2014_ic425['YEAR'] != 2014, 'ANGLE'] = np.nan
+namedomain       = st.radio('Select one domain:', list(config.domains) + ["Draw a box"])
 
-dfout_2014_ic421 = estimateangle(data_melt_2014_ic421)
-dfout_2014_ic421.loc[dfout_2014_ic425['YEAR'] != 2014, 'ANGLE'] = np.nan
+if namedomain == "Draw a box":
+    # any box drawn on the map, its statistics are computed from the gridded fields
+    import folium
+    from folium.plugins import Draw
+    from streamlit_folium import st_folium
 
-dfout_1992_ic421 = estimateangle(data_melt_1992_ic421)
-dfout_1992_ic421.loc[dfout_1992_ic421['YEAR'] != 1992, 'ANGLE'] = np.nan
+    m        = folium.Map(location=[50, -80], zoom_start=3)
+    Draw(draw_options={'polyline': False, 'polygon': False, 'circle': False, 'marker': False, 'circlemarker': False,
+                       'rectangle': True}, edit_options={'edit': False}).add_to(m)
+    output   = st_folium(m, width=700, height=400, returned_objects=["last_active_drawing"])
 
-#%%    
-# do the plot
-fig = plt.figure(figsize=(12, 6))
-
-ax1 = fig.add_subplot(121, projection='polar')
-
-ax1.plot(dfout_v2['ANGLE'], dfout_v2['RADII'], marker='o', linestyle='--', markersize=5, 
-        color='sandybrown', label="V2.1")
-ax1.plot(dfout_v3['ANGLE'], dfout_v3['RADII'], marker='*', linestyle='--', markersize=8, 
-        color='blue', label="DRS1992IC401")
-
-ax1.plot(dfout_v3wCHDSD['ANGLE'], dfout_v3wCHDSD['RADII'], marker='D', linestyle='--', markersize=7, 
-        color='purple', label="DRS1992IC401wCHDSD")
-
-ax1.plot(dfout_v3_bis['ANGLE'], dfout_v3_bis['RADII'], marker='>', linestyle='--', markersize=8, 
-        color='hotpink', markeredgecolor='darkred', label="DRS1992IC401v3")
-
-ax1.plot(dfout_ic425['ANGLE'], dfout_ic425['RADII'], marker='X', linestyle='--', markersize=8, 
-        color='limegreen', markeredgecolor='forestgreen', label="IC425")
-
-ax1.plot(dfout_2014_ic425['ANGLE'], dfout_2014_ic425['RADII'], marker='X', linestyle='--', markersize=8, 
-        color='limegreen', markeredgecolor='forestgreen')
+    drawing  = (output or {}).get("last_active_drawing")
+    if not drawing:
+        st.info("Draw a rectangle on the map with the square button on the left")
+        st.stop()
 
-ax1.plot(dfout_2014_ic421['ANGLE'], dfout_2014_ic421['RADII'], marker='^', linestyle='--', markersize=7, 
-        color='c', label="IC421", markeredgecolor='midnightblue')
+    # round the box to 0.1 degree so that close boxes share their statistics
+    lons, lats = zip(*drawing["geometry"]["coordinates"][0])
+    domain     = (round(min(lats), 1), round(max(lats), 1), round(min(lons) % 360, 1), round(max(lons) % 360, 1))
 
-ax1.plot(dfout_1992_ic421['ANGLE'], dfout_1992_ic421['RADII'], marker='^', linestyle='--', markersize=7, 
-        color='c', markeredgecolor='midnightblue')
-
-
-radii       = dfout_v2['RADII'].tolist()
-
-# arrange the ticks
-yearsval    = np.arange(yearfirst, yearend + 1)
-yticksval   = radii[::10]
-yticklabels = [str(x) for x in yearsval[::10]]
-ax1.set_yticks(yticksval)
-ax1.set_yticklabels(yticklabels, fontsize=8, color="grey")
-
-ax1.set_xticks(angles_lbl)      # Set the angular ticks to match the dates
-ax1.set_xticklabels(month_lbl)  # Use date labels for the angular ticks
-
-# legend
-ax1.legend(loc='best', ncol=2)
-
-# Set the theta limits to show only the top half of the circle
-ax1.set_thetamin(0)
-ax1.set_thetamax(180)
+    try:
+        with st.spinner(f"Computing the statistics of the box {datastore.domain_key(domain)} from the gridded fields"):
+            if gridstats.compute_domain(domain):
+                config = registry.get_registry()
+    except ValueError as error:
+        st.error(f"The statistics of the box cannot be computed: {error}", icon="🚨")
+        st.stop()
+else:
+    domain     = config.domains[namedomain]
     
 
-# Subplot 2: Map
-if loninf > 180:
-    loninf -= 360
-if lonsup > 180:
-    lonsup -= 360
-
-ax2 = fig.add_subplot(122, projection=ccrs.PlateCarree())
-# ax2 = axes[1]
+# only the experiments with data over this domain are read and drawn
+nameexps_melt, nameexps_prcp = domain_experiments(domain)
 
-ax2.set_extent([loninf-5 , lonsup+5, latinf-5, latsup+5], crs=ccrs.PlateCarree())
+if not nameexps_melt or not nameexps_prcp:
+    st.warning(f"No melting dates or precipitation available over {datastore.domain_key(domain)}", icon="⚠️")
+    st.stop()
 
-# Add rivers using Cartopy's NaturalEarthFeature
-rivers = NaturalEarthFeature(category='physical', name='rivers_lake_centerlines', 
-                            scale='10m', facecolor='none', edgecolor='blue', linewidth=0.5)
-ax2.add_feature(rivers)
-
-
-ax2.add_patch(plt.Rectangle((loninf, latinf), lonsup - loninf, latsup - latinf, 
-                            color='blue', alpha=0.2, transform=ccrs.PlateCarree()))
-ax2.coastlines(resolution='10m')
-ax2.set_title('Spatial Domain')
-
-st.pyplot(fig)
+# render the figures, or reuse them if this domain was already displayed with the same data
+png          = melt_png(domain, nameexps_melt)
+st.image(png, use_column_width=True)
+profiling.sent("melting dates", png)
 
 #%%    
 # do the plot
 
-data_prcp_agg_v21   = load_prcp_data(domain, "v21")
-
-data_prcp_agg_v01_ = load_prcp_data(domain, "DRS1992IC401")
-data_prcp_agg_v01  = data_prcp_agg_v01_[data_prcp_agg_v01_['year'] == 1992].reset_index(drop=True)
-
-data_prcp_agg_v01v3_ = load_prcp_data(domain, "DRS1992IC401v3")
-data_prcp_agg_v01v3  = data_prcp_agg_v01v3_[data_prcp_agg_v01v3_['year'] == 1992].reset_index(drop=True)
-
-data_prcp_agg_ic425_ = load_prcp_data(domain, "DRS1992IC425")
-data_prcp_agg_ic425  = data_prcp_agg_ic425_[data_prcp_agg_ic425_['year'] == 1992].reset_index(drop=True)
-
-
-unit = 1000
-
-fig = plt.figure(figsize=(5.2, 2.6))
-
-ax = fig.add_subplot(111)
-
-ax = doplottimeseries(ax, data_prcp_agg_v21, unit, 
-                    'o', 'sandybrown', 'sandybrown', "V2.1")
-
-ax = doplottimeseries(ax, data_prcp_agg_v01v3, unit, 
-                    '>', 'hotpink', 'darkred', "IC401v3")
-                    
-ax = doplottimeseries(ax, data_prcp_agg_v01, unit, 
-                    '*', 'blue', 'blue', "IC401")
-
-ax = doplottimeseries(ax, data_prcp_agg_ic425, unit, 
-                    'X', 'limegreen', 'forestgreen', "IC425")
-          
-
-ax.legend(loc="lower right", fontsize=7)
-ax.set_title('Precipitation accumulation over the domain', fontsize=9)
-ax.set_ylabel('[mm]', fontsize=9)
-ax.set_xlabel('year', fontsize=9)
-ax.tick_params(axis='both', which='major', labelsize=8)
-ax.grid()
+png          = prcp_png(domain, nameexps_prcp)
+st.image(png, use_column_width=True)
+profiling.sent("precipitation", png)
 
-st.pyplot(fig)
+# render the other domains while the user looks at this one
+prefetcher   = prefetch.session_prefetcher()
+if prefetcher is not None:
+    prefetcher.warm([(("02_snowmelt_dates", tuple(other)), lambda other=other: warm_domain(other))
+                     for other in config.domains.values() if tuple(other) != tuple(domain)])
 
 st.info("The shaded area corresponds to the 25th and 75th percentiles of the accumulation precipitation over the area")
 
+profiling.debug_panel()
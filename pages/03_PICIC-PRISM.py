@@ -1,12 +1,13 @@
 # !/usr/bin/python3
 
 import streamlit as st 
-import pandas as pd
-import numpy as np
+import os
 
-from configparser import ConfigParser
+from utils import imagepyramid
+from utils import griddiff
+from utils import profiling
 
-from PIL import Image
+profiling.start_run("03_PICIC-PRISM")
 
 
     
@@ -16,11 +17,14 @@ st.write("""
 ## Map of the differences per month between PRISM data generated by PICIC and Analysis (RSAS) or RDRS
 """)
 
-year_select = st.radio('Select one year:', ["1992"])
+# the experiments and years with gridded fields are added to the pre-rendered ones
+available   = griddiff.list_available()
+
+year_select = st.radio('Select one year:', sorted({"1992"} | {year for nameexp, year, namevar in available}))
 
 nameexp = st.radio(
     "Select one experiment",
-    ["IC401wCHDSD", "IC401"],
+    ["IC401wCHDSD", "IC401"] + sorted({nameexp for nameexp, year, namevar in available} - {"IC401wCHDSD", "IC401"}),
     index=None,
 )
 
@@ -32,21 +36,44 @@ namevar = st.radio(
 
 if namevar and nameexp and year_select:
     
-    if namevar == "PR" and nameexp == "IC401":
-        st.warning(f"Currently this map for precipitation is not available for IC401 - try an other experiment", icon="⚠️")
+    if namevar == "PR":
+        typediff = st.radio("Select one type of difference", ["DIFFERENCE (mm)", "RELATIVE DIFFERENCE (%)"], index=None)
+        typediff = "abs" if typediff == "DIFFERENCE (mm)" else "rel"
+        st.info('06-18 leadtimes of Precipitation are taken from RDRS')
+    else:
+        typediff = "abs"
+        st.info('Analysis fields are taken from RSAS')
+    
+    prefix     = "fig_diff_rel" if typediff == "rel" else "fig_diff"
+    image_name = f"figures/{prefix}_picic_{griddiff.reference_source(namevar)}_{nameexp}_{year_select}_{namevar}.png"
+    
+    # no pre-rendered map: compute it from the gridded fields (once, it is then saved)
+    if not os.path.isfile(image_name) and griddiff.is_available(nameexp, year_select, namevar):
+        with st.spinner("Computing the differences from the gridded fields"):
+            with profiling.stage("gridded differences"):
+                image_name = griddiff.render_difference(nameexp, year_select, namevar, typediff)
+    
+    if not os.path.isfile(image_name):
+        st.warning(f"Currently this map for {namevar} is not available for {nameexp} - try an other experiment", icon="⚠️")
     else:
-        if namevar == "PR" and nameexp == "IC401wCHDSD":
-            typediff = st.radio("Select one type of difference", ["DIFFERENCE (mm)", "RELATIVE DIFFERENCE (%)"], index=None)
-            
-            if typediff == "DIFFERENCE (mm)":
-                image_name = f"figures/fig_diff_picic_rdrs_{nameexp}_{year_select}_{namevar}.png"
-            else:
-                image_name = f"figures/fig_diff_rel_picic_rdrs_{nameexp}_{year_select}_{namevar}.png"                    
-            st.info('06-18 leadtimes of Precipitation are taken from RDRS')
+        # show the preview first, the tiles of the zoomed area are only sent on request
+        with profiling.stage("tile pyramid"):
+            meta  = imagepyramid.open_pyramid(image_name)
+        zooms = ["Overview"] + [f"x{2 ** (meta['preview'] - level)}" for level in range(meta['preview'] - 1, -1, -1)]
+        zoom  = st.select_slider("Zoom", options=zooms)
+
+        if zoom == "Overview":
+            with profiling.stage("preview read"):
+                image = imagepyramid.load_preview(image_name)
+            st.image(image)
+            profiling.sent("preview", image)
         else:
-            st.info('Analysis fields are taken from RSAS')
-            image_name = f"figures/fig_diff_picic_rsas_{nameexp}_{year_select}_{namevar}.png"
-            
-        image = Image.open(image_name)
+            level   = meta['preview'] - zooms.index(zoom)
+            xcenter = st.slider("Horizontal position (%)", 0, 100, 50) / 100
+            ycenter = st.slider("Vertical position (%)", 0, 100, 50) / 100
+            with profiling.stage("view compose"):
+                image = imagepyramid.load_view(image_name, level, xcenter, ycenter)
+            st.image(image)
+            profiling.sent("view", image)
 
-        st.image(image)
+profiling.debug_panel()
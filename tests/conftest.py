@@ -0,0 +1,53 @@
+# !/usr/bin/python3
+
+# Fixtures of the tests: a temporary store and synthetic statoma files.
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+dirroot = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, dirroot)
+sys.path.insert(0, os.path.join(dirroot, ".preprocessing"))
+
+from utils import datastore
+from utils import stationids
+
+#============================= FUNCTIONS
+#%% function to write synthetic statoma files, one every timestep hours from start over ndays
+# every file holds a random subset of a pool of stations (ID LAT LON ALT VAL columns as the real files)
+def write_statoma(directory, namevar="TT", start="1992-01-01", ndays=90, timestep=6, nstation=40, seed=0):
+    rng      = np.random.default_rng(seed)
+    stations = pd.DataFrame({'ID': "x", 'LAT': rng.uniform(42, 60, nstation).round(2),
+                             'LON': rng.uniform(230, 300, nstation).round(2),
+                             'ALT': rng.uniform(0, 2000, nstation).round(0), 'VAL': 1.0})
+    suffixe  = "001" if namevar == "SD" else "000"
+    os.makedirs(directory, exist_ok=True)
+    for date in pd.date_range(start, periods=ndays * 24 // timestep, freq=f"{timestep}h"):
+        subset   = stations[rng.random(nstation) < 0.7]
+        namefile = os.path.join(directory, f"{date:%Y%m%d%H}_statoma_{namevar}_{suffixe}")
+        subset.to_csv(namefile, sep=" ", index=False)
+
+    return(sorted(os.listdir(directory)))
+
+#============================= FIXTURES
+#%% empty store and station dictionary of the test
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(datastore, "dirstore", str(tmp_path / "store"))
+    monkeypatch.setattr(stationids, "state", {'namefile': None, 'mtime': None, 'stations': None, 'index': None,
+                                              'provisional': stationids.state['provisional'][:0],
+                                              'final': np.zeros(0, np.int32)})
+
+    return(tmp_path / "store")
+
+#%% directory of synthetic statoma files of TT over three months of 1992
+@pytest.fixture
+def statoma_dir(tmp_path):
+    directory = str(tmp_path / "statoma")
+    write_statoma(directory)
+
+    return(directory)
@@ -0,0 +1,50 @@
+# !/usr/bin/python3
+
+# Cache of the loaders of the pages: every lookup is recorded as a hit or a miss by
+# the instrumentation (RDRSVIZ_PROFILE=1), and a rewritten data file is loaded again.
+
+import importlib
+
+import pandas as pd
+import pytest
+
+from utils import arrowcache
+from utils import profiling
+
+#============================= FIXTURES
+#%% instrumentation enabled as with RDRSVIZ_PROFILE=1, and an empty cache
+@pytest.fixture
+def profiled(tmp_path, monkeypatch):
+    monkeypatch.setenv("RDRSVIZ_PROFILE", "1")
+    monkeypatch.delenv("RDRSVIZ_PROFILE_LOG", raising=False)
+    importlib.reload(profiling)
+    monkeypatch.setattr(arrowcache, "dircache", str(tmp_path / "cache"))
+    profiling.start_run("test")
+
+    yield
+
+    monkeypatch.undo()
+    importlib.reload(profiling)
+
+#============================= TESTS
+def test_every_lookup_is_recorded(profiled, tmp_path):
+    namefile = tmp_path / "data.csv"
+    pd.DataFrame({'year': [1992, 1993], 'value': [1.0, 2.0]}).to_csv(namefile, index=False)
+    ncalls   = []
+
+    @arrowcache.cached(lambda namefile: [str(namefile)])
+    def load_data(namefile):
+        ncalls.append(namefile)
+        return(pd.read_csv(namefile))
+
+    for i in range(3):
+        data = load_data(namefile)
+    assert data['value'].tolist() == [1.0, 2.0]
+
+    # a rewritten file is a new entry
+    pd.DataFrame({'year': [1992, 1993, 1994], 'value': [1.0, 2.0, 3.0]}).to_csv(namefile, index=False)
+    assert load_data(namefile)['value'].tolist() == [1.0, 2.0, 3.0]
+
+    assert len(ncalls) == 2
+    events = [(entry['name'], entry['hit']) for entry in profiling.local.records if entry['kind'] == "cache"]
+    assert events == [("load_data", False), ("load_data", True), ("load_data", True), ("load_data", False)]
@@ -0,0 +1,31 @@
+# !/usr/bin/python3
+
+# Store of the pages: a partition written by another process (extractor, scheduler,
+# build_datastore) is seen by a running process without restarting it.
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from utils import datastore
+from utils import registry
+
+#============================= FUNCTIONS
+#%% function to write the yearly precipitation of a domain in a new process
+def write_prcp(dirstore, nameexp):
+    datastore.dirstore = dirstore
+    data = pd.DataFrame({'year': [1992, 1993], 'yearlysum': [800.0, 900.0],
+                         'yearlysum_25pct': [700.0, 800.0], 'yearlysum_75pct': [900.0, 1000.0]})
+    datastore.write_partition("yearly_prcp", data, domain="Rockies", nameexp=nameexp)
+
+#============================= TESTS
+def test_new_partitions_are_seen(store):
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        pool.submit(write_prcp, str(store), "EXPA").result()
+        assert registry.get_registry().prcp == {("Rockies", "EXPA")}
+        assert datastore.query("yearly_prcp")['nameexp'].tolist() == ["EXPA", "EXPA"]
+
+        # the datasets and the registry opened above are listed again after the write of the other process
+        pool.submit(write_prcp, str(store), "EXPB").result()
+        assert registry.get_registry().prcp == {("Rockies", "EXPA"), ("Rockies", "EXPB")}
+        assert sorted(datastore.query("yearly_prcp")['nameexp'].unique()) == ["EXPA", "EXPB"]
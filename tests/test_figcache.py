@@ -0,0 +1,115 @@
+# !/usr/bin/python3
+
+# Cache of the rendered figures: bounded in size with the least recently viewed
+# figures dropped first, stale once a partition they were drawn from is rewritten,
+# emptied by invalidate(), and a figure rendered by one thread at a time.
+
+import os
+import time
+import threading
+
+import pandas as pd
+
+from utils import datastore
+from utils import figcache
+
+#============================= FUNCTIONS
+#%% function to build a render function counting its calls in calls (same figure, so same PNG size, for every key)
+def make_render(calls, key, started=None, release=None):
+    def render():
+        import matplotlib.pyplot as plt
+
+        calls.append(key)
+        if started is not None:
+            started.set()
+            release.wait(10)
+        fig, ax = plt.subplots(figsize=(1, 1))
+        ax.plot([0, 1], [0, 1])
+
+        return(fig)
+
+    return(render)
+
+#%% function to write the yearly precipitation of a domain, returns its partition
+def write_prcp(years):
+    data = pd.DataFrame({'year': years, 'yearlysum': 800.0, 'yearlysum_25pct': 700.0, 'yearlysum_75pct': 900.0})
+    datastore.write_partition("yearly_prcp", data, domain="Rockies", nameexp="EXPA")
+
+    return(datastore.partition_dir("yearly_prcp", domain="Rockies", nameexp="EXPA"))
+
+#============================= TESTS
+def test_least_recently_viewed_figures_are_dropped(store):
+    calls  = []
+    size   = len(figcache.FigureCache().get_or_render("size", make_render([], "size")))
+    # room for three figures
+    cache  = figcache.FigureCache(maxbytes=3.5 * size)
+
+    for key in ["a", "b", "c", "a", "d"]:
+        cache.get_or_render(key, make_render(calls, key))
+    assert calls == ["a", "b", "c", "d"]
+    assert list(cache.entries) == ["c", "a", "d"] and cache.nbytes == 3 * size
+
+    cache.get_or_render("b", make_render(calls, "b"))
+    assert calls[-1] == "b" and list(cache.entries) == ["a", "d", "b"]
+
+def test_rewritten_partition_makes_the_figure_stale(store):
+    calls     = []
+    cache     = figcache.FigureCache()
+    partition = write_prcp([1992, 1993])
+
+    cache.get_or_render("prcp", make_render(calls, "prcp"), [partition])
+    cache.get_or_render("prcp", make_render(calls, "prcp"), [partition])
+    assert len(calls) == 1
+
+    # new size of the partition
+    write_prcp([1992, 1993, 1994])
+    cache.get_or_render("prcp", make_render(calls, "prcp"), [partition])
+    assert len(calls) == 2
+
+    # same size, new modification time
+    for dirpath, dirnames, filenames in os.walk(partition):
+        for filename in filenames:
+            mtime = os.stat(os.path.join(dirpath, filename)).st_mtime_ns
+            os.utime(os.path.join(dirpath, filename), ns=(mtime, mtime + 10 ** 9))
+    cache.get_or_render("prcp", make_render(calls, "prcp"), [partition])
+    cache.get_or_render("prcp", make_render(calls, "prcp"), [partition])
+    assert len(calls) == 3 and len(cache.entries) == 1
+
+def test_invalidate(store):
+    calls  = []
+    cache  = figcache.FigureCache()
+    for key in [("melt", "EXPA"), ("melt", "EXPB"), ("prcp", "EXPA")]:
+        cache.get_or_render(key, make_render(calls, key))
+
+    cache.invalidate(lambda key: key[1] == "EXPA")
+    assert list(cache.entries) == [("melt", "EXPB")]
+    cache.get_or_render(("melt", "EXPA"), make_render(calls, ("melt", "EXPA")))
+    assert len(calls) == 4
+
+    cache.invalidate()
+    assert list(cache.entries) == [] and cache.nbytes == 0
+
+def test_figure_rendering_is_waited_for(store):
+    calls   = []
+    cache   = figcache.FigureCache()
+    started = threading.Event()
+    release = threading.Event()
+    results = dict()
+
+    def view(name, render):
+        results[name] = cache.get_or_render("melt", render)
+
+    first   = threading.Thread(target=view, args=("first", make_render(calls, "first", started, release)))
+    first.start()
+    assert started.wait(10)
+    # the second session selects the figure being rendered by the first one
+    second  = threading.Thread(target=view, args=("second", make_render(calls, "second")))
+    second.start()
+    time.sleep(0.2)
+    assert "melt" in cache.rendering and not results
+
+    release.set()
+    first.join(10)
+    second.join(10)
+    assert calls == ["first"]
+    assert results["first"] == results["second"] and cache.rendering == {}
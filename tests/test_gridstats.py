@@ -0,0 +1,85 @@
+# !/usr/bin/python3
+
+# Statistics of the boxes drawn on the snowmelt page: written to the store of the
+# boxes (the store keeps the domains of Configuration.ini), found by the registry,
+# and the least recently viewed boxes removed above the size of that store.
+
+import os
+import dataclasses
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from utils import datastore
+from utils import gridstats
+from utils import registry
+
+#============================= FIXTURES
+#%% gridded fields of one experiment, and an empty store of the boxes
+@pytest.fixture
+def gridded(store, tmp_path, monkeypatch):
+    dirgridded = tmp_path / "gridded"
+    os.makedirs(dirgridded)
+    rng        = np.random.default_rng(0)
+    coords     = {'year': np.arange(1980, 1986), 'lat': np.arange(40, 60, 0.5), 'lon': np.arange(270, 300, 0.5)}
+    shape      = tuple(len(values) for values in coords.values())
+    xr.Dataset({'MELTDAY': (tuple(coords), rng.integers(90, 150, shape).astype(np.float32))},
+               coords=coords).to_netcdf(dirgridded / "snowmelt_EXPA.nc")
+    xr.Dataset({'PRCP': (tuple(coords), rng.uniform(0.5, 1.5, shape).astype(np.float32))},
+               coords=coords).to_netcdf(dirgridded / "yearlyprcp_EXPA.nc")
+
+    get_registry = registry.get_registry
+    monkeypatch.setattr(registry, "get_registry", lambda: dataclasses.replace(get_registry(), griddedpath=str(dirgridded)))
+    monkeypatch.setattr(datastore, "dirboxes", str(tmp_path / "boxes"))
+    monkeypatch.setattr(gridstats, "dirindex", str(tmp_path / "gridindex"))
+
+    return(dirgridded)
+
+#============================= TESTS
+def test_boxes_are_not_written_to_the_store(gridded):
+    box    = (45.1, 47.3, 280.2, 285.7)
+    assert gridstats.compute_domain(box)
+    assert not gridstats.compute_domain(box)
+
+    config = registry.get_registry()
+    assert config.domain_store(box) == datastore.dirboxes
+    assert config.experiments_with_melt(box) == ("EXPA",) and config.experiments_with_prcp(box) == ("EXPA",)
+    data   = datastore.query("yearly_prcp", root=datastore.dirboxes, domain=datastore.domain_key(box))
+    assert data['year'].tolist() == list(range(1980, 1986))
+    assert not os.path.isdir(datastore.partition_dir("yearly_prcp", domain=datastore.domain_key(box)))
+
+    # a domain of Configuration.ini is written to the store
+    domain = next(iter(config.domains.values()))
+    assert gridstats.compute_domain(domain)
+    assert config.domain_store(domain) == datastore.dirstore
+    assert os.path.isdir(datastore.partition_dir("melting_angle", domain=datastore.domain_key(domain)))
+    assert not os.path.isdir(datastore.partition_dir("melting_angle", datastore.dirboxes, domain=datastore.domain_key(domain)))
+
+def test_least_recently_viewed_boxes_are_removed(gridded, monkeypatch):
+    boxes  = [(45, 46 + i, 280, 285) for i in range(4)]
+    gridstats.compute_domain(boxes[0])
+    # room for about three boxes
+    monkeypatch.setattr(gridstats, "maxbytes", 3.5 * gridstats.list_boxes()[datastore.domain_key(boxes[0])][1])
+
+    for box in boxes[1:3]:
+        gridstats.compute_domain(box)
+    # the first box is viewed again, the second one is now the least recently viewed
+    assert not gridstats.compute_domain(boxes[0])
+    gridstats.compute_domain(boxes[3])
+
+    kept   = set(gridstats.list_boxes())
+    assert kept == {datastore.domain_key(box) for box in (boxes[0], boxes[2], boxes[3])}
+    melt   = {domain for domain, nameexp in registry.get_registry().melt}
+    assert datastore.domain_key(boxes[1]) not in melt and datastore.domain_key(boxes[3]) in melt
+
+def test_missing_backend_is_reported(gridded, monkeypatch):
+    # xarray without the netCDF4 backend installed
+    import xarray.backends.plugins as plugins
+    list_engines = plugins.list_engines
+    engines      = lambda: {name: engine for name, engine in list_engines().items() if name != "netcdf4"}
+    monkeypatch.setattr(plugins, "list_engines", engines)
+    monkeypatch.setattr(xr.backends, "list_engines", engines)
+
+    with pytest.raises(ValueError, match="backend netcdf4 is not installed \\(pip install netCDF4\\)"):
+        gridstats.compute_domain((45.1, 47.3, 280.2, 285.7))
@@ -0,0 +1,82 @@
+# !/usr/bin/python3
+
+# Prefetch of the neighbouring selections: at most maxjobs jobs are queued per
+# session, and the jobs of the previous selection not started yet are cancelled
+# when the selection changes.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import prefetch
+
+#============================= FIXTURES
+#%% pool of one thread, held by a first job until the test releases it
+@pytest.fixture
+def pool(monkeypatch):
+    pool    = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setitem(prefetch.state, "pool", pool)
+
+    yield pool
+
+    pool.shutdown(wait=True, cancel_futures=True)
+
+#============================= FUNCTIONS
+#%% function to build jobs recording their name in ran, the first one setting started and waiting for release
+def make_jobs(names, ran, started=None, release=None):
+    def job(name):
+        def func():
+            if release is not None and name == names[0]:
+                started.set()
+                release.wait(10)
+            ran.append(name)
+        return(func)
+
+    return([(name, job(name)) for name in names])
+
+#============================= TESTS
+def test_jobs_are_limited_per_session(pool, monkeypatch):
+    monkeypatch.setattr(prefetch, "maxjobs", 3)
+    started  = threading.Event()
+    release  = threading.Event()
+    ran      = []
+
+    sessions = [prefetch.Prefetcher(), prefetch.Prefetcher()]
+    sessions[0].warm(make_jobs(["a1", "a2", "a3", "a4", "a5"], ran, started, release))
+    sessions[1].warm(make_jobs(["b1", "b2", "b3", "b4"], ran))
+    # the most likely jobs of each session are queued, the others dropped
+    assert list(sessions[0].futures) == ["a1", "a2", "a3"]
+    assert list(sessions[1].futures) == ["b1", "b2", "b3"]
+
+    release.set()
+    pool.shutdown(wait=True)
+    assert ran == ["a1", "a2", "a3", "b1", "b2", "b3"]
+
+def test_jobs_not_started_are_cancelled(pool, monkeypatch):
+    started  = threading.Event()
+    release  = threading.Event()
+    ran      = []
+
+    session  = prefetch.Prefetcher()
+    session.warm(make_jobs(["2019", "2020", "2021"], ran, started, release))
+    futures  = dict(session.futures)
+    assert started.wait(10)
+
+    # the selection changes while the first job runs
+    session.warm(make_jobs(["2022", "2021"], ran))
+    assert futures["2020"].cancelled() and not futures["2021"].cancelled()
+    assert set(session.futures) == {"2019", "2021", "2022"}
+
+    release.set()
+    pool.shutdown(wait=True)
+    assert ran == ["2019", "2021", "2022"]
+
+    # the jobs done are not queued again
+    pool     = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setitem(prefetch.state, "pool", pool)
+    session.warm(make_jobs(["2019", "2022", "2023"], ran))
+    assert session.done == {"2019", "2021", "2022"} and list(session.futures) == ["2023"]
+
+    pool.shutdown(wait=True)
+    assert ran == ["2019", "2021", "2022", "2023"]
@@ -0,0 +1,83 @@
+# !/usr/bin/python3
+
+# Presence of the stations at every cycle: the counts per cycle and the gaps of the
+# stations queried from the bitmaps of the store are the ones of the statoma files.
+
+import os
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import statoma
+import extract_statoma_nbstation as extractor
+from utils import stationcycles
+from utils import stationids
+from utils import stationindex
+
+#============================= FUNCTIONS
+#%% function to extract the counts and the cycles of the statoma files of 1992 to the store
+def extract(statoma_dir):
+    filenames = statoma.list_statoma_files("TT", 1992, statoma_dir)
+    presence  = stationcycles.Presence(1992, 6)
+    grouped   = statoma.stream_counts([os.path.join(statoma_dir, filename) for filename in filenames], presence=presence)
+    pivoted   = statoma.format_counts(extractor.save_stations(grouped, presence))
+
+    stationindex.write_counts(pivoted, namevar="TT", nameexp="EXPA", year=1992)
+    stationcycles.write_cycles(presence, "TT", "EXPA", 1992)
+
+    return(filenames)
+
+#%% function to read the stations of every statoma file from start (included) to end (excluded) in a region
+# returns one row per (file date, station)
+def read_files(statoma_dir, filenames, start, end, bounds):
+    latmin, latmax, lonmin, lonmax = bounds
+    rows = []
+    for filename in filenames:
+        date = datetime.datetime.strptime(filename[0:10], "%Y%m%d%H")
+        if not start <= date < end:
+            continue
+        data = pd.read_csv(os.path.join(statoma_dir, filename), sep=r"\s+")
+        data = data[data['LAT'].between(latmin, latmax) & np.mod(data['LON'], 360).between(lonmin, lonmax)]
+        rows.append(pd.DataFrame({'DATE': date, 'STATION': stationids.lookup(data)}))
+
+    return(pd.concat(rows, ignore_index=True))
+
+#============================= TESTS
+def test_cycles_match_the_files(store, statoma_dir):
+    filenames = extract(statoma_dir)
+
+    bounds    = (45, 55, 250, 280)
+    start     = datetime.datetime(1992, 1, 10, 3)
+    # the query runs past the end of the year extracted: the years without cycles are skipped
+    end       = datetime.datetime(1993, 1, 15)
+    data, dates, presence = stationcycles.query_cycles("TT", "EXPA", start, end, bounds)
+    files     = read_files(statoma_dir, filenames, start, end, bounds)
+
+    # one cycle every 6 hours from the first one after start to the end of 1992
+    assert dates[0] == pd.Timestamp(1992, 1, 10, 6) and dates[-1] == pd.Timestamp(1992, 12, 31, 18)
+    assert (np.diff(dates) == np.timedelta64(6, "h")).all()
+    assert set(data['STATION']) == set(files['STATION'])
+
+    counts    = stationcycles.cycle_counts(dates, presence)
+    expected  = files.groupby('DATE')['STATION'].nunique().reindex(dates, fill_value=0)
+    np.testing.assert_array_equal(counts.to_numpy(), expected.to_numpy())
+
+    gaps      = stationcycles.station_gaps(data, dates, presence).set_index('STATION')
+    for station, group in files.sort_values('DATE').groupby('STATION'):
+        hours = np.diff(group['DATE'].to_numpy()) / np.timedelta64(1, "h")
+        assert gaps.loc[station, 'NPRESENT'] == len(group)
+        assert gaps.loc[station, 'FIRST'] == group['DATE'].iloc[0]
+        assert gaps.loc[station, 'LAST'] == group['DATE'].iloc[-1]
+        assert gaps.loc[station, 'LONGESTGAP'] == (hours.max() if len(hours) else 0)
+
+def test_empty_region(store, statoma_dir):
+    extract(statoma_dir)
+
+    # no station in the region
+    data, dates, presence = stationcycles.query_cycles("TT", "EXPA", datetime.datetime(1992, 2, 1), datetime.datetime(1992, 2, 2),
+                                                       (0, 1, 0, 1))
+    assert data.empty and not len(dates)
+    counts    = stationcycles.cycle_counts(dates, presence)
+    gaps      = stationcycles.station_gaps(data, dates, presence)
+    assert counts.empty and gaps.empty
@@ -0,0 +1,68 @@
+# !/usr/bin/python3
+
+# Dictionary of the stations: the IDs given by processes running at the same time
+# are the same for the same station, dense and never changed afterwards.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils import datastore
+from utils import stationids
+
+#============================= FUNCTIONS
+#%% function to get the stations of a seed: a common pool and stations of its own
+def make_stations(seed):
+    common = pd.DataFrame({'LAT': np.arange(40, 60, 0.5), 'LON': np.arange(240, 280, 1.0), 'ALT': 100.0})
+    rng    = np.random.default_rng(seed)
+    own    = pd.DataFrame({'LAT': rng.uniform(40, 60, 30).round(2), 'LON': rng.uniform(-120, -60, 30).round(2), 'ALT': 0.0})
+
+    return(pd.concat([common.sample(frac=1, random_state=seed), own], ignore_index=True))
+
+#%% function to assign the IDs of the stations of a seed in a new process, in batches as the files of an extraction
+def assign_in_process(dirstore, seed):
+    datastore.dirstore = dirstore
+    data = make_stations(seed)
+    ids  = np.concatenate([stationids.assign(data.iloc[i:i + 10]) for i in range(0, len(data), 10)])
+    stationids.save()
+
+    return(data.assign(STATION=stationids.final(ids)))
+
+#============================= TESTS
+def test_assign_is_stable_across_processes(store):
+    os.makedirs(store, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(assign_in_process, [str(store)] * 8, range(8)))
+
+    dictionary = stationids.load(force=True)
+    assert dictionary['STATION'].tolist() == list(range(len(dictionary)))
+    assert not dictionary.duplicated(subset=stationids.keys_station).any()
+    assert len(dictionary) == 40 + 8 * 30
+
+    # every process got the IDs of the dictionary, the same ones for the common stations
+    for data in results:
+        coords = stationids.coordinates(data['STATION'])
+        np.testing.assert_allclose(coords['LAT'], data['LAT'], atol=1e-4)
+        np.testing.assert_allclose(coords['LON'], np.mod(data['LON'], 360), atol=1e-4)
+        np.testing.assert_array_equal(stationids.lookup(data), data['STATION'])
+
+    # a later process finds every station with its ID and does not write the dictionary again
+    mtime  = os.stat(stationids.dictionary_file()).st_mtime_ns
+    again  = assign_in_process(str(store), 3)
+    pd.testing.assert_frame_equal(again, results[3])
+    assert os.stat(stationids.dictionary_file()).st_mtime_ns == mtime
+
+def test_assign_in_another_store(store, monkeypatch):
+    data   = make_stations(0)
+    ids    = stationids.assign(data)
+    stationids.save()
+    assert stationids.final(ids).tolist() == list(range(len(data)))
+
+    # a second store (e.g. the synthetic stores of the benchmarks) starts its own dictionary
+    monkeypatch.setattr(datastore, "dirstore", str(store) + "_other")
+    ids    = stationids.assign(data.iloc[::-1])
+    stationids.save()
+    assert sorted(stationids.final(ids)) == list(range(len(data)))
+    assert len(stationids.load()) == len(data)
@@ -0,0 +1,45 @@
+# !/usr/bin/python3
+
+# Comparison of combinations on the stations page: the totals of two count
+# partitions are aligned on the station IDs, and the summary counts the stations
+# shared with the reference, the ones missing from it and the mean difference.
+
+import numpy as np
+import pandas as pd
+
+from utils import stationindex
+from utils import stations
+
+#============================= FUNCTIONS
+#%% function to write the count partition of the stations of pool selected by rows, with their totals in January
+def write_counts(pool, rows, totals, nameexp):
+    data = pool.iloc[rows].reset_index(drop=True)
+    data = data.assign(**{namecol: 0 for namecol in stations.month_names})
+    data = data.assign(Jan=totals, Total=totals)
+    stationindex.write_counts(data, namevar="TT", nameexp=nameexp, year=1992)
+
+#============================= TESTS
+def test_combinations_are_aligned_on_the_stations(store):
+    pool    = pd.DataFrame({'LAT': [45.5, 47.25, 50.0, 52.75, 55.5], 'LON': [280.5, 270.25, 250.0, 260.75, 290.5],
+                            'ALT': [100.0, 200.0, 300.0, 400.0, 500.0]})
+    # EXPB misses the first station of EXPA and has a station EXPA does not have
+    write_counts(pool, [0, 1, 2, 3], [10, 20, 30, 40], "EXPA")
+    write_counts(pool, [1, 2, 3, 4], [25, 30, 31, 7], "EXPB")
+
+    labels  = ["EXPA 1992", "EXPB 1992"]
+    results = stations.load_combinations("TT", [("EXPA", 1992), ("EXPB", 1992)])
+    aligned = stations.align_stations([data for data, month_sum in results], labels)
+
+    assert len(aligned) == 5 and aligned['STATION'].is_unique
+    assert aligned[labels[0]].notna().sum() == 4 and aligned[labels[1]].notna().sum() == 4
+    assert (aligned[labels[0]].notna() & aligned[labels[1]].notna()).sum() == 3
+
+    summary = stations.comparison_summary(aligned, labels)
+    assert summary.loc[labels[0]].to_dict() == {'stations': 4, 'common with reference': 4, 'not in reference': 0,
+                                                'assimilated cases': 100, 'mean difference per station': 0.0}
+    assert summary.loc[labels[1], 'stations'] == 4
+    assert summary.loc[labels[1], 'common with reference'] == 3
+    assert summary.loc[labels[1], 'not in reference'] == 1
+    assert summary.loc[labels[1], 'assimilated cases'] == 93
+    # (25 - 20 + 30 - 30 + 31 - 40) / 3
+    assert np.isclose(summary.loc[labels[1], 'mean difference per station'], -4 / 3)
@@ -0,0 +1,127 @@
+# !/usr/bin/python3
+
+# Counts of the assimilated stations: every mode of the extractor gives the same
+# output, and an incremental update from the manifest gives the one of a rebuild.
+
+import os
+import argparse
+
+import pandas as pd
+
+import manifest
+import statoma
+import extract_statoma_nbstation as extractor
+from utils import stationcycles
+
+from conftest import write_statoma
+
+#============================= FUNCTIONS
+#%% function to count a list of files in stream mode and pivot them as in the extractor
+def count_files(directory, filenames, presence=None):
+    presence = presence or stationcycles.Presence(1992, 6)
+    grouped  = statoma.stream_counts([os.path.join(directory, filename) for filename in filenames], presence=presence)
+
+    return(statoma.format_counts(extractor.save_stations(grouped, presence)))
+
+#%% function to run the extraction of the TT files of 1992 into an output, as extract_statoma_nbstation.py
+def run_extractor(statoma_dir, namefileout, mode="stream"):
+    args = argparse.Namespace(mode=mode, workers=1, memory_limit=1, spill_dir=None)
+    extractor.build_output("TT", "EXPA", 1992, statoma_dir, namefileout, args)
+
+    return(pd.read_parquet(namefileout))
+
+#============================= TESTS
+def test_modes_give_the_same_counts(store, statoma_dir, tmp_path):
+    filenames = statoma.list_statoma_files("TT", 1992, statoma_dir)
+    paths     = [os.path.join(statoma_dir, filename) for filename in filenames]
+
+    presences = {mode: stationcycles.Presence(1992, 6) for mode in ("stream", "spill", "concat")}
+    grouped   = {'stream': statoma.stream_counts(paths, workers=2, presence=presences['stream']),
+                 # a ceiling of 1 kB spills the counts to disk every few files
+                 'spill': statoma.spill_counts(paths, str(tmp_path / "spill"), 1024, workers=2, presence=presences['spill']),
+                 'concat': extractor.count_concat("TT", 1992, statoma_dir, presences['concat'])}
+    assert os.listdir(tmp_path / "spill")
+
+    pivoted   = {mode: statoma.format_counts(extractor.save_stations(grouped[mode], presences[mode])) for mode in grouped}
+    pd.testing.assert_frame_equal(pivoted['stream'], pivoted['spill'])
+    pd.testing.assert_frame_equal(pivoted['stream'], pivoted['concat'])
+    assert pivoted['stream']['Total'].sum() == sum(len(pd.read_csv(path, sep=r"\s+")) for path in paths)
+
+    bitmaps   = {mode: presence.to_frame().set_index('STATION')['BITMAP'].sort_index() for mode, presence in presences.items()}
+    pd.testing.assert_series_equal(bitmaps['stream'], bitmaps['spill'])
+    pd.testing.assert_series_equal(bitmaps['stream'], bitmaps['concat'])
+
+def test_manifest_update_equals_rebuild(store, statoma_dir):
+    filenames = statoma.list_statoma_files("TT", 1992, statoma_dir)
+    # first extraction without the files of March
+    first     = [filename for filename in filenames if filename[4:6] != "03"]
+    previous  = {'files': manifest.scan_files(statoma_dir, first)}
+    presence  = stationcycles.Presence(1992, 6)
+    pivoted   = count_files(statoma_dir, first, presence)
+
+    # the files of March arrive, a file of February is rewritten with new stations and one of January is removed
+    changed   = [filename for filename in first if filename[4:6] == "02"][3]
+    removed   = [filename for filename in first if filename[4:6] == "01"][5]
+    write_statoma(os.path.join(statoma_dir, "new"), start=f"{changed[0:4]}-{changed[4:6]}-{changed[6:8]} {changed[8:10]}:00",
+                  ndays=1, timestep=24, nstation=5, seed=1)
+    os.replace(os.path.join(statoma_dir, "new", changed), os.path.join(statoma_dir, changed))
+    os.remove(os.path.join(statoma_dir, removed))
+
+    filenames = statoma.list_statoma_files("TT", 1992, statoma_dir)
+    files     = manifest.scan_files(statoma_dir, filenames)
+    new_files, dirty_months = manifest.diff_manifest(previous, files)
+    assert dirty_months == [1, 2]
+    assert all(filename[4:6] == "03" for filename in new_files) and new_files
+
+    presence.clear_months(dirty_months)
+    parse     = new_files + [filename for filename, entry in files.items() if entry['month'] in dirty_months]
+    delta     = statoma.stream_counts([os.path.join(statoma_dir, filename) for filename in sorted(parse)], presence=presence)
+    updated   = statoma.update_counts(pivoted, extractor.save_stations(delta, presence), dirty_months)
+
+    rebuilt_presence = stationcycles.Presence(1992, 6)
+    rebuilt   = count_files(statoma_dir, filenames, rebuilt_presence)
+    pd.testing.assert_frame_equal(updated, rebuilt)
+    pd.testing.assert_frame_equal(presence.to_frame().sort_values('STATION').reset_index(drop=True),
+                                  rebuilt_presence.to_frame().sort_values('STATION').reset_index(drop=True))
+
+def test_output_without_manifest_is_counted_again(store, statoma_dir, tmp_path):
+    namefileout = str(tmp_path / "data" / "count_nbstation_assim_TT_EXPA_1992.parquet")
+    os.makedirs(os.path.dirname(namefileout))
+
+    # first extraction without the files of March
+    march       = [filename for filename in statoma.list_statoma_files("TT", 1992, statoma_dir) if filename[4:6] == "03"]
+    os.makedirs(tmp_path / "march")
+    for filename in march:
+        os.replace(os.path.join(statoma_dir, filename), tmp_path / "march" / filename)
+    assert run_extractor(statoma_dir, namefileout)['Mar'].sum() == 0
+
+    # the task is killed between its output and its manifest, then the files of March arrive
+    os.remove(manifest.manifest_path(namefileout))
+    for filename in march:
+        os.replace(tmp_path / "march" / filename, os.path.join(statoma_dir, filename))
+
+    rerun       = run_extractor(statoma_dir, namefileout, mode="spill")
+    assert manifest.read_manifest(namefileout) is not None
+    assert rerun['Mar'].sum() > 0
+
+    full        = run_extractor(statoma_dir, str(tmp_path / "data" / "full.parquet"))
+    pd.testing.assert_frame_equal(rerun, full)
+
+def test_output_built_before_the_manifests_is_updated(store, statoma_dir, tmp_path, capsys):
+    namefileout = str(tmp_path / "data" / "count_nbstation_assim_TT_EXPA_1992.parquet")
+    os.makedirs(os.path.dirname(namefileout))
+
+    # an output of the original extractor: the counts only, no manifest nor partition in the store
+    filenames   = statoma.list_statoma_files("TT", 1992, statoma_dir)
+    count_files(statoma_dir, filenames).to_parquet(namefileout)
+    run_extractor(statoma_dir, namefileout)
+    assert "every file is parsed again" in capsys.readouterr().out
+    assert manifest.read_manifest(namefileout) is not None
+
+    # the next run only parses the new files
+    write_statoma(statoma_dir, start="1992-04-01", ndays=2, seed=2)
+    updated     = run_extractor(statoma_dir, namefileout)
+    assert "8 new file(s), month(s) to recount []" in capsys.readouterr().out
+    full        = run_extractor(statoma_dir, str(tmp_path / "data" / "full.parquet"))
+    pd.testing.assert_frame_equal(updated, full)
+    assert updated['Apr'].sum() > 0
@@ -0,0 +1,203 @@
+# !/usr/bin/python3
+
+# Cache of the data loaded by the pages, on disk and shared by every server process.
+#
+#   data/cache/<loader>_<key of the arguments>_<version of the data files>/meta.json
+#   data/cache/<loader>_<key of the arguments>_<version of the data files>/<i>.arrow
+#
+# The data frames returned by a loader are saved as Arrow IPC files and read back
+# through a memory map, so the replicas of the server share the same pages of the
+# operating system cache instead of one pickled copy per process. An entry is
+# named after the version (size and modification time) of the data files it was
+# loaded from, so an entry of rewritten files is not found anymore; the least
+# recently used entries are removed once the cache is above its size. In a server
+# process, an entry is loaded by one thread at a time: a page selecting what a
+# prefetch job (utils/prefetch.py) is loading waits for it and reads its entry.
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+import functools
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+
+from utils import figcache
+from utils import profiling
+
+#============================ CONFIGURATION
+#
+dircache         = os.environ.get("RDRSVIZ_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache"))
+
+# upper bound of the size of the cache on disk
+maxbytes_default = 1024 * 1024 * 1024
+maxbytes         = int(os.environ.get("RDRSVIZ_CACHE_BYTES", maxbytes_default))
+
+# entries being loaded by the threads of the process: lock and number of threads using it
+loading          = dict()
+loadinglock      = threading.Lock()
+
+# result of read_entry when the entry is not in the cache
+missing          = object()
+
+#============================= FUNCTIONS
+#%% function to build the name of an entry
+def entry_name(nameloader, args, sources):
+    key     = hashlib.sha1(repr(args).encode()).hexdigest()[:16]
+    version = hashlib.sha1(repr(figcache.data_version(sources)).encode()).hexdigest()[:16]
+
+    return(f"{nameloader}_{key}_{version}")
+
+#%% function to split a result into Arrow tables and a JSON description of its structure
+# a result is a data frame, a series, a value (str, int, float, bool, None) or a list/tuple of them
+def encode(result, tables):
+    if isinstance(result, pd.DataFrame):
+        tables.append(pa.Table.from_pandas(result, preserve_index=False))
+        return({'frame': len(tables) - 1})
+    if isinstance(result, pd.Series):
+        tables.append(pa.Table.from_pandas(result.to_frame(name="values"), preserve_index=True))
+        return({'series': len(tables) - 1, 'name': result.name})
+    if isinstance(result, (list, tuple)):
+        return({'list': [encode(item, tables) for item in result], 'tuple': isinstance(result, tuple)})
+    if result is None or isinstance(result, (str, int, float, bool)):
+        return({'value': result})
+
+    raise TypeError(f"arrowcache cannot store a {type(result).__name__}")
+
+#%% function to rebuild a result from its description and the memory mapped files of the entry
+def decode(structure, direntry):
+    if 'frame' in structure:
+        return(read_table(direntry, structure['frame']).to_pandas(split_blocks=True, date_as_object=False))
+    if 'series' in structure:
+        series = read_table(direntry, structure['series']).to_pandas(split_blocks=True, date_as_object=False)['values']
+        return(series.rename(structure['name']))
+    if 'list' in structure:
+        items = [decode(item, direntry) for item in structure['list']]
+        return(tuple(items) if structure['tuple'] else items)
+
+    return(structure['value'])
+
+#%% function to read one table of an entry without copying it in memory
+def read_table(direntry, i):
+    # the buffers of the table keep the memory map open
+    source = pa.memory_map(os.path.join(direntry, f"{i}.arrow"), "r")
+
+    return(pa.ipc.open_file(source).read_all())
+
+#%% function to read the result of an entry, missing if it is not in the cache
+def read_entry(direntry):
+    try:
+        with open(os.path.join(direntry, "meta.json")) as f:
+            structure = json.load(f)
+        result = decode(structure, direntry)
+        # the modification time of an entry is the time of its last use
+        os.utime(direntry)
+    except (FileNotFoundError, NotADirectoryError):
+        # no entry yet, or removed by another process while it was read
+        return(missing)
+
+    return(result)
+
+#%% context manager held by the thread loading an entry, the other threads wait for it
+@contextmanager
+def loading_entry(direntry):
+    with loadinglock:
+        lock, nthreads    = loading.get(direntry, (None, 0))
+        loading[direntry] = (lock or threading.Lock(), nthreads + 1)
+        lock              = loading[direntry][0]
+
+    try:
+        with lock:
+            yield
+    finally:
+        with loadinglock:
+            lock, nthreads = loading.pop(direntry)
+            if nthreads > 1:
+                loading[direntry] = (lock, nthreads - 1)
+
+#%% function to save a result in a new entry
+def write_entry(direntry, result):
+    tables    = []
+    structure = encode(result, tables)
+
+    dirtmp    = f"{direntry}.{os.getpid()}.tmp"
+    shutil.rmtree(dirtmp, ignore_errors=True)
+    os.makedirs(dirtmp)
+    for i, table in enumerate(tables):
+        with pa.OSFile(os.path.join(dirtmp, f"{i}.arrow"), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    with open(os.path.join(dirtmp, "meta.json"), "w") as f:
+        json.dump(structure, f)
+
+    try:
+        os.replace(dirtmp, direntry)
+    except OSError:
+        # another process saved the same entry in the meantime
+        shutil.rmtree(dirtmp, ignore_errors=True)
+
+#%% function to get the size on disk of an entry
+def entry_size(direntry):
+    return(sum(os.path.getsize(os.path.join(direntry, filename)) for filename in os.listdir(direntry)))
+
+#%% function to remove the least recently used entries until the cache is below maxbytes
+def evict():
+    entries = []
+    for nameentry in os.listdir(dircache):
+        # skip the entries being written
+        if nameentry.endswith(".tmp"):
+            continue
+        direntry = os.path.join(dircache, nameentry)
+        try:
+            entries.append((os.stat(direntry).st_mtime_ns, entry_size(direntry), direntry))
+        except OSError:
+            # removed by another process
+            continue
+
+    nbytes = sum(size for mtime, size, direntry in entries)
+    for mtime, size, direntry in sorted(entries):
+        if nbytes <= maxbytes:
+            break
+        # a process reading the entry keeps its memory maps of the removed files
+        shutil.rmtree(direntry, ignore_errors=True)
+        nbytes -= size
+
+#%% function to remove every entry
+def clear():
+    shutil.rmtree(dircache, ignore_errors=True)
+
+#%% decorator caching the result of a loader
+# sources(*args, **kwargs) returns the data files (or directories) the result is loaded from, e.g.
+#   @arrowcache.cached(lambda domain, nameexps: [datastore.partition_dir("melting_date", domain=datastore.domain_key(domain))])
+#   def load_data(domain, nameexps):
+def cached(sources):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            direntry = os.path.join(dircache, entry_name(func.__name__, (args, sorted(kwargs.items())), sources(*args, **kwargs)))
+
+            result   = read_entry(direntry)
+            if result is missing:
+                with loading_entry(direntry):
+                    # loaded by another thread while this one was waiting
+                    result = read_entry(direntry)
+                    if result is missing:
+                        profiling.cache_event(func.__name__, False)
+                        with profiling.stage(func.__name__):
+                            result = func(*args, **kwargs)
+
+                        os.makedirs(dircache, exist_ok=True)
+                        write_entry(direntry, result)
+                        evict()
+                        return(result)
+
+            profiling.cache_event(func.__name__, True)
+
+            return(result)
+
+        return(wrapper)
+
+    return(decorate)
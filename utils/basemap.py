@@ -0,0 +1,130 @@
+# !/usr/bin/python3
+
+# Cache of the base map (rivers and coastlines) drawn under the snowmelt domains.
+#
+# The 10m Natural Earth shapes are clipped to the map extent and simplified once,
+# then saved in data/basemap so that every session (and every user) reuses them
+# instead of reading and re-projecting the full shapefiles on each rerun. Every
+# box drawn on the snowmelt page has its extent: the least recently used files
+# are removed once the directory is above its size, as in the loader cache.
+
+import os
+import pickle
+from functools import lru_cache
+
+from utils import profiling
+
+#============================ CONSTANTS
+#
+dirbasemap = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "basemap")
+
+# upper bound of the size of the base maps on disk
+maxbytes   = int(os.environ.get("RDRSVIZ_BASEMAP_BYTES", 64 * 1024 * 1024))
+
+# Natural Earth layers of the base map: (category, name)
+layers     = {
+    'rivers':    ('physical', 'rivers_lake_centerlines'),
+    'coastline': ('physical', 'coastline'),
+}
+
+# the simplification tolerance is this fraction of the width of the map
+tolerance  = 1. / 2000
+
+#============================= FUNCTIONS
+#%% function to build the name of the cache file of an extent [lonmin, lonmax, latmin, latmax]
+def basemap_path(extent):
+    lonmin, lonmax, latmin, latmax = extent
+
+    return(os.path.join(dirbasemap, f"basemap_lon{lonmin}to{lonmax}_lat{latmin}to{latmax}.pkl"))
+
+#%% function to clip and simplify the Natural Earth shapes to an extent
+@profiling.timed("basemap build")
+def build_basemap(extent):
+    import shapely.wkb
+    from shapely.geometry import box
+    from cartopy.feature import NaturalEarthFeature
+
+    lonmin, lonmax, latmin, latmax = extent
+    clip     = box(lonmin, latmin, lonmax, latmax)
+    simplify = tolerance * (lonmax - lonmin)
+
+    basemap  = dict()
+    for namelayer, (category, name) in layers.items():
+        feature    = NaturalEarthFeature(category=category, name=name, scale='10m')
+        geometries = []
+        for geometry in feature.intersecting_geometries(extent):
+            geometry = geometry.intersection(clip).simplify(simplify, preserve_topology=False)
+            if not geometry.is_empty:
+                geometries.append(shapely.wkb.dumps(geometry))
+        basemap[namelayer] = geometries
+
+    return(basemap)
+
+#%% function to remove the least recently used base maps until the directory is below maxbytes
+def evict():
+    files  = []
+    for namefile in os.listdir(dirbasemap):
+        # skip the files being written
+        if namefile.endswith(".tmp"):
+            continue
+        try:
+            stat = os.stat(os.path.join(dirbasemap, namefile))
+        except OSError:
+            # removed by another process
+            continue
+        files.append((stat.st_mtime_ns, stat.st_size, os.path.join(dirbasemap, namefile)))
+
+    nbytes = sum(size for mtime, size, namefile in files)
+    for mtime, size, namefile in sorted(files):
+        if nbytes <= maxbytes:
+            break
+        try:
+            os.remove(namefile)
+        except FileNotFoundError:
+            pass
+        nbytes -= size
+
+#%% function to load the base map of an extent, building it on the first call
+@lru_cache(maxsize=16)
+def load_basemap(extent):
+    import shapely.wkb
+
+    namefile = basemap_path(extent)
+
+    try:
+        with open(namefile, "rb") as f:
+            basemap = pickle.load(f)
+        # the modification time of a base map is the time of its last use
+        os.utime(namefile)
+    except FileNotFoundError:
+        # not built yet, or removed by another process
+        basemap  = None
+
+    if basemap is None:
+        basemap  = build_basemap(extent)
+
+        # write to a temporary file first, another session may read the cache at the same time
+        os.makedirs(dirbasemap, exist_ok=True)
+        namefiletmp = f"{namefile}.{os.getpid()}.tmp"
+        with open(namefiletmp, "wb") as f:
+            pickle.dump(basemap, f)
+        os.replace(namefiletmp, namefile)
+        evict()
+
+    geometries = {namelayer: [shapely.wkb.loads(geometry) for geometry in basemap[namelayer]] for namelayer in basemap}
+
+    return(geometries)
+
+#%% function to draw the cached base map on a cartopy axis
+def draw_basemap(ax, extent):
+    import cartopy.crs as ccrs
+
+    geometries = load_basemap(tuple(extent))
+
+    ax.add_geometries(geometries['rivers'], crs=ccrs.PlateCarree(),
+                      facecolor='none', edgecolor='blue', linewidth=0.5)
+    # the default style of ax.coastlines()
+    ax.add_geometries(geometries['coastline'], crs=ccrs.PlateCarree(),
+                      facecolor='none', edgecolor='black')
+
+    return(ax)
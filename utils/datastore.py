@@ -0,0 +1,213 @@
+# !/usr/bin/python3
+
+# Consolidated, Hive-partitioned store of the data displayed by the pages.
+#
+#   data/store/count_nbstation/namevar=SD/nameexp=DRS1992IC401/year=1992/part-0.parquet
+#   data/store/station_cycles/namevar=SD/nameexp=DRS1992IC401/year=1992/part-0.parquet
+#   data/store/station_ids/part-0.parquet
+#   data/store/melting_date/domain=lat45to48_lon285to290/nameexp=DRS1992IC401/part-0.parquet
+#   data/store/melting_angle/domain=lat45to48_lon285to290/nameexp=DRS1992IC401/part-0.parquet
+#   data/store/yearly_prcp/domain=lat45to48_lon285to290/nameexp=DRS1992IC401/part-0.parquet
+#
+# A query only opens the partitions matching its filters, so several experiments
+# or years are read at once instead of building one file name per call.
+#
+# The columns of every dataset have compact types (uint16 counts, float32
+# coordinates, int32 station IDs, dictionary encoded experiments and domains). The data written is
+# cast to them (an overflow raises an error) and every file is checked against
+# them the first time a query reads it. A file is written under a hidden temporary
+# name and renamed, so a reader or an interrupted run never sees half a file.
+
+import os
+import time
+from functools import lru_cache
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+#============================ CONSTANTS
+#
+# (RDRSVIZ_STORE points the pages to another store, e.g. a synthetic one of the benchmarks)
+dirstore   = os.environ.get("RDRSVIZ_STORE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "store"))
+
+# store of the boxes drawn on the snowmelt page (utils/gridstats.py), same datasets as dirstore but not tracked
+# and bounded in size: the functions below read and write it with root=dirboxes
+dirboxes   = os.environ.get("RDRSVIZ_BOXES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "boxes"))
+
+# partition keys of each dataset (read as pandas categories)
+keyname    = pa.dictionary(pa.int32(), pa.string())
+partitions = {
+    'count_nbstation':       pa.schema([('namevar', keyname), ('nameexp', keyname), ('year', pa.int32())]),
+    'count_nbstation_index': pa.schema([('namevar', keyname), ('nameexp', keyname), ('year', pa.int32())]),
+    'station_cycles':        pa.schema([('namevar', keyname), ('nameexp', keyname), ('year', pa.int32())]),
+    'station_ids':           pa.schema([]),
+    'melting_date':          pa.schema([('domain', keyname), ('nameexp', keyname)]),
+    'melting_angle':         pa.schema([('domain', keyname), ('nameexp', keyname)]),
+    'yearly_prcp':           pa.schema([('domain', keyname), ('nameexp', keyname)]),
+}
+
+# columns of the files of each dataset
+month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+schemas    = {
+    # a station is assimilated at most a few hundred times per month
+    'count_nbstation':       pa.schema([('STATION', pa.int32()), ('LAT', pa.float32()), ('LON', pa.float32()), ('ALT', pa.float32())]
+                                       + [(namecol, pa.uint16()) for namecol in month_names + ['Total']]
+                                       + [('BUCKET', pa.int32())]),
+    # sums over the stations of a bucket
+    'count_nbstation_index': pa.schema([('BUCKET', pa.int32()), ('LATMIN', pa.float32()), ('LATMAX', pa.float32()),
+                                        ('LONMIN', pa.float32()), ('LONMAX', pa.float32()), ('NSTATION', pa.uint32())]
+                                       + [(namecol, pa.uint32()) for namecol in month_names + ['Total']]),
+    # presence of a station at every cycle of the year, one bit per cycle (utils/stationcycles.py)
+    'station_cycles':        pa.schema([('STATION', pa.int32()), ('LAT', pa.float32()), ('LON', pa.float32()), ('ALT', pa.float32()),
+                                        ('TIMESTEP', pa.uint8()), ('BUCKET', pa.int32()), ('BITMAP', pa.binary())]),
+    # ID of every station of the count tables (utils/stationids.py)
+    'station_ids':           pa.schema([('STATION', pa.int32()), ('LAT', pa.float32()), ('LON', pa.float32()),
+                                        ('ALT', pa.float32()), ('LONMAP', pa.float32())]),
+    'melting_date':          pa.schema([('YEAR', pa.int16()), ('MEDIAN', pa.date32()),
+                                        ('QUANTILE25', pa.date32()), ('QUANTILE75', pa.date32())]),
+    # polar plot of the melting dates, one row per year of the period (DAYOFYEAR and ANGLE null without date)
+    'melting_angle':         pa.schema([('YEAR', pa.int16()), ('DAYOFYEAR', pa.int16()), ('ANGLE', pa.float32()),
+                                        ('RADII', pa.float32()), ('KEPT', pa.bool_())]),
+    'yearly_prcp':           pa.schema([('year', pa.int16()), ('yearlysum', pa.float32()),
+                                        ('yearlysum_25pct', pa.float32()), ('yearlysum_75pct', pa.float32())]),
+}
+
+# parquet options: the count and cycle partitions are sorted by BUCKET, small row groups let a region query skip the others
+compression = "zstd"
+rowgroups  = {'count_nbstation': 4096, 'station_cycles': 1024}
+rowgroup_default = 65536
+
+# files already checked by a query
+checked    = set()
+
+# marker replaced by every write of a partition, the processes reading the store list its partitions again
+nameversion = ".version"
+
+#============================= FUNCTIONS
+#%% function to build the name of a domain partition from the domain box
+# (whole degrees are written without decimals, e.g. lat45to48_lon285to290 or lat45.5to48_lon285to290.2)
+def domain_key(domain):
+    latinf, latsup, loninf, lonsup = domain
+
+    return(f"lat{latinf:g}to{latsup:g}_lon{loninf:g}to{lonsup:g}")
+
+#%% function to cast a data frame to the columns of a dataset (without the columns in exclude)
+def to_table(namedataset, data, exclude=()):
+    schema  = pa.schema([column for column in schemas[namedataset] if column.name not in exclude])
+    missing = [namecol for namecol in schema.names if namecol not in data.columns]
+    if missing:
+        raise ValueError(f"{namedataset}: missing column(s) {missing}")
+
+    # safe cast: a value out of the range of its type raises pa.ArrowInvalid
+    table   = pa.Table.from_pandas(data[schema.names], preserve_index=False)
+
+    return(table.cast(schema))
+
+#%% function to write a table with the parquet options of a dataset
+# (the datasets skip the files starting with a dot, so the temporary file is never read)
+def write_table(namedataset, table, namefile):
+    dirname, basename = os.path.split(namefile)
+    namefiletmp       = os.path.join(dirname, f".{basename}.{os.getpid()}.tmp")
+    try:
+        pq.write_table(table, namefiletmp, compression=compression,
+                       row_group_size=rowgroups.get(namedataset, rowgroup_default))
+        os.replace(namefiletmp, namefile)
+    finally:
+        if os.path.exists(namefiletmp):
+            os.remove(namefiletmp)
+
+#%% function to check that the files read by a query have the columns of the dataset (once per file)
+def check_fragments(namedataset, dataset, expression):
+    for fragment in dataset.get_fragments(filter=expression):
+        if fragment.path in checked:
+            continue
+        if not fragment.physical_schema.remove_metadata().equals(schemas[namedataset]):
+            raise ValueError(f"{fragment.path} does not have the columns of {namedataset}, "
+                             f"rebuild the store (.preprocessing/build_datastore.py)")
+        checked.add(fragment.path)
+
+#%% function to get the version of the store: the marker replaced by every write of a partition
+# (inode and modification time, None before the first write)
+def store_version(root=None):
+    try:
+        stat = os.stat(os.path.join(root or dirstore, nameversion))
+    except FileNotFoundError:
+        return(None)
+
+    return((stat.st_ino, stat.st_mtime_ns))
+
+#%% function to mark the store as modified, the processes reading it list its partitions again
+def touch_version(root=None):
+    root        = root or dirstore
+    os.makedirs(root, exist_ok=True)
+    namefiletmp = os.path.join(root, f"{nameversion}.{os.getpid()}.tmp")
+    with open(namefiletmp, "w") as f:
+        f.write(f"{time.time_ns()}\n")
+    os.replace(namefiletmp, os.path.join(root, nameversion))
+
+#%% function to open a dataset (the list of partitions is read again once the store has been written)
+def open_dataset(namedataset, root=None):
+    return(open_version(namedataset, root or dirstore, store_version(root)))
+
+@lru_cache(maxsize=64)
+def open_version(namedataset, root, version):
+    partitioning = ds.partitioning(partitions[namedataset], flavor="hive", dictionaries="infer")
+
+    return(ds.dataset(os.path.join(root, namedataset), format="parquet", partitioning=partitioning))
+
+#%% function to forget the opened datasets once the store has been rewritten
+def refresh():
+    open_version.cache_clear()
+    checked.clear()
+
+#%% function to build the filter expression of a query
+# a list of values selects several partitions at once
+def build_filter(filters):
+    expression = None
+    for key, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            condition = ds.field(key).isin(list(value))
+        else:
+            condition = ds.field(key) == value
+        expression = condition if expression is None else expression & condition
+
+    return(expression)
+
+#%% function to read the rows of a dataset matching the filters
+# e.g. query('count_nbstation', namevar='TT', nameexp=['DRS1992IC401', 'DRS1992IC425'], year=1992)
+def query(namedataset, columns=None, root=None, **filters):
+    dataset    = open_dataset(namedataset, root)
+    expression = build_filter(filters)
+    check_fragments(namedataset, dataset, expression)
+    table      = dataset.to_table(columns=columns, filter=expression)
+
+    return(table.to_pandas(date_as_object=False))
+
+#%% function to list the partitions present in a dataset
+def list_partitions(namedataset, root=None):
+    dataset = open_dataset(namedataset, root)
+    keys    = [ds.get_partition_keys(fragment.partition_expression) for fragment in dataset.get_fragments()]
+
+    return(keys)
+
+#%% function to build the directory of a partition
+# only the leading partition keys given are used, e.g. partition_dir('melting_date', domain=...)
+def partition_dir(namedataset, root=None, **keys):
+    dirpart = [namedataset]
+    for key in partitions[namedataset].names:
+        if key not in keys:
+            break
+        dirpart.append(f"{key}={keys[key]}")
+
+    return(os.path.join(root or dirstore, *dirpart))
+
+#%% function to write (or replace) one partition of a dataset
+def write_partition(namedataset, data, root=None, **keys):
+    dirpart = partition_dir(namedataset, root, **keys)
+    os.makedirs(dirpart, exist_ok=True)
+
+    write_table(namedataset, to_table(namedataset, data), os.path.join(dirpart, "part-0.parquet"))
+    touch_version(root)
+
+    return(dirpart)
@@ -0,0 +1,124 @@
+# !/usr/bin/python3
+
+# Cache of the rendered figures shared by all the sessions of the server process.
+#
+# A figure is stored as PNG bytes under a key describing the widget state
+# (page, experiment, year, variable, domain) and the version of the data files
+# it was drawn from. A repeated view is then a copy of bytes instead of a
+# matplotlib render; a new version of the data files makes the old entry stale.
+#
+# pyplot is not thread safe: the sessions and the prefetch jobs (utils/prefetch.py)
+# render one figure at a time, and a figure being rendered by another thread is
+# waited for instead of being rendered twice.
+
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from utils import profiling
+
+#============================ CONSTANTS
+#
+# upper bound of the memory used by the cached figures
+maxbytes_default = 64 * 1024 * 1024
+
+# held while a figure is drawn and encoded
+render_lock      = threading.Lock()
+
+#============================= FUNCTIONS
+#%% function to get the version of data files or directories (size and modification time of every file)
+def data_version(paths):
+    version = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    stat = os.stat(os.path.join(dirpath, filename))
+                    version.append((os.path.join(dirpath, filename), stat.st_size, stat.st_mtime_ns))
+        elif os.path.isfile(path):
+            stat = os.stat(path)
+            version.append((path, stat.st_size, stat.st_mtime_ns))
+        else:
+            version.append((path, None, None))
+
+    return(tuple(version))
+
+#%% function to save a matplotlib figure as PNG bytes and free it
+def figure_to_png(fig, dpi=200):
+    import matplotlib.pyplot as plt
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+
+    return(buffer.getvalue())
+
+#============================= CLASSES
+#%% LRU cache of PNG bytes bounded by its size in bytes
+class FigureCache:
+    def __init__(self, maxbytes=maxbytes_default):
+        self.maxbytes  = maxbytes
+        self.nbytes    = 0
+        self.entries   = OrderedDict()
+        self.lock      = threading.Lock()
+        # keys being rendered and the event set when they are done
+        self.rendering = dict()
+
+    # return the PNG bytes of the figure, render(...) is only called on a miss
+    # render returns a matplotlib figure; sources are the data files the figure depends on
+    def get_or_render(self, key, render, sources=()):
+        version = data_version(sources)
+
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] == version:
+                    self.entries.move_to_end(key)
+                    profiling.cache_event("figure cache", True)
+                    return(entry[1])
+
+                # rendered by another thread: wait for it and look again (render it if it failed)
+                event = self.rendering.get(key)
+                if event is None:
+                    self.rendering[key] = threading.Event()
+                    break
+            event.wait()
+
+        try:
+            profiling.cache_event("figure cache", False)
+            with render_lock:
+                with profiling.stage("matplotlib render"):
+                    fig = render()
+                with profiling.stage("png encode"):
+                    png = figure_to_png(fig)
+
+            with self.lock:
+                self._drop(key)
+                self.entries[key] = (version, png)
+                self.nbytes      += len(png)
+                while self.nbytes > self.maxbytes and len(self.entries) > 1:
+                    self._drop(next(iter(self.entries)))
+        finally:
+            with self.lock:
+                self.rendering.pop(key).set()
+
+        return(png)
+
+    # remove every entry, or only the entries whose key matches the predicate
+    # (to call after the data files have been rebuilt)
+    def invalidate(self, predicate=None):
+        with self.lock:
+            for key in list(self.entries):
+                if predicate is None or predicate(key):
+                    self._drop(key)
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= len(entry[1])
+
+#============================ SHARED CACHE
+#
+# the module is imported once per server process, so all the sessions share this cache
+figure_cache = FigureCache(int(os.environ.get("RDRSVIZ_FIGCACHE_BYTES", maxbytes_default)))
@@ -0,0 +1,171 @@
+# !/usr/bin/python3
+
+# Maps of the monthly differences between PICIC and the analyses (RSAS) or RDRS
+# computed from the gridded fields instead of exported by hand.
+#
+# The monthly fields are read from the directory given by [GRIDDED] DATAPATH in
+# Configuration.ini, one netCDF file (or zarr store) per source:
+#
+#   {source}_{nameexp}_{year}_{namevar}.nc     source = picic, rsas or rdrs
+#
+# holding the variable namevar with dimensions (month, lat, lon). The differences
+# are computed month by month and by blocks of latitudes, so only one block of
+# both fields is in memory at a time, and saved as a .npy file. The figure drawn
+# from them is saved next to the static ones and cut into tiles by imagepyramid.
+
+import os
+import numpy as np
+
+from utils import profiling
+from utils import registry
+
+#============================ CONFIGURATION
+#
+dirroot      = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+dirdiff      = os.path.join(dirroot, "data", "griddiff")
+dirfigures   = os.path.join(dirroot, "figures", "generated")
+
+# number of latitudes read at once
+chunkrows    = 256
+# largest number of grid points drawn along a side of one monthly panel
+maxpanel     = 600
+
+month_lbl    = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+
+#============================= FUNCTIONS
+#%% function to get the source the PICIC field is compared to
+# (06-18 leadtimes of precipitation are taken from RDRS, the other variables from the analyses)
+def reference_source(namevar):
+    return("rdrs" if namevar == "PR" else "rsas")
+
+#%% function to build the name of a gridded field (netCDF file or zarr store)
+def field_path(source, nameexp, year, namevar):
+    namefile = os.path.join(registry.get_registry().griddedpath, f"{source}_{nameexp}_{year}_{namevar}")
+    if os.path.isdir(f"{namefile}.zarr"):
+        return(f"{namefile}.zarr")
+
+    return(f"{namefile}.nc")
+
+#%% function to check that both fields of a difference exist
+def is_available(nameexp, year, namevar):
+    return(all(os.path.exists(field_path(source, nameexp, year, namevar))
+               for source in ("picic", reference_source(namevar))))
+
+#%% function to list the (nameexp, year, namevar) that can be computed
+def list_available():
+    dirgridded = registry.get_registry().griddedpath
+    if not os.path.isdir(dirgridded):
+        return([])
+
+    available = set()
+    for filename in os.listdir(dirgridded):
+        parts = os.path.splitext(filename)[0].split("_")
+        if len(parts) == 4 and parts[0] == "picic" and is_available(parts[1], parts[2], parts[3]):
+            available.add((parts[1], parts[2], parts[3]))
+
+    return(sorted(available))
+
+#%% function to open one gridded field without loading it
+def open_field(source, nameexp, year, namevar):
+    import xarray as xr
+
+    namefile = field_path(source, nameexp, year, namevar)
+    if namefile.endswith(".zarr"):
+        dataset = xr.open_zarr(namefile)
+    else:
+        dataset = xr.open_dataset(namefile)
+
+    return(dataset[namevar])
+
+#%% function to build the name of the saved differences
+def difference_path(nameexp, year, namevar, typediff):
+    return(os.path.join(dirdiff, f"diff_{typediff}_picic_{reference_source(namevar)}_{nameexp}_{year}_{namevar}"))
+
+#%% function to compute the monthly differences (typediff = "abs" or "rel" in %), saved on disk once
+# returns the (month, lat, lon) differences as a read-only memory map, and the latitudes and longitudes
+@profiling.timed("gridded difference compute")
+def compute_difference(nameexp, year, namevar, typediff):
+    namefile = difference_path(nameexp, year, namevar, typediff)
+
+    if not os.path.isfile(f"{namefile}.npy"):
+        picic   = open_field("picic", nameexp, year, namevar)
+        ref     = open_field(reference_source(namevar), nameexp, year, namevar)
+        if picic.shape != ref.shape:
+            raise ValueError(f"PICIC {picic.shape} and {reference_source(namevar)} {ref.shape} are not on the same grid")
+
+        dimmonth, dimlat, dimlon = picic.dims
+        nmonths, nlat, nlon      = picic.shape
+
+        os.makedirs(dirdiff, exist_ok=True)
+        namefiletmp = f"{namefile}.{os.getpid()}.tmp.npy"
+        diff        = np.lib.format.open_memmap(namefiletmp, mode="w+", dtype=np.float32, shape=(nmonths, nlat, nlon))
+
+        for month in range(nmonths):
+            for j0 in range(0, nlat, chunkrows):
+                block  = {dimmonth: month, dimlat: slice(j0, j0 + chunkrows)}
+                valpic = picic.isel(block).values.astype(np.float32)
+                valref = ref.isel(block).values.astype(np.float32)
+
+                if typediff == "rel":
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        values = np.where(valref != 0, 100 * (valpic - valref) / valref, np.nan)
+                else:
+                    values = valpic - valref
+                diff[month, j0:j0 + valpic.shape[0]] = values
+
+        diff.flush()
+        del diff
+        np.savez(f"{namefile}_coords.npz", lat=picic[dimlat].values, lon=picic[dimlon].values)
+        os.replace(namefiletmp, f"{namefile}.npy")
+
+    diff   = np.load(f"{namefile}.npy", mmap_mode="r")
+    coords = np.load(f"{namefile}_coords.npz")
+
+    return(diff, coords["lat"], coords["lon"])
+
+#%% function to draw the 12 monthly differences
+def plot_difference(diff, lat, lon, nameexp, year, namevar, typediff):
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+
+    # draw at most maxpanel points along each side of a panel
+    step    = max(1, int(np.ceil(max(diff.shape[1:]) / maxpanel)))
+    lat     = lat[::step]
+    lon     = np.where(lon[::step] > 180, lon[::step] - 360, lon[::step])
+
+    # symmetric color scale, without the extreme values
+    limit   = np.nanpercentile(np.abs(diff[:, ::step, ::step]), 98)
+    cmap    = "BrBG" if namevar == "PR" else "RdBu_r"
+    unit    = "%" if typediff == "rel" else ("mm" if namevar == "PR" else "°C")
+
+    fig     = plt.figure(figsize=(12, 13))
+    for month in range(diff.shape[0]):
+        ax   = fig.add_subplot(4, 3, month + 1, projection=ccrs.PlateCarree())
+        mesh = ax.pcolormesh(lon, lat, diff[month, ::step, ::step], cmap=cmap, vmin=-limit, vmax=limit,
+                             shading="auto", transform=ccrs.PlateCarree())
+        ax.coastlines(resolution='50m', linewidth=0.5)
+        ax.set_title(month_lbl[month], fontsize=9)
+
+    fig.colorbar(mesh, ax=fig.axes, orientation="horizontal", fraction=0.03, pad=0.03, label=f"[{unit}]")
+    fig.suptitle(f"PICIC - {reference_source(namevar).upper()} {nameexp} {year} {namevar}")
+
+    return(fig)
+
+#%% function to get the figure of the differences, computed and drawn on the first request only
+def render_difference(nameexp, year, namevar, typediff):
+    prefix     = "fig_diff_rel" if typediff == "rel" else "fig_diff"
+    image_name = os.path.join(dirfigures, f"{prefix}_picic_{reference_source(namevar)}_{nameexp}_{year}_{namevar}.png")
+
+    if not os.path.isfile(image_name):
+        import matplotlib.pyplot as plt
+
+        diff, lat, lon = compute_difference(nameexp, year, namevar, typediff)
+        fig            = plot_difference(diff, lat, lon, nameexp, year, namevar, typediff)
+
+        os.makedirs(dirfigures, exist_ok=True)
+        namefiletmp = f"{image_name}.{os.getpid()}.tmp.png"
+        fig.savefig(namefiletmp, dpi=300, bbox_inches="tight")
+        plt.close(fig)
+        os.replace(namefiletmp, image_name)
+
+    return(image_name)
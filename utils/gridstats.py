@@ -0,0 +1,275 @@
+# !/usr/bin/python3
+
+# Melting dates and yearly precipitation of any lat/lon box, computed from the
+# gridded fields instead of the offline files of the four domains.
+#
+# The yearly fields are read from the directory given by [GRIDDED] DATAPATH in
+# Configuration.ini, one netCDF file (or zarr store) per experiment:
+#
+#   snowmelt_{nameexp}.nc      MELTDAY (year, y, x)  day of the year the snow is melted
+#   yearlyprcp_{nameexp}.nc    PRCP    (year, y, x)  yearly precipitation accumulation [m]
+#
+# with the latitudes and longitudes of the cells as 1D (lat, lon) or 2D (y, x)
+# coordinates 'lat' and 'lon'. The cells of a box are found with an index of the
+# grid by 1 degree buckets, then only the window of rows and columns around them
+# is read, a few years at a time. The statistics of a box are written in a store
+# (melting_date with its melting_angle and yearly_prcp, partition domain=...), so a
+# box is computed once: data/store for the domains of Configuration.ini, data/boxes
+# (not tracked) for the boxes drawn on the page. The least recently viewed boxes
+# are removed from data/boxes once it is above its size.
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from utils import datastore
+from utils import profiling
+from utils import registry
+from utils import snowmelt
+
+#============================ CONFIGURATION
+#
+dirindex     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "gridindex")
+
+# gridded field of each dataset of the store: prefix of the file and variable
+fields       = {
+    'melting_date': ("snowmelt", "MELTDAY"),
+    'yearly_prcp':  ("yearlyprcp", "PRCP"),
+}
+
+# package of the xarray backend of each kind of gridded field
+engine_packages = {'netcdf4': "netCDF4", 'zarr': "zarr"}
+
+# size of the buckets of the index [degree] and number of years read at once
+bucketsize   = 1.0
+chunkyears   = 8
+
+# datasets of a box and upper bound of the size of the store of the boxes
+datasets     = ["melting_date", "melting_angle", "yearly_prcp"]
+maxbytes     = int(os.environ.get("RDRSVIZ_BOXES_BYTES", 64 * 1024 * 1024))
+
+#============================= FUNCTIONS
+#%% function to build the name of a gridded field (netCDF file or zarr store)
+def field_path(namedataset, nameexp):
+    prefix, namevar = fields[namedataset]
+    namefile        = os.path.join(registry.get_registry().griddedpath, f"{prefix}_{nameexp}")
+    if os.path.isdir(f"{namefile}.zarr"):
+        return(f"{namefile}.zarr")
+
+    return(f"{namefile}.nc")
+
+#%% function to list the experiments with a gridded field
+def list_experiments(namedataset):
+    dirgridded = registry.get_registry().griddedpath
+    if not os.path.isdir(dirgridded):
+        return([])
+
+    prefix     = fields[namedataset][0]
+    nameexps   = {os.path.splitext(filename)[0][len(prefix) + 1:] for filename in os.listdir(dirgridded)
+                  if filename.startswith(f"{prefix}_") and os.path.splitext(filename)[1] in (".nc", ".zarr")}
+
+    return(sorted(nameexps))
+
+#%% function to open one gridded field without loading it
+def open_field(namedataset, nameexp):
+    import xarray as xr
+
+    # the backend is declared, a missing one is reported with the package to install
+    namefile = field_path(namedataset, nameexp)
+    engine   = "zarr" if namefile.endswith(".zarr") else "netcdf4"
+    try:
+        if engine == "zarr":
+            dataset = xr.open_zarr(namefile)
+        else:
+            dataset = xr.open_dataset(namefile, engine=engine)
+    except (ImportError, ValueError) as error:
+        if engine in xr.backends.list_engines():
+            raise
+        raise ValueError(f"{os.path.basename(namefile)} cannot be read: the xarray backend {engine} "
+                         f"is not installed (pip install {engine_packages[engine]})") from error
+
+    return(dataset[fields[namedataset][1]])
+
+#%% function to get the latitudes and longitudes (0 to 360) of every cell as 2D arrays
+def cell_coords(field):
+    lat = field['lat'].values
+    lon = field['lon'].values
+    if lat.ndim == 1:
+        lon, lat = np.meshgrid(lon, lat)
+
+    return(lat, np.mod(lon, 360))
+
+#%% function to build the index of the cells of a grid by buckets of bucketsize degrees
+# cells[start[k]:start[k + 1]] are the flat indices of the cells of the bucket keys[k]
+def build_index(lat, lon):
+    nlonbucket = int(np.ceil(360 / bucketsize))
+    buckets    = (np.floor((lat.ravel() + 90) / bucketsize).astype(np.int64) * nlonbucket
+                  + np.floor(lon.ravel() / bucketsize).astype(np.int64) % nlonbucket)
+
+    cells      = np.argsort(buckets, kind="stable").astype(np.int64)
+    keys, start = np.unique(buckets[cells], return_index=True)
+
+    return({'keys': keys, 'start': np.append(start, len(cells)), 'cells': cells,
+            'lat': lat.ravel().astype(np.float32), 'lon': lon.ravel().astype(np.float32), 'shape': np.array(lat.shape)})
+
+#%% function to load the index of the grid of a gridded field, building it on the first call
+def load_index(namedataset, nameexp, field):
+    namefield = field_path(namedataset, nameexp)
+    namefile  = os.path.join(dirindex, f"{os.path.basename(namefield)}.{os.stat(namefield).st_mtime_ns}.npz")
+
+    if not os.path.isfile(namefile):
+        with profiling.stage("grid index build"):
+            index = build_index(*cell_coords(field))
+
+        os.makedirs(dirindex, exist_ok=True)
+        namefiletmp = f"{namefile}.{os.getpid()}.tmp.npz"
+        np.savez(namefiletmp, **index)
+        os.replace(namefiletmp, namefile)
+
+    index = np.load(namefile)
+
+    return({key: index[key] for key in index.files})
+
+#%% function to find the cells of a grid inside a box (latinf, latsup, loninf, lonsup), lon from 0 to 360
+# returns the (rows, cols) of the cells
+def query_index(index, domain):
+    latinf, latsup, loninf, lonsup = domain
+    nlonbucket = int(np.ceil(360 / bucketsize))
+
+    latbuckets = range(int(np.floor((latinf + 90) / bucketsize)), int(np.floor((latsup + 90) / bucketsize)) + 1)
+    lonbuckets = range(int(np.floor(loninf / bucketsize)), int(np.floor(lonsup / bucketsize)) + 1)
+    wanted     = np.array([latbucket * nlonbucket + lonbucket % nlonbucket for latbucket in latbuckets for lonbucket in lonbuckets])
+
+    found      = np.flatnonzero(np.isin(index['keys'], wanted))
+    cells      = np.concatenate([index['cells'][index['start'][k]:index['start'][k + 1]] for k in found]) if len(found) else np.array([], dtype=np.int64)
+
+    lat        = index['lat'][cells]
+    lon        = index['lon'][cells]
+    cells      = cells[(lat >= latinf) & (lat <= latsup) & (lon >= loninf) & (lon <= lonsup)]
+
+    return(np.unravel_index(cells, tuple(index['shape'])))
+
+#%% function to get the 25th, 50th and 75th percentiles over the cells of a box, year per year
+# returns the years and a (nyears, 3) array
+def box_percentiles(namedataset, nameexp, domain):
+    field          = open_field(namedataset, nameexp)
+    dimyear, dimy, dimx = field.dims
+
+    rows, cols     = query_index(load_index(namedataset, nameexp, field), domain)
+    years          = field[dimyear].values.astype(int)
+    if len(rows) == 0:
+        return(years, np.full((len(years), 3), np.nan))
+
+    # read the window around the cells only, and keep the cells of the box in it
+    window         = {dimy: slice(rows.min(), rows.max() + 1), dimx: slice(cols.min(), cols.max() + 1)}
+    rows, cols     = rows - rows.min(), cols - cols.min()
+
+    percentiles    = []
+    for y0 in range(0, len(years), chunkyears):
+        values = field.isel({dimyear: slice(y0, y0 + chunkyears), **window}).values.astype(np.float32)
+        with np.errstate(all="ignore"):
+            percentiles.append(np.nanpercentile(values[:, rows, cols], [25, 50, 75], axis=1).T)
+
+    return(years, np.concatenate(percentiles))
+
+#%% function to compute the melting dates of a box for one experiment (same columns as the offline files)
+def melting_date(nameexp, domain):
+    years, pct = box_percentiles("melting_date", nameexp, domain)
+    firstday   = pd.to_datetime(pd.Series(years).astype(str) + "-01-01")
+
+    data       = pd.DataFrame({'YEAR': years})
+    for namecol, k in (('MEDIAN', 1), ('QUANTILE25', 0), ('QUANTILE75', 2)):
+        data[namecol] = firstday + pd.to_timedelta(np.round(pct[:, k]) - 1, unit="D")
+
+    return(data.dropna().reset_index(drop=True))
+
+#%% function to compute the yearly precipitation of a box for one experiment (same columns as the offline files)
+def yearly_prcp(nameexp, domain):
+    years, pct = box_percentiles("yearly_prcp", nameexp, domain)
+
+    data       = pd.DataFrame({'year': years, 'yearlysum': pct[:, 1].astype(np.float32),
+                               'yearlysum_25pct': pct[:, 0].astype(np.float64), 'yearlysum_75pct': pct[:, 2].astype(np.float64)})
+
+    return(data.dropna().reset_index(drop=True))
+
+#%% function to list the boxes of the store of the boxes: time of last use and size of every domain key
+def list_boxes():
+    boxes = dict()
+    for namedataset in datasets:
+        dirdataset = os.path.join(datastore.dirboxes, namedataset)
+        if not os.path.isdir(dirdataset):
+            continue
+        for namedir in os.listdir(dirdataset):
+            dirdomain = os.path.join(dirdataset, namedir)
+            try:
+                used  = os.stat(dirdomain).st_mtime_ns
+                size  = sum(os.path.getsize(os.path.join(dirpath, filename))
+                            for dirpath, dirnames, filenames in os.walk(dirdomain) for filename in filenames)
+            except OSError:
+                # removed by another process
+                continue
+            key   = namedir[len("domain="):]
+            boxused, boxsize = boxes.get(key, (0, 0))
+            boxes[key] = (max(boxused, used), boxsize + size)
+
+    return(boxes)
+
+#%% function to mark a box as viewed, the modification time of its directories is the time of its last use
+def touch_box(key):
+    for namedataset in datasets:
+        dirdomain = datastore.partition_dir(namedataset, datastore.dirboxes, domain=key)
+        if os.path.isdir(dirdomain):
+            os.utime(dirdomain)
+
+#%% function to remove the least recently used boxes (but keep) until the store of the boxes is below maxbytes
+def evict_boxes(keep):
+    boxes   = list_boxes()
+    nbytes  = sum(size for used, size in boxes.values())
+    removed = False
+    for used, key in sorted((used, key) for key, (used, size) in boxes.items()):
+        if nbytes <= maxbytes:
+            break
+        if key == keep:
+            continue
+        for namedataset in datasets:
+            shutil.rmtree(datastore.partition_dir(namedataset, datastore.dirboxes, domain=key), ignore_errors=True)
+        nbytes -= boxes[key][1]
+        removed = True
+
+    # the registry lists the boxes again
+    if removed:
+        datastore.touch_version(datastore.dirboxes)
+
+#%% function to compute the statistics of a box for every experiment with gridded fields, once
+# returns True if something was added to the store
+def compute_domain(domain):
+    config  = registry.get_registry()
+    root    = config.domain_store(domain)
+    key     = datastore.domain_key(domain)
+    added   = False
+
+    for namedataset, compute, present in (("melting_date", melting_date, config.experiments_with_melt(domain)),
+                                          ("yearly_prcp", yearly_prcp, config.experiments_with_prcp(domain))):
+        for nameexp in list_experiments(namedataset):
+            if nameexp in present:
+                continue
+
+            with profiling.stage(f"{namedataset} box"):
+                data = compute(nameexp, domain)
+            if namedataset == "melting_date":
+                snowmelt.write_melt(data, key, nameexp, root)
+            else:
+                datastore.write_partition(namedataset, data, root, domain=key, nameexp=nameexp)
+            added = True
+
+    if root == datastore.dirboxes:
+        touch_box(key)
+        if added:
+            evict_boxes(key)
+
+    # the registry lists the partitions of the store
+    if added:
+        registry.refresh()
+
+    return(added)
@@ -0,0 +1,143 @@
+# !/usr/bin/python3
+
+# Multi-resolution tiles of the large figures displayed by the pages.
+#
+#   figures/tiles/<figure name>/meta.json
+#   figures/tiles/<figure name>/preview.png
+#   figures/tiles/<figure name>/<level>/<row>_<col>.png
+#
+# Level 0 is the full resolution, each level halves the previous one. The page
+# first sends the small preview, then only the tiles under the zoomed viewport.
+
+import io
+import os
+import json
+import shutil
+import threading
+from functools import lru_cache
+
+#============================ CONSTANTS
+#
+dirtiles     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "figures", "tiles")
+tilesize     = 512
+previewwidth = 800
+
+#============================= FUNCTIONS
+#%% function to get the directory of the tiles of one figure
+def pyramid_dir(image_name):
+    return(os.path.join(dirtiles, os.path.splitext(os.path.basename(image_name))[0]))
+
+#%% function to cut one figure into tiles at every level
+def build_pyramid(image_name):
+    from PIL import Image
+
+    dirpyramid = pyramid_dir(image_name)
+    # the sessions of the server are threads of one process
+    dirtmp     = f"{dirpyramid}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(dirtmp, ignore_errors=True)
+
+    image      = Image.open(image_name)
+    image.load()
+
+    levels     = []
+    level      = 0
+    preview    = None
+    while True:
+        width, height = image.size
+        nrows  = -(-height // tilesize)
+        ncols  = -(-width // tilesize)
+        os.makedirs(os.path.join(dirtmp, str(level)))
+        for row in range(nrows):
+            for col in range(ncols):
+                tile = image.crop((col * tilesize, row * tilesize,
+                                   min((col + 1) * tilesize, width), min((row + 1) * tilesize, height)))
+                tile.save(os.path.join(dirtmp, str(level), f"{row}_{col}.png"), optimize=True)
+        levels.append({'width': width, 'height': height, 'nrows': nrows, 'ncols': ncols})
+
+        nextimage = image.reduce(2) if max(width, height) > tilesize else None
+
+        # the preview is the smallest level still wider than previewwidth
+        if preview is None and (nextimage is None or nextimage.size[0] < previewwidth):
+            image.save(os.path.join(dirtmp, "preview.png"), optimize=True)
+            preview = level
+
+        if nextimage is None:
+            break
+        image  = nextimage
+        level += 1
+
+    meta = {'source_mtime': os.stat(image_name).st_mtime_ns, 'tilesize': tilesize,
+            'preview': preview, 'levels': levels}
+    with open(os.path.join(dirtmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+
+    # move the previous pyramid (if any) aside and put the new one in its place: the sessions
+    # reading it never find the directory missing while the old tiles are removed
+    dirold     = f"{dirtmp[:-4]}.old"
+    try:
+        os.rename(dirpyramid, dirold)
+    except FileNotFoundError:
+        dirold = None
+    try:
+        os.replace(dirtmp, dirpyramid)
+    except OSError:
+        # another session built the same pyramid in the meantime
+        shutil.rmtree(dirtmp, ignore_errors=True)
+    if dirold is not None:
+        shutil.rmtree(dirold, ignore_errors=True)
+
+    return(meta)
+
+#%% function to read the description of the pyramid of a figure, building it when missing or outdated
+def open_pyramid(image_name):
+    namemeta = os.path.join(pyramid_dir(image_name), "meta.json")
+
+    if os.path.isfile(namemeta):
+        with open(namemeta) as f:
+            meta = json.load(f)
+        if meta['source_mtime'] == os.stat(image_name).st_mtime_ns:
+            return(meta)
+
+    return(build_pyramid(image_name))
+
+#%% function to get the preview of a figure as PNG bytes
+def load_preview(image_name):
+    open_pyramid(image_name)
+    with open(os.path.join(pyramid_dir(image_name), "preview.png"), "rb") as f:
+        return(f.read())
+
+#%% function to read one tile (the last decoded tiles are kept in memory, by version of the figure)
+@lru_cache(maxsize=128)
+def load_tile(image_name, source_mtime, level, row, col):
+    from PIL import Image
+
+    tile = Image.open(os.path.join(pyramid_dir(image_name), str(level), f"{row}_{col}.png"))
+    tile.load()
+
+    return(tile)
+
+#%% function to compose the viewport of a zoomed figure as PNG bytes
+# (xcenter, ycenter) is the center of the viewport as a fraction of the figure width and height
+def load_view(image_name, level, xcenter, ycenter, width=1024, height=768):
+    from PIL import Image
+
+    meta      = open_pyramid(image_name)
+    levelmeta = meta['levels'][level]
+
+    width    = min(width, levelmeta['width'])
+    height   = min(height, levelmeta['height'])
+    x0       = int(min(max(xcenter * levelmeta['width'] - width / 2, 0), levelmeta['width'] - width))
+    y0       = int(min(max(ycenter * levelmeta['height'] - height / 2, 0), levelmeta['height'] - height))
+
+    view     = None
+    for row in range(y0 // tilesize, (y0 + height - 1) // tilesize + 1):
+        for col in range(x0 // tilesize, (x0 + width - 1) // tilesize + 1):
+            tile = load_tile(image_name, meta['source_mtime'], level, row, col)
+            if view is None:
+                view = Image.new(tile.mode, (width, height))
+            view.paste(tile, (col * tilesize - x0, row * tilesize - y0))
+
+    buffer   = io.BytesIO()
+    view.save(buffer, format="png")
+
+    return(buffer.getvalue())
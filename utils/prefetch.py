@@ -0,0 +1,100 @@
+# !/usr/bin/python3
+
+# Background loading of the selections a user is likely to look at next.
+#
+# After drawing the current view, a page lists the neighbouring selections (the
+# other variables, years, experiments or domains of Configuration.ini) as jobs
+# filling the loader cache (arrowcache) and the figure cache (figcache). The jobs
+# run in a pool of threads shared by the sessions of the server process while the
+# user looks at the page; when the selection changes, the jobs of the session not
+# started yet are cancelled and the new neighbours are queued. A job still loading
+# or rendering the selection the user switched to is waited for by the caches, so
+# the work is never done twice.
+#
+# The jobs never call Streamlit: they only fill the caches read by the next run.
+#
+#   RDRSVIZ_PREFETCH=0              disable the prefetch
+#   RDRSVIZ_PREFETCH_WORKERS=2      threads of the pool
+#   RDRSVIZ_PREFETCH_JOBS=16        jobs queued per session
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import profiling
+
+#============================ CONFIGURATION
+#
+enabled      = os.environ.get("RDRSVIZ_PREFETCH", "1") not in ("", "0", "false", "False")
+
+# few threads: the jobs share the interpreter with the sessions drawing their page
+nworkers     = int(os.environ.get("RDRSVIZ_PREFETCH_WORKERS", 2))
+maxjobs      = int(os.environ.get("RDRSVIZ_PREFETCH_JOBS", 16))
+
+logger       = logging.getLogger("rdrsviz.prefetch")
+
+# pool of the server process, started by the first session
+state        = {'pool': None}
+lock         = threading.Lock()
+
+#============================= FUNCTIONS
+#%% function to get the pool of the server process
+def get_pool():
+    with lock:
+        if state['pool'] is None:
+            state['pool'] = ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix="prefetch")
+
+    return(state['pool'])
+
+#%% function to run one job in the pool, a failed job is only logged (the page loads it again if selected)
+def run_job(name, func):
+    profiling.start_run(f"prefetch {name}")
+    try:
+        with profiling.stage("prefetch"):
+            func()
+    except Exception:
+        logger.warning("prefetch of %s failed", name, exc_info=True)
+        return(False)
+
+    return(True)
+
+#%% function to get the prefetcher of the current Streamlit session (None when the page runs without a server)
+def session_prefetcher():
+    import streamlit as st
+
+    if not enabled or not st.runtime.exists():
+        return(None)
+
+    if "prefetcher" not in st.session_state:
+        st.session_state["prefetcher"] = Prefetcher()
+
+    return(st.session_state["prefetcher"])
+
+#============================= CLASSES
+#%% jobs queued by one session
+class Prefetcher:
+    def __init__(self):
+        # jobs queued or running, and jobs done, by name
+        self.futures = dict()
+        self.done    = set()
+
+    # queue the jobs of the neighbours of the current selection, most likely first
+    # jobs is a list of (name, function), the name identifies the selection warmed
+    def warm(self, jobs):
+        jobs  = [(name, func) for name, func in jobs if name not in self.done][:maxjobs]
+        names = set(name for name, func in jobs)
+
+        # forget the finished jobs, cancel the ones of the previous selection not started yet
+        for name, future in list(self.futures.items()):
+            if future.done():
+                if not future.cancelled() and future.result():
+                    self.done.add(name)
+                del self.futures[name]
+            elif name not in names and future.cancel():
+                del self.futures[name]
+
+        pool  = get_pool()
+        for name, func in jobs:
+            if name not in self.futures and name not in self.done:
+                self.futures[name] = pool.submit(run_job, name, func)
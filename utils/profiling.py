@@ -0,0 +1,152 @@
+# !/usr/bin/python3
+
+# Timing of the stages of the pages and of the preprocessing scripts.
+#
+# Enabled with RDRSVIZ_PROFILE=1 (or profiling.enable() in a script), disabled by
+# default. When disabled, stage() returns one shared empty context manager and
+# cache_event() and sent() return at once, so the pages run the same code as
+# without instrumentation.
+#
+# Every record (stage time, cache hit or miss, bytes sent to the browser) is
+# logged as one JSON line on the logger "rdrsviz.profile" (and appended to the
+# file RDRSVIZ_PROFILE_LOG if set), and kept for the debug panel of the page.
+
+import os
+import json
+import time
+import logging
+import threading
+import functools
+from contextlib import nullcontext
+
+#============================ CONFIGURATION
+#
+enabled      = os.environ.get("RDRSVIZ_PROFILE", "0") not in ("", "0", "false", "False")
+namelog      = os.environ.get("RDRSVIZ_PROFILE_LOG")
+
+logger       = logging.getLogger("rdrsviz.profile")
+
+# records of the current run, one list per thread (Streamlit runs every session in its own thread)
+local        = threading.local()
+nostage      = nullcontext()
+
+#============================= FUNCTIONS
+#%% function to switch the instrumentation on (the scripts call it from a command line flag)
+def enable():
+    global enabled
+    enabled = True
+
+    if namelog and not any(getattr(handler, "baseFilename", None) == os.path.abspath(namelog) for handler in logger.handlers):
+        handler = logging.FileHandler(namelog)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+#%% function to start the records of a page run (or of a script)
+def start_run(namerun):
+    if not enabled:
+        return
+
+    local.namerun = namerun
+    local.start   = time.perf_counter()
+    local.records = []
+
+#%% function to keep and log one record
+def record(kind, name, **values):
+    entry = {'run': getattr(local, "namerun", None), 'kind': kind, 'name': name, **values}
+
+    if not hasattr(local, "records"):
+        local.records = []
+    local.records.append(entry)
+    logger.info(json.dumps(entry, default=str))
+
+#%% function to time a stage, e.g.
+#   with profiling.stage("parquet read"):
+#       data = datastore.query(...)
+def stage(name):
+    if not enabled:
+        return(nostage)
+
+    return(Stage(name))
+
+#%% decorator timing every call of a function as one stage
+# (the function is returned unchanged when the instrumentation is disabled at import)
+def timed(name=None):
+    def decorate(func):
+        if not enabled:
+            return(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Stage(name or func.__name__):
+                return(func(*args, **kwargs))
+
+        return(wrapper)
+
+    return(decorate)
+
+#%% function to record a cache lookup (arrow cache, figure cache)
+def cache_event(name, hit):
+    if not enabled:
+        return
+
+    record("cache", name, hit=hit)
+
+#%% function to record the size of an element sent to the browser
+# payload is bytes or str, or a function returning them (only called when enabled)
+def sent(name, payload):
+    if not enabled:
+        return
+
+    if callable(payload):
+        payload = payload()
+    if isinstance(payload, str):
+        payload = payload.encode()
+
+    record("sent", name, nbytes=len(payload))
+
+#%% function to get the records of the current run as a table
+def run_records():
+    import pandas as pd
+
+    return(pd.DataFrame(getattr(local, "records", []), columns=['kind', 'name', 'seconds', 'hit', 'nbytes']))
+
+#%% function to show the records of the run at the bottom of a page
+def debug_panel():
+    if not enabled:
+        return
+
+    import streamlit as st
+
+    records = run_records()
+    total   = time.perf_counter() - getattr(local, "start", time.perf_counter())
+    with st.expander(f"Profiling - {getattr(local, 'namerun', '')} - {total:.3f} s"):
+        st.dataframe(records, use_container_width=True)
+
+#%% function to print the total time per stage at the end of a script
+def summary():
+    if not enabled:
+        return
+
+    records = run_records()
+    stages  = records[records['kind'] == "stage"].groupby('name')['seconds'].agg(['count', 'sum'])
+    print(stages.sort_values('sum', ascending=False).to_string())
+
+#============================= CLASSES
+#%% context manager timing one stage
+class Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record("stage", self.name, seconds=time.perf_counter() - self.start, failed=exc_type is not None)
+        return(False)
+
+#============================ ENABLED FROM THE ENVIRONMENT
+#
+if enabled:
+    enable()
@@ -0,0 +1,171 @@
+# !/usr/bin/python3
+
+# Registry of the experiments of Configuration.ini and of the data available for them.
+#
+# Configuration.ini is parsed once per process (again only if it is modified) and
+# the partitions of the store are listed at the same time, so the pages know which
+# (variable, experiment, year) or (domain, experiment) can be displayed without
+# probing any file.
+
+import os
+from configparser import ConfigParser
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Optional, Set, Tuple
+
+from utils import datastore
+
+#============================ CONSTANTS
+#
+dirroot      = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+nameconfig   = os.path.join(dirroot, "Configuration.ini")
+
+#============================= CLASSES
+#%% one experiment of the reanalysis (a section of Configuration.ini containing 'DRS')
+@dataclass(frozen=True)
+class Experiment:
+    name:    str
+    years:   Tuple[int, ...]
+    rsas:    str
+    exppath: str
+
+    # directory of the statoma files of a variable
+    def statoma_dir(self, namevar: str) -> str:
+        subdir = "snow" if namevar == "SD" else "screen"
+
+        return(f"{self.exppath}/{self.name}/{self.rsas}/gridpt/mist/statoma/{subdir}/yin")
+
+#%% content of Configuration.ini and index of the data in the store
+@dataclass(frozen=True)
+class Registry:
+    namevars:    Tuple[str, ...]
+    timesteps:   Dict[str, int]
+    yearfirst:   int
+    yearend:     int
+    experiments: Dict[str, Experiment]
+    domains:     Dict[str, Tuple[int, int, int, int]]
+    griddedpath: str
+    # year kept on the polar plot of the melting dates per experiment (every year if not listed)
+    meltyears:   Dict[str, int] = field(default_factory=dict)
+    # (namevar, nameexp, year) of the station counts in the store
+    counts:      Set[Tuple[str, str, int]] = field(default_factory=set)
+    # (namevar, nameexp, year) of the presence of the stations at every cycle in the store
+    cycles:      Set[Tuple[str, str, int]] = field(default_factory=set)
+    # (domain key, nameexp) of the melting dates (of their angles) and of the yearly precipitation in the store
+    # and in the store of the boxes drawn on the snowmelt page
+    melt:        Set[Tuple[str, str]] = field(default_factory=set)
+    prcp:        Set[Tuple[str, str]] = field(default_factory=set)
+
+    # experiments by year and by RSAS, in the order of Configuration.ini
+    def experiments_by_year(self, year: int) -> Tuple[str, ...]:
+        return(tuple(name for name, exp in self.experiments.items() if year in exp.years))
+
+    def experiments_by_rsas(self, rsas: str) -> Tuple[str, ...]:
+        return(tuple(name for name, exp in self.experiments.items() if exp.rsas == rsas))
+
+    # experiments with station counts, e.g. experiments_with_counts(year=1992, namevar='TT')
+    def experiments_with_counts(self, year: Optional[int] = None, namevar: Optional[str] = None) -> Tuple[str, ...]:
+        found = {nameexp for var, nameexp, yr in self.counts
+                 if (year is None or yr == year) and (namevar is None or var == namevar)}
+
+        return(tuple(name for name in self.experiments if name in found))
+
+    # years and variables with station counts for one experiment
+    def years_with_counts(self, nameexp: str) -> Tuple[int, ...]:
+        return(tuple(sorted({yr for var, name, yr in self.counts if name == nameexp})))
+
+    def namevars_with_counts(self, nameexp: str, year: int) -> Tuple[str, ...]:
+        return(tuple(var for var in self.namevars if (var, nameexp, year) in self.counts))
+
+    def has_counts(self, namevar: str, nameexp: str, year: int) -> bool:
+        return((namevar, nameexp, year) in self.counts)
+
+    def has_cycles(self, namevar: str, nameexp: str, year: int) -> bool:
+        return((namevar, nameexp, year) in self.cycles)
+
+    # experiments with melting dates / yearly precipitation over a domain
+    def experiments_with_melt(self, domain) -> Tuple[str, ...]:
+        key = datastore.domain_key(domain)
+
+        return(tuple(sorted(name for dom, name in self.melt if dom == key)))
+
+    def experiments_with_prcp(self, domain) -> Tuple[str, ...]:
+        key = datastore.domain_key(domain)
+
+        return(tuple(sorted(name for dom, name in self.prcp if dom == key)))
+
+    # store of the statistics of a domain: the store for the domains of Configuration.ini, the store of the boxes otherwise
+    def domain_store(self, domain) -> str:
+        if tuple(domain) in [tuple(box) for box in self.domains.values()]:
+            return(datastore.dirstore)
+
+        return(datastore.dirboxes)
+
+#============================= FUNCTIONS
+#%% function to list the partitions of a dataset of the store (empty if the store is not built)
+# root is the store listed (datastore.dirstore if None)
+def list_store(namedataset, keys, root=None):
+    if not os.path.isdir(os.path.join(root or datastore.dirstore, namedataset)):
+        return(set())
+
+    return({tuple(partition[key] for key in keys) for partition in datastore.list_partitions(namedataset, root)})
+
+#%% function to parse Configuration.ini and list the store (again once either was modified)
+@lru_cache(maxsize=4)
+def load_registry(nameconfig, mtime, version):
+    config     = ConfigParser()
+    # keep the case of the names of the domains
+    config.optionxform = str
+    config.read(nameconfig)
+
+    # name of the variables and their time step (hours between two statoma files)
+    namevars   = tuple(x.strip() for x in config["VARIABLES"]["namevar"].split(','))
+    tpsvars    = [int(x) for x in config["TIMESTEPVAR"]["tpsvar"].split(',')]
+
+    # time information
+    years      = config["PERIOD"]["timeperiod"].split(',')
+
+    # name of experiments
+    experiments = dict()
+    for section in config.sections():
+        if 'DRS' in section :
+            years_s  = [int(x) for x in config[section]['YEAR'].split(',')]
+            experiments[section] = Experiment(name=section, years=tuple(dict.fromkeys(years_s)),
+                                              rsas=config[section]['RSAS'].strip(),
+                                              exppath=config[section]['EXPPATH'].strip())
+
+    # domains of the snowmelt page: latinf, latsup, loninf, lonsup
+    domains    = dict()
+    if config.has_section("DOMAINS"):
+        for namedomain, box in config["DOMAINS"].items():
+            domains[namedomain] = tuple(int(x) for x in box.split(','))
+
+    # year kept on the polar plot of the experiments run over one year
+    meltyears  = dict()
+    if config.has_section("MELTYEARS"):
+        for nameexp, year in config["MELTYEARS"].items():
+            meltyears[nameexp] = int(year)
+
+    griddedpath = os.path.join(dirroot, config.get("GRIDDED", "DATAPATH", fallback="data/gridded"))
+
+    registry   = Registry(namevars=namevars, timesteps=dict(zip(namevars, tpsvars)),
+                          yearfirst=int(years[0]), yearend=int(years[1]),
+                          experiments=experiments, domains=domains, griddedpath=griddedpath, meltyears=meltyears,
+                          counts=list_store("count_nbstation", ("namevar", "nameexp", "year")),
+                          cycles=list_store("station_cycles", ("namevar", "nameexp", "year")),
+                          melt=list_store("melting_angle", ("domain", "nameexp"))
+                               | list_store("melting_angle", ("domain", "nameexp"), datastore.dirboxes),
+                          prcp=list_store("yearly_prcp", ("domain", "nameexp"))
+                               | list_store("yearly_prcp", ("domain", "nameexp"), datastore.dirboxes))
+
+    return(registry)
+
+#%% function to get the registry (reloaded when Configuration.ini or a store is modified)
+def get_registry():
+    return(load_registry(nameconfig, os.stat(nameconfig).st_mtime_ns,
+                         (datastore.dirstore, datastore.store_version(), datastore.dirboxes, datastore.store_version(datastore.dirboxes))))
+
+#%% function to reload the registry once the store has been rewritten
+def refresh():
+    datastore.refresh()
+    load_registry.cache_clear()
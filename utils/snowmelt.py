@@ -0,0 +1,204 @@
+# !/usr/bin/python3
+
+# Computations and figures of the snowmelt page (02_snowmelt_dates.py), kept out of
+# the page so that they can be run without Streamlit.
+
+import datetime
+from math import pi
+
+import numpy as np
+import pandas as pd
+
+from utils import basemap
+from utils import datastore
+from utils import profiling
+from utils import registry
+
+#============================ CONSTANTS
+#
+# experiments shown on the polar plot and their style
+# (the year kept for an experiment is in the MELTYEARS section of Configuration.ini)
+meltexps = {
+    "v21":                dict(marker='o', markersize=5, color='sandybrown', label="V2.1"),
+    "DRS1992IC401":       dict(marker='*', markersize=8, color='blue', label="DRS1992IC401"),
+    "DRS1992IC401wCHDSD": dict(marker='D', markersize=7, color='purple', label="DRS1992IC401wCHDSD"),
+    "DRS1992IC401v3":     dict(marker='>', markersize=8, color='hotpink', markeredgecolor='darkred', label="DRS1992IC401v3"),
+    "DRS1992IC425":       dict(marker='X', markersize=8, color='limegreen', markeredgecolor='forestgreen', label="IC425"),
+    "DRS2014IC425":       dict(marker='X', markersize=8, color='limegreen', markeredgecolor='forestgreen'),
+    "DRS2014IC421":       dict(marker='^', markersize=7, color='c', markeredgecolor='midnightblue', label="IC421"),
+    "DRS1992IC421":       dict(marker='^', markersize=7, color='c', markeredgecolor='midnightblue'),
+}
+
+# months of the polar plot and angle of their first day
+month_lbl    = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+month_angles = [2 * pi * datetime.date(2023, m, 1).timetuple().tm_yday / 365 for m in range(1, 13)]
+
+# experiments shown on the precipitation time series: year kept, marker, colors and label
+prcpexps = {
+    "v21":                (None, 'o', 'sandybrown', 'sandybrown', "V2.1"),
+    "DRS1992IC401v3":     (1992, '>', 'hotpink', 'darkred', "IC401v3"),
+    "DRS1992IC401":       (1992, '*', 'blue', 'blue', "IC401"),
+    "DRS1992IC425":       (1992, 'X', 'limegreen', 'forestgreen', "IC425"),
+}
+
+#============================= FUNCTIONS
+def doplottimeseries(axin, data_prcp_agg, unit, marker_t, colorm, colore, labeltxt):
+    
+    if labeltxt == "V2.1":
+        alphaval = 0.4
+    else:
+        alphaval = 0.7
+        
+    axin.plot(data_prcp_agg['year'], unit*data_prcp_agg['yearlysum'], 
+        marker=marker_t, linestyle='--', markersize=5, 
+        color=colorm, markeredgecolor=colore, label=labeltxt)
+
+    axin.fill_between(data_prcp_agg['year'], 
+                    unit*data_prcp_agg['yearlysum_25pct'], 
+                    unit*data_prcp_agg['yearlysum_75pct'], 
+                    color=colorm, alpha=alphaval)   
+    
+    return(axin)
+        
+# day of year and angle of the median melting date of one experiment, one row per year from yearfirst to yearend
+# KEPT is False for the years outside the year kept (yearkept None keeps every year)
+def angle_table(data_melt, yearkept=None, yearfirst=1980, yearend=2018):
+    years       = pd.Index(range(yearfirst, yearend + 1), name='YEAR')
+    dayofyear   = data_melt.set_index(data_melt['YEAR'].astype(int))['MEDIAN'].dt.dayofyear.reindex(years)
+
+    result_df   = pd.DataFrame({'DAYOFYEAR': dayofyear,
+                                'ANGLE': 2 * pi * dayofyear / 365,
+                                # estimate the radius
+                                'RADII': np.linspace( 1,0.1,  len(years)),
+                                'KEPT': (years == yearkept) if yearkept is not None else True}, index=years)
+
+    return(result_df.reset_index())
+
+# function to write the melting dates of a domain (key of datastore.domain_key) and experiment, with their angles
+# the year kept and the period are the ones of Configuration.ini, root is the store written (datastore.dirstore if None)
+def write_melt(data_melt, domain, nameexp, root=None):
+    config  = registry.get_registry()
+    angles  = angle_table(data_melt, config.meltyears.get(nameexp), config.yearfirst, config.yearend)
+
+    datastore.write_partition("melting_angle", angles, root, domain=domain, nameexp=nameexp)
+    dirpart = datastore.write_partition("melting_date", data_melt, root, domain=domain, nameexp=nameexp)
+
+    return(dirpart)
+
+# angle of the kept years for every experiment (one column per experiment, in the order of nameexps) and radius
+def angle_frame(data_angle, nameexps):
+    result_df   = (data_angle.assign(ANGLE=data_angle['ANGLE'].where(data_angle['KEPT']))
+                             .pivot(index='YEAR', columns='nameexp', values='ANGLE')
+                             .reindex(columns=list(nameexps)))
+    result_df['RADII'] = data_angle.groupby('YEAR')['RADII'].first()
+
+    return(result_df)
+
+    
+# bounds of a domain with the longitudes from -180 to 180
+def shift_domain(domain):
+    latinf, latsup, loninf, lonsup = domain
+    if loninf > 180:
+        loninf -= 360
+    if lonsup > 180:
+        lonsup -= 360
+
+    return(latinf, latsup, loninf, lonsup)
+
+# extent of the map of a domain: the domain and 5 degrees around, longitudes from -180 to 180
+def map_extent(domain):
+    latinf, latsup, loninf, lonsup = shift_domain(domain)
+
+    return([loninf-5 , lonsup+5, latinf-5, latsup+5])
+
+#%% PLOT
+# function to plot the median melting dates (polar plot) next to the map of the domain
+def plot_melt_domain(domain, data_angle):
+    # experiments of data_angle, in the order of meltexps
+    nameexps         = [nameexp for nameexp in meltexps if nameexp in set(data_angle['nameexp'])]
+
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+
+    with profiling.stage("angle frame"):
+        dfout    = angle_frame(data_angle, nameexps)
+
+    # do the plot
+    fig = plt.figure(figsize=(12, 6))
+
+    ax1 = fig.add_subplot(121, projection='polar')
+
+    for nameexp in nameexps:
+        ax1.plot(dfout[nameexp], dfout['RADII'], linestyle='--', **meltexps[nameexp])
+
+
+    radii       = dfout['RADII'].tolist()
+
+    # arrange the ticks
+    yearsval    = dfout.index
+    yticksval   = radii[::10]
+    yticklabels = [str(x) for x in yearsval[::10]]
+    ax1.set_yticks(yticksval)
+    ax1.set_yticklabels(yticklabels, fontsize=8, color="grey")
+
+    ax1.set_xticks(month_angles)    # Set the angular ticks to match the dates
+    ax1.set_xticklabels(month_lbl)  # Use date labels for the angular ticks
+
+    # legend
+    ax1.legend(loc='best', ncol=2)
+
+    # Set the theta limits to show only the top half of the circle
+    ax1.set_thetamin(0)
+    ax1.set_thetamax(180)
+
+
+    # Subplot 2: Map
+    latinf, latsup, loninf, lonsup = shift_domain(domain)
+
+    ax2 = fig.add_subplot(122, projection=ccrs.PlateCarree())
+
+    extent = map_extent(domain)
+    ax2.set_extent(extent, crs=ccrs.PlateCarree())
+
+    # Add rivers and coastlines from the base map cached on disk for this extent
+    with profiling.stage("cartopy basemap"):
+        basemap.draw_basemap(ax2, extent)
+
+
+    ax2.add_patch(plt.Rectangle((loninf, latinf), lonsup - loninf, latsup - latinf,
+                                color='blue', alpha=0.2, transform=ccrs.PlateCarree()))
+    ax2.set_title('Spatial Domain')
+    
+    return(fig)
+
+# function to plot the yearly precipitation accumulation over the domain
+def plot_prcp_domain(data_prcp_agg):
+    # experiments of data_prcp_agg, in the order of prcpexps
+    nameexps        = [nameexp for nameexp in prcpexps if nameexp in set(data_prcp_agg['nameexp'])]
+
+
+    unit = 1000
+
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=(5.2, 2.6))
+
+    ax = fig.add_subplot(111)
+
+    for nameexp in nameexps:
+        year, marker_t, colorm, colore, labeltxt = prcpexps[nameexp]
+        data_prcp_exp = data_prcp_agg[data_prcp_agg['nameexp'] == nameexp]
+        if year is not None:
+            data_prcp_exp = data_prcp_exp[data_prcp_exp['year'] == year]
+
+        ax = doplottimeseries(ax, data_prcp_exp.reset_index(drop=True), unit,
+                            marker_t, colorm, colore, labeltxt)
+
+
+    ax.legend(loc="lower right", fontsize=7)
+    ax.set_title('Precipitation accumulation over the domain', fontsize=9)
+    ax.set_ylabel('[mm]', fontsize=9)
+    ax.set_xlabel('year', fontsize=9)
+    ax.tick_params(axis='both', which='major', labelsize=8)
+    ax.grid()
+    
+    return(fig)
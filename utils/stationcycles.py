@@ -0,0 +1,221 @@
+# !/usr/bin/python3
+
+# Presence of the stations at every analysis cycle, written next to the monthly
+# counts of count_nbstation at extraction time:
+#
+#   data/store/station_cycles/namevar=TT/nameexp=DRS1992IC401/year=1992/part-0.parquet
+#
+# One row per station (its ID of utils/stationids.py, sorted by BUCKET like
+# count_nbstation) with the bitmap of the cycles of the year: bit i, most
+# significant bit first, is set when the station is in the statoma file of
+# January 1st 00h + i * TIMESTEP hours. A year of hourly cycles is 1098 bytes per
+# station, so the cycles of any date range are unpacked from the store without
+# going back to the statoma files.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils import datastore
+from utils import registry
+from utils import stationids
+from utils import stationindex
+
+#============================ CONFIGURATION
+#
+keys_station = ['LAT', 'LON', 'ALT']
+
+# number of files kept before they are folded into the bitmaps
+batchsize    = 256
+
+#============================= FUNCTIONS
+#%% function to get the number of cycles of a year
+def ncycles(year, timestep):
+    nhours = (datetime.datetime(year + 1, 1, 1) - datetime.datetime(year, 1, 1)).days * 24
+
+    return(-(-nhours // timestep))
+
+#%% function to get the cycle of a statoma file from its date (YYYYMMDDHH)
+def cycle_of(date_str, year, timestep):
+    date = datetime.datetime.strptime(date_str, "%Y%m%d%H")
+
+    return(int((date - datetime.datetime(year, 1, 1)).total_seconds() // 3600) // timestep)
+
+#%% function to get the first cycle at or after a date (a datetime)
+def first_cycle(date, year, timestep):
+    hours = (date - datetime.datetime(year, 1, 1)).total_seconds() / 3600
+
+    return(min(max(int(np.ceil(hours / timestep)), 0), ncycles(year, timestep)))
+
+#%% function to write the bitmaps of one (variable, experiment, year)
+def write_cycles(presence, namevar, nameexp, year):
+    data = presence.to_frame()
+    data = data.assign(BUCKET=stationindex.bucket_keys(data['LAT'], data['LON']))
+    data = data.sort_values('BUCKET', kind="stable").reset_index(drop=True)
+
+    return(datastore.write_partition("station_cycles", data, namevar=namevar, nameexp=nameexp, year=year))
+
+#%% function to read the stations and their bitmaps (one row of bytes per station) of a region, LON from 0 to 360
+# bounds=None selects every station
+def read_bitmaps(namevar, nameexp, year, bounds=None):
+    filters = dict()
+    if bounds is not None:
+        # only the buckets of the index touching the region are read
+        index             = datastore.query("count_nbstation_index", namevar=namevar, nameexp=nameexp, year=year)
+        inside, outside   = stationindex.bucket_masks(index, bounds)
+        filters['BUCKET'] = index.loc[~outside, 'BUCKET'].tolist()
+
+    data = datastore.query("station_cycles", columns=['STATION'] + keys_station + ['TIMESTEP', 'BITMAP'],
+                           namevar=namevar, nameexp=nameexp, year=year, **filters)
+    if bounds is not None:
+        latmin, latmax, lonmin, lonmax = bounds
+        data = data[data['LAT'].between(latmin, latmax) & data['LON'].between(lonmin, lonmax)].reset_index(drop=True)
+
+    bits = np.frombuffer(b"".join(data['BITMAP']), np.uint8).reshape(len(data), -1) if len(data) else np.zeros((0, 0), np.uint8)
+
+    return(data.drop(columns=['BITMAP']), bits)
+
+#%% function to get the presence of the stations at the cycles from start (included) to end (excluded), two datetimes
+# returns the stations (STATION, LAT, LON, ALT), the dates of the cycles and the presence (one row per station, one column per cycle)
+# the years without bitmaps in the store are skipped
+def query_cycles(namevar, nameexp, start, end, bounds=None):
+    config  = registry.get_registry()
+    blocks  = []
+    for year in range(start.year, end.year + 1):
+        if not config.has_cycles(namevar, nameexp, year):
+            continue
+
+        data, bits = read_bitmaps(namevar, nameexp, year, bounds)
+        if data.empty:
+            continue
+        timestep   = int(data['TIMESTEP'].iloc[0])
+        c0         = first_cycle(start, year, timestep)
+        c1         = first_cycle(end, year, timestep)
+        if c1 <= c0:
+            continue
+
+        # unpack the bytes of the range only
+        presence   = np.unpackbits(bits[:, c0 // 8:-(-c1 // 8)], axis=1)[:, c0 % 8:c0 % 8 + c1 - c0].astype(bool)
+        dates      = pd.Timestamp(year, 1, 1) + pd.to_timedelta(np.arange(c0, c1) * timestep, unit="h")
+        blocks.append((pd.Index(data['STATION']), dates, presence))
+
+    if not blocks:
+        return(pd.DataFrame({'STATION': pd.Series([], dtype='int32'), **{namecol: pd.Series([], dtype='float32') for namecol in keys_station}}),
+               pd.DatetimeIndex([]), np.zeros((0, 0), bool))
+
+    # stations of every year, a station missing from a year is absent at its cycles
+    stations = blocks[0][0]
+    for index, dates, block in blocks[1:]:
+        stations = stations.union(index)
+    presence = np.zeros((len(stations), sum(len(dates) for index, dates, block in blocks)), bool)
+    col      = 0
+    for index, dates, block in blocks:
+        presence[stations.get_indexer(index), col:col + len(dates)] = block
+        col += len(dates)
+
+    data     = stationids.coordinates(stations)[keys_station]
+    data.insert(0, 'STATION', stations.to_numpy(np.int32))
+
+    return(data, pd.DatetimeIndex(np.concatenate([dates for index, dates, block in blocks])), presence)
+
+#%% function to count the stations present at every cycle
+def cycle_counts(dates, presence):
+    return(pd.Series(presence.sum(axis=0), index=dates, name='NSTATION'))
+
+#%% function to describe the presence of every station over the cycles queried
+# first and last cycle present, number of cycles present and longest time between two consecutive presences [hours]
+def station_gaps(stations, dates, presence):
+    gaps    = stations.copy()
+    if not len(dates):
+        return(gaps.assign(NPRESENT=0, FIRST=pd.NaT, LAST=pd.NaT, LONGESTGAP=0.))
+
+    seen    = presence.any(axis=1)
+    hours   = (dates - dates[0]).total_seconds().to_numpy() / 3600
+
+    gaps['NPRESENT'] = presence.sum(axis=1)
+    gaps['FIRST']    = pd.Series(dates[presence.argmax(axis=1)]).where(seen)
+    gaps['LAST']     = pd.Series(dates[presence.shape[1] - 1 - presence[:, ::-1].argmax(axis=1)]).where(seen)
+
+    # consecutive presences of a station: nonzero lists them row by row, in order of the cycles
+    rows, cols = np.nonzero(presence)
+    same       = rows[1:] == rows[:-1]
+    longest    = np.zeros(len(stations))
+    np.maximum.at(longest, rows[1:][same], np.diff(hours[cols])[same])
+    gaps['LONGESTGAP'] = longest
+
+    return(gaps)
+
+#============================= CLASSES
+#%% presence of the stations of one (variable, experiment, year), filled file per file by the extraction
+class Presence:
+    def __init__(self, year, timestep):
+        self.year     = year
+        self.timestep = timestep
+        self.ncycle   = ncycles(year, timestep)
+        # IDs of the stations and their bitmaps, in the same order
+        self.index    = pd.Index(np.array([], np.int32))
+        self.bits     = np.zeros((0, -(-self.ncycle // 8)), np.uint8)
+        self.partials = []
+
+    # function to add the stations (STATION column) of the file of a date (YYYYMMDDHH)
+    def add(self, stations, date_str):
+        cycle = cycle_of(date_str, self.year, self.timestep)
+        if not 0 <= cycle < self.ncycle:
+            return
+        self.partials.append(stations[['STATION']].assign(CYCLE=cycle))
+        if len(self.partials) > batchsize:
+            self.fold()
+
+    # function to set the bits of the files added since the last fold
+    def fold(self):
+        if not self.partials:
+            return
+        batch         = pd.concat(self.partials, axis=0, ignore_index=True)
+        self.partials = []
+
+        keys   = pd.Index(batch['STATION'].to_numpy(np.int32))
+        new    = keys.unique().difference(self.index)
+        if len(new):
+            self.index = self.index.append(new)
+            self.bits  = np.vstack([self.bits, np.zeros((len(new), self.bits.shape[1]), np.uint8)])
+
+        rows   = self.index.get_indexer(keys)
+        cycles = batch['CYCLE'].to_numpy()
+        np.bitwise_or.at(self.bits, (rows, cycles >> 3), (128 >> (cycles & 7)).astype(np.uint8))
+
+    # function to clear the cycles of some months (before they are parsed again)
+    def clear_months(self, months):
+        self.fold()
+        presence = np.unpackbits(self.bits, axis=1)
+        for month in months:
+            start = datetime.datetime(self.year, month, 1)
+            end   = datetime.datetime(self.year + month // 12, month % 12 + 1, 1)
+            presence[:, first_cycle(start, self.year, self.timestep):first_cycle(end, self.year, self.timestep)] = 0
+        self.bits = np.packbits(presence, axis=1)
+
+    # function to replace the provisional IDs of the new stations by their IDs in the dictionary (after stationids.save())
+    def finalize(self):
+        self.fold()
+        self.index = pd.Index(stationids.final(self.index))
+
+    # function to get the stations seen at least once and their bitmaps (one row per station)
+    def to_frame(self):
+        self.fold()
+        seen = self.bits.any(axis=1)
+
+        data = stationids.coordinates(self.index[seen])[keys_station]
+        data.insert(0, 'STATION', self.index[seen].to_numpy(np.int32))
+        data['TIMESTEP'] = self.timestep
+        data['BITMAP']   = pd.Series([row.tobytes() for row in self.bits[seen]], dtype=object)
+
+        return(data)
+
+    # function to start from the bitmaps of the store (read_bitmaps)
+    @classmethod
+    def from_bitmaps(cls, data, bits, year):
+        presence       = cls(year, int(data['TIMESTEP'].iloc[0]))
+        presence.index = pd.Index(data['STATION'].to_numpy(np.int32))
+        presence.bits  = bits.copy()
+
+        return(presence)
@@ -0,0 +1,159 @@
+# !/usr/bin/python3
+
+# Dictionary of the stations of the store, shared by every count table:
+#
+#   data/store/station_ids/part-0.parquet
+#
+# A station is identified by its coordinates normalized as in the count tables
+# (float32, LON from 0 to 360) and gets the next integer ID the first time it is
+# written. The IDs are never changed nor reused, so the tables of any experiment
+# and year are joined, compared and grouped on their int32 STATION column. The ID
+# of a station is also its row in the dictionary: its coordinates and its
+# longitude on the maps (LONMAP, from -180 to 180) are read by position.
+#
+# The dictionary is written by the preprocessing. A station new to a process gets
+# a provisional negative ID (-2, -3, ...) until save() adds every new station at
+# once, under a lock shared by the processes (the extractions run in parallel)
+# after reading the stations added by the others; final() then gives the IDs of
+# the dictionary of the provisional ones.
+
+import os
+import fcntl
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from utils import datastore
+
+#============================ CONFIGURATION
+#
+keys_station = ['LAT', 'LON', 'ALT']
+
+# dictionary of the process: file read, its modification time, the stations and their index by coordinates,
+# the stations with a provisional ID (ID -2 - i for the row i) and their ID in the dictionary (-1 until saved)
+state        = {'namefile': None, 'mtime': None, 'stations': None, 'index': None,
+                'provisional': pd.MultiIndex.from_arrays([[], [], []], names=keys_station), 'final': np.zeros(0, np.int32)}
+
+#============================= FUNCTIONS
+#%% function to get the file of the dictionary of the current store
+def dictionary_file():
+    return(os.path.join(datastore.partition_dir("station_ids"), "part-0.parquet"))
+
+#%% function to normalize the coordinates of stations (LAT, LON, ALT columns) as in the count tables
+def normalize(data):
+    return([np.asarray(data['LAT'], dtype=np.float32),
+            np.mod(np.asarray(data['LON'], dtype=np.float32), np.float32(360)),
+            np.asarray(data['ALT'], dtype=np.float32)])
+
+#%% context manager holding the lock of the dictionary between the processes
+@contextmanager
+def locked():
+    namelock = os.path.join(os.path.dirname(dictionary_file()), ".lock")
+    os.makedirs(os.path.dirname(namelock), exist_ok=True)
+    with open(namelock, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+#%% function to get the dictionary (read again only when the file changes, or always if force)
+def load(force=False):
+    namefile = dictionary_file()
+    mtime    = os.stat(namefile).st_mtime_ns if os.path.isfile(namefile) else None
+    if not force and state['namefile'] == namefile and state['mtime'] == mtime:
+        return(state['stations'])
+
+    if mtime is None:
+        stations = pd.DataFrame({'STATION': pd.Series([], dtype='int32'),
+                                 **{namecol: pd.Series([], dtype='float32') for namecol in keys_station + ['LONMAP']}})
+    else:
+        stations = pq.read_table(namefile).to_pandas()
+
+    if state['namefile'] != namefile:
+        # the provisional IDs belong to the dictionary of another store
+        state.update(provisional=state['provisional'][:0], final=np.zeros(0, np.int32))
+    state.update(namefile=namefile, mtime=mtime, stations=stations,
+                 index=pd.MultiIndex.from_arrays(normalize(stations), names=keys_station))
+
+    return(stations)
+
+#%% function to get the IDs of stations (LAT, LON, ALT columns), -1 for the stations not in the dictionary
+def lookup(data):
+    load()
+
+    return(state['index'].get_indexer(pd.MultiIndex.from_arrays(normalize(data), names=keys_station)).astype(np.int32))
+
+#%% function to get the IDs of stations, the new ones get a provisional ID until save()
+def assign(data):
+    keys     = pd.MultiIndex.from_arrays(normalize(data), names=keys_station)
+    ids      = lookup(data)
+
+    # a station keeps its provisional ID until it is saved, even if another process saved it in the meantime
+    row      = state['provisional'].get_indexer(keys)
+    known    = row >= 0
+    # a station saved to a dictionary rewritten since then is provisional again
+    state['final'][row[known & (ids == -1)]] = -1
+    unsaved  = np.zeros(len(keys), bool)
+    unsaved[known] = state['final'][row[known]] < 0
+    ids      = np.where(unsaved, -2 - row, ids).astype(np.int32)
+
+    if (ids == -1).any():
+        new  = keys[ids == -1].unique()
+        state.update(provisional=state['provisional'].append(new),
+                     final=np.concatenate([state['final'], np.full(len(new), -1, np.int32)]))
+        row  = state['provisional'].get_indexer(keys)
+        ids  = np.where(ids == -1, -2 - row, ids).astype(np.int32)
+
+    return(ids)
+
+#%% function to add the stations with a provisional ID to the dictionary, one write under the lock
+def save():
+    unsaved = np.flatnonzero(state['final'] < 0)
+    if not len(unsaved):
+        return
+
+    with locked():
+        # stations added by the other processes since the dictionary was read
+        stations = load(force=True)
+        keys     = state['provisional'][unsaved]
+        ids      = state['index'].get_indexer(keys).astype(np.int32)
+
+        new      = ids < 0
+        if new.any():
+            added    = keys[new].to_frame(index=False)
+            added.insert(0, 'STATION', np.arange(len(stations), len(stations) + new.sum(), dtype=np.int32))
+            added['LONMAP'] = np.where(added['LON'] > 180, added['LON'] - 360, added['LON']).astype(np.float32)
+            ids[new] = added['STATION'].to_numpy()
+            stations = pd.concat([stations, added], ignore_index=True)
+
+            namefile = dictionary_file()
+            os.makedirs(os.path.dirname(namefile), exist_ok=True)
+            datastore.write_table("station_ids", datastore.to_table("station_ids", stations), namefile)
+            state.update(namefile=namefile, mtime=os.stat(namefile).st_mtime_ns, stations=stations,
+                         index=pd.MultiIndex.from_arrays(normalize(stations), names=keys_station))
+
+        state['final'][unsaved] = ids
+
+#%% function to replace the provisional IDs by the IDs of the dictionary (after save)
+def final(ids):
+    ids     = np.asarray(ids, dtype=np.int32)
+    mapped  = ids.copy()
+    mask    = ids <= -2
+    mapped[mask] = state['final'][-2 - ids[mask]]
+    if (mapped < 0).any():
+        raise ValueError("stations with a provisional ID not saved yet, call stationids.save() first")
+
+    return(mapped)
+
+#%% function to get the coordinates of stations from their IDs (LAT, LON, ALT, LONMAP)
+def coordinates(ids):
+    stations = load()
+
+    return(stations.iloc[np.asarray(ids)][keys_station + ['LONMAP']].reset_index(drop=True))
+
+#%% function to get the longitude on the maps (from -180 to 180) of stations from their IDs
+def map_lon(ids):
+    return(load()['LONMAP'].to_numpy()[np.asarray(ids)])
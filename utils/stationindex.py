@@ -0,0 +1,90 @@
+# !/usr/bin/python3
+
+# Spatial index of the stations of the count_nbstation partitions, written next to
+# them at extraction time:
+#
+#   data/store/count_nbstation_index/namevar=SD/nameexp=DRS1992IC401/year=1992/part-0.parquet
+#
+# The stations are grouped by buckets of bucketsize degrees (BUCKET column, the
+# rows of a partition are sorted by it). The index has one row per bucket with the
+# extent of its stations and the sums of their monthly counts, so the monthly
+# cycle of a region is summed from the index for the buckets inside the region,
+# and only the stations of the buckets crossing its border are read.
+
+import numpy as np
+
+from utils import datastore
+from utils import stationids
+
+#============================ CONFIGURATION
+#
+bucketsize   = 1.0
+month_names  = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+#============================= FUNCTIONS
+#%% function to get the bucket of stations (LON from 0 to 360)
+def bucket_keys(lat, lon):
+    nlonbucket = int(np.ceil(360 / bucketsize))
+
+    return(np.floor((np.asarray(lat) + 90) / bucketsize).astype(np.int32) * nlonbucket
+           + np.floor(np.mod(lon, 360) / bucketsize).astype(np.int32) % nlonbucket)
+
+#%% function to sort the stations of a count partition by bucket and build its index
+def build_index(data):
+    data  = data.assign(BUCKET=bucket_keys(data['LAT'], data['LON']))
+    data  = data.sort_values('BUCKET', kind="stable").reset_index(drop=True)
+
+    index = data.groupby('BUCKET').agg(LATMIN=('LAT', 'min'), LATMAX=('LAT', 'max'),
+                                       LONMIN=('LON', 'min'), LONMAX=('LON', 'max'),
+                                       NSTATION=('LAT', 'size'),
+                                       **{namecol: (namecol, 'sum') for namecol in month_names + ['Total']})
+
+    return(data, index.reset_index())
+
+#%% function to write a count partition and its index
+# the stations get their ID from their coordinates (new stations are added to the dictionary)
+def write_counts(data, namevar, nameexp, year):
+    ids         = stationids.assign(data)
+    stationids.save()
+    data        = data.assign(STATION=stationids.final(ids))
+    data, index = build_index(data)
+
+    datastore.write_partition("count_nbstation_index", index, namevar=namevar, nameexp=nameexp, year=year)
+    dirpart     = datastore.write_partition("count_nbstation", data, namevar=namevar, nameexp=nameexp, year=year)
+
+    return(dirpart)
+
+#%% function to get the buckets of an index inside a region (latmin, latmax, lonmin, lonmax) and outside of it
+# (the others cross its border)
+def bucket_masks(index, bounds):
+    latmin, latmax, lonmin, lonmax = bounds
+    inside  = ((index['LATMIN'] >= latmin) & (index['LATMAX'] <= latmax)
+               & (index['LONMIN'] >= lonmin) & (index['LONMAX'] <= lonmax))
+    outside = ((index['LATMAX'] < latmin) | (index['LATMIN'] > latmax)
+               | (index['LONMAX'] < lonmin) | (index['LONMIN'] > lonmax))
+
+    return(inside, outside)
+
+#%% function to get the stations and the monthly cycle of a region (latmin, latmax, lonmin, lonmax), LON from 0 to 360
+# bounds=None selects every station
+def query_region(namevar, nameexp, year, bounds=None):
+    index  = datastore.query("count_nbstation_index", namevar=namevar, nameexp=nameexp, year=year)
+
+    if bounds is None:
+        data  = datastore.query("count_nbstation", namevar=namevar, nameexp=nameexp, year=year)
+        return(data, index[month_names].sum(axis=0))
+
+    latmin, latmax, lonmin, lonmax = bounds
+    inside, outside = bucket_masks(index, bounds)
+    border  = ~inside & ~outside
+
+    # read the stations of the buckets touching the region only
+    data    = datastore.query("count_nbstation", namevar=namevar, nameexp=nameexp, year=year,
+                              BUCKET=index.loc[~outside, 'BUCKET'].tolist())
+    data    = data[data['LAT'].between(latmin, latmax) & data['LON'].between(lonmin, lonmax)].reset_index(drop=True)
+
+    # monthly cycle: sums of the buckets inside, stations of the buckets on the border
+    month_sum = (index.loc[inside, month_names].sum(axis=0)
+                 + data.loc[data['BUCKET'].isin(index.loc[border, 'BUCKET']), month_names].sum(axis=0))
+
+    return(data, month_sum)
@@ -0,0 +1,61 @@
+# !/usr/bin/python3
+
+# Folium layer drawing all the assimilated stations at once.
+#
+# Instead of one folium.Circle (one Python object and one JavaScript snippet) per
+# station, the coordinates and colors are sent as a single array and the circles
+# are created in the browser on a canvas renderer.
+
+import numpy as np
+from jinja2 import Template
+from folium.map import Layer
+from folium.vector_layers import path_options
+
+#============================ CONSTANTS
+#
+hexdigits = np.array([f"{i:02x}" for i in range(256)])
+
+#============================= FUNCTIONS
+#%% function to get the colors of all the values at once ("#rrggbb", same as colormap.rgb_hex_str)
+def station_colors(values, colormap):
+    index  = np.asarray(colormap.index, dtype=float)
+    colors = np.asarray(colormap.colors, dtype=float)
+
+    # linear interpolation between the colors of the colormap, clipped at both ends
+    rgb    = np.stack([np.interp(values, index, colors[:, j]) for j in range(3)], axis=1)
+    rgb    = (rgb * 255.9999).astype(int)
+
+    codes  = hexdigits[rgb]
+    colors = np.char.add(np.char.add(np.char.add("#", codes[:, 0]), codes[:, 1]), codes[:, 2])
+
+    return(colors)
+
+#============================= CLASSES
+#%% layer of circles, one per station, colored by value
+class StationLayer(Layer):
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.featureGroup();
+            (function() {
+                var renderer = L.canvas();
+                var options  = {{ this.options|tojson }};
+                var stations = {{ this.stations|tojson }};
+                for (var i = 0; i < stations.length; i++) {
+                    var station = stations[i];
+                    L.circle([station[0], station[1]], Object.assign({}, options,
+                        {renderer: renderer, color: station[2], fillColor: station[2]})
+                    ).addTo({{ this.get_name() }});
+                }
+            })();
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, lat, lon, values, colormap, radius=30, name=None, overlay=True, control=True,
+                 show=True, **kwargs):
+        super(StationLayer, self).__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name    = 'StationLayer'
+
+        colors        = station_colors(np.asarray(values, dtype=float), colormap)
+        self.stations = [[float(la), float(lo), str(co)] for la, lo, co in zip(lat, lon, colors)]
+        self.options  = path_options(line=False, radius=radius, **kwargs)
@@ -0,0 +1,163 @@
+# !/usr/bin/python3
+
+# Map and figure of the stations page (01_stations_assimilated.py), kept out of
+# the page so that they can be built without Streamlit.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from utils import stationids
+from utils import stationindex
+
+#============================ CONSTANTS
+#
+month_names  = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+#============================= FUNCTIONS
+#%% MAP
+# function to build the map of the stations colored by their number of assimilated cases
+# (longitudes of the map, from -180 to 180, from the dictionary of the stations)
+def build_station_map(data_var):
+    import branca.colormap as cm
+    import folium
+    from utils import stationmap
+
+    colormap = cm.LinearColormap(colors=['magenta', 'green', 'red'], vmin=0, vmax=365)
+
+    m        = folium.Map(location=[45.5, -93.56], zoom_start=2.4)    
+    stationmap.StationLayer(data_var["LAT"], stationids.map_lon(data_var["STATION"]), data_var['Total'], colormap,
+                            fill=True, fill_opacity=0.2, radius=30, name="Stations").add_to(m)
+
+    m.add_child(colormap)
+    folium.map.LayerControl('topleft', collapsed= False).add_to(m)
+    
+    return(m)
+
+#%% function to get the region (latmin, latmax, lonmin, lonmax), LON from 0 to 360, of the view returned by st_folium
+# (None, every station, before the first view or when the view goes around the globe)
+def view_bounds(view):
+    if not view or not view.get("bounds") or not view["bounds"].get("_southWest"):
+        return(None)
+
+    southwest = view["bounds"]["_southWest"]
+    northeast = view["bounds"]["_northEast"]
+    lonmin    = southwest["lng"] % 360
+    lonmax    = northeast["lng"] % 360
+    if northeast["lng"] - southwest["lng"] >= 360 or lonmin > lonmax:
+        return(None)
+
+    return((southwest["lat"], northeast["lat"], lonmin, lonmax))
+
+#%% PLOT
+# function to plot the annual cycle of the number of assimilated stations
+def plot_annual_cycle(monthval, year_to_look, option):
+    # Create the x-axis values (months) and the corresponding y-axis values (sums)
+    x_values = range(1, 13)  # Month numbers from 1 to 12
+    y_values = monthval.tolist()  # Convert the Series to a list
+
+    month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    # Create the plot
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import ScalarFormatter
+    fig = plt.figure(figsize=(5.2, 2.6))
+
+    ax = fig.add_subplot(111)
+
+    ax.plot(x_values, y_values, marker='o', linestyle='-', color='m', markersize=4)
+
+    ax.set_title(f"Annual Time Series - {year_to_look} - {option}", fontsize=7)
+    ax.set_xlabel('Month', fontsize=7)
+    ax.set_xticks(x_values, month_names)  # Label the x-axis with month names
+    ax.set_ylabel('# assimilated cases', fontsize=7)
+    ax.tick_params(axis='both', which='major', labelsize=7)
+    ax.grid(True)
+
+    # Use ScalarFormatter to format the x-axis tick labels
+    ax.xaxis.set_major_formatter(ScalarFormatter())
+    
+    return(fig)
+
+# function to plot the number of stations present at every analysis cycle of a date range
+def plot_cycles(counts, option):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(10.4, 2.6))
+    ax  = fig.add_subplot(111)
+
+    ax.plot(counts.index, counts.values, linestyle='-', color='m', linewidth=0.8)
+
+    ax.set_title(f"Stations per analysis cycle - {counts.index[0]:%Y-%m-%d} to {counts.index[-1]:%Y-%m-%d} - {option}", fontsize=7)
+    ax.set_ylabel('# stations', fontsize=7)
+    ax.tick_params(axis='both', which='major', labelsize=7)
+    ax.grid(True)
+    fig.autofmt_xdate()
+
+    return(fig)
+
+#%% COMPARISON
+# function to load the stations of several (nameexp, year) at once, one thread per read
+# returns one (data, month_sum) per combination, in the order of combos
+def load_combinations(namevar, combos, bounds=None, workers=8):
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(combos)))) as pool:
+        results = list(pool.map(lambda combo: stationindex.query_region(namevar, combo[0], combo[1], bounds), combos))
+
+    return(results)
+
+# function to align the totals of the stations of several combinations (join on the station IDs)
+# one column per label, NaN where a station is missing from a combination
+def align_stations(datas, labels):
+    aligned = None
+    for data, label in zip(datas, labels):
+        total   = data.groupby('STATION')['Total'].sum().astype('int64').rename(label)
+        aligned = total.to_frame() if aligned is None else aligned.join(total, how="outer")
+
+    return(aligned.reset_index())
+
+# function to summarize the combinations against the first one (the reference)
+def comparison_summary(aligned, labels):
+    reference = aligned[labels[0]]
+    rows      = []
+    for label in labels:
+        common = aligned[label].notna() & reference.notna()
+        rows.append({'': label, 'stations': int(aligned[label].notna().sum()),
+                     'common with reference': int(common.sum()),
+                     'not in reference': int((aligned[label].notna() & reference.isna()).sum()),
+                     'assimilated cases': int(aligned[label].sum()),
+                     'mean difference per station': (aligned.loc[common, label] - reference[common]).mean()})
+
+    return(pd.DataFrame(rows).set_index(''))
+
+# function to plot the annual cycles of the combinations next to the differences per station with the reference
+def plot_comparison(month_sums, aligned, labels, namevar):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(10.4, 2.6))
+
+    ax1 = fig.add_subplot(121)
+    for month_sum, label in zip(month_sums, labels):
+        ax1.plot(range(1, 13), month_sum[month_names].tolist(), marker='o', linestyle='-', markersize=4, label=label)
+
+    ax1.set_title(f"Annual Time Series - {namevar}", fontsize=7)
+    ax1.set_xlabel('Month', fontsize=7)
+    ax1.set_xticks(range(1, 13), month_names)
+    ax1.set_ylabel('# assimilated cases', fontsize=7)
+    ax1.tick_params(axis='both', which='major', labelsize=7)
+    ax1.legend(fontsize=6)
+    ax1.grid(True)
+
+    # per station: total of the combination - total of the reference, over the common stations
+    ax2 = fig.add_subplot(122)
+    reference   = aligned[labels[0]]
+    differences = [(aligned[label] - reference).dropna().values for label in labels[1:]]
+    ax2.boxplot(differences, showfliers=False)
+    ax2.set_xticks(range(1, len(labels)), labels[1:], rotation=15)
+    ax2.axhline(0, color='grey', linewidth=0.8)
+
+    ax2.set_title(f"Difference per station with {labels[0]}", fontsize=7)
+    ax2.set_ylabel('# assimilated cases', fontsize=7)
+    ax2.tick_params(axis='both', which='major', labelsize=7)
+    ax2.grid(True, axis='y')
+
+    return(fig)
+